@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+操作记录内存基准：对比旧的每行dict结构与RowOperation的每行字节数
+
+用法: python benchmarks/bench_operations_memory.py [行数]
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from binlog_tool_rollback import new_row_operation  # noqa: E402
+
+COLUMNS = (1, 2, 3, 4, 5, 6, 7, 8)
+
+def sample_row(n):
+    """
+    一行典型的订单数据（SQL字面量），每行的值各不相同
+    """
+    return [str(n), str(100000 + n % 5000), f"'ORD{n:010d}'", str(n % 7), f"{n % 10000}.{n % 100:02d}",
+            "'2025-11-17 10:10:57'", 'NULL' if n % 3 else f"'备注{n}'", str(n % 2)]
+
+def legacy_deletes(rows):
+    """
+    旧结构：每行一个dict，值列表，每行各自保存库名和表名
+    """
+    operations = []
+    for n in range(rows):
+        # 旧解析器每行都从Table_map正则的group得到新的库名/表名字符串
+        operations.append({
+            'type': 'DELETE',
+            'database': ''.join(['sh', 'op']),
+            'table': ''.join(['ord', 'ers']),
+            'values': sample_row(n),
+        })
+    return operations
+
+def compact_deletes(rows):
+    operations = []
+    for n in range(rows):
+        operations.append(new_row_operation('DELETE', ''.join(['sh', 'op']), ''.join(['ord', 'ers']),
+                                            COLUMNS, sample_row(n)))
+    return operations
+
+def legacy_updates(rows):
+    operations = []
+    for n in range(rows):
+        operations.append({
+            'type': 'UPDATE',
+            'database': ''.join(['sh', 'op']),
+            'table': ''.join(['ord', 'ers']),
+            'old_values': dict(zip(COLUMNS, sample_row(n))),
+            'new_values': dict(zip(COLUMNS, sample_row(n + 1))),
+        })
+    return operations
+
+def compact_updates(rows):
+    operations = []
+    for n in range(rows):
+        operations.append(new_row_operation('UPDATE', ''.join(['sh', 'op']), ''.join(['ord', 'ers']),
+                                            COLUMNS, sample_row(n), COLUMNS, sample_row(n + 1)))
+    return operations
+
+def measure(build, rows):
+    """
+    返回build(rows)的结果常驻内存的每行字节数
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    operations = build(rows)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del operations
+    return used / rows
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print(f"{rows} 行, 每行 {len(COLUMNS)} 列")
+    print(f"{'操作':<8} {'旧结构 B/行':>14} {'RowOperation B/行':>20} {'节省':>8}")
+    for name, legacy, compact in (('DELETE', legacy_deletes, compact_deletes),
+                                  ('UPDATE', legacy_updates, compact_updates)):
+        old = measure(legacy, rows)
+        new = measure(compact, rows)
+        print(f"{name:<8} {old:>14.1f} {new:>20.1f} {(1 - new / old) * 100:>7.1f}%")
+
+if __name__ == "__main__":
+    main()
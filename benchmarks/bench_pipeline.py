@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+解析流水线基准：在合成负载上测量analyze、extract各闪回模式和SQL生成的吞吐
+
+每个场景在独立的子进程中运行，峰值RSS互不影响。结果写入JSON，
+用--compare与另一个版本的结果对比。文本场景读取生成的mysqlbinlog文本，
+不调用mysqlbinlog本身，测量的是本工具的解析开销。
+
+用法:
+  python benchmarks/bench_pipeline.py --rows 200000 -o bench.json
+  python benchmarks/bench_pipeline.py --rows 200000 -o new.json --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import binlog_tool_rollback as tool  # noqa: E402
+from binlog_workload import add_workload_arguments, generate_workload  # noqa: E402
+
+FLASHBACK_MODES = ('deletes', 'updates', 'inserts')
+SCENARIOS = (['analyze-text', 'analyze-native'] +
+             [f"extract-{source}-{mode}" for source in ('text', 'native') for mode in FLASHBACK_MODES] +
+             [f"sqlgen-{mode}" for mode in FLASHBACK_MODES])
+
+def read_text_lines(text_path):
+    """
+    与iter_mysqlbinlog_lines一样逐行产出（不带换行符）
+    """
+    with open(text_path, encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS上ru_maxrss的单位是字节
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def run_scenario(name, binlog_path, text_path):
+    """
+    在当前进程中运行一个场景，返回测量结果
+    """
+    tool.set_verbose_level(tool.VERBOSE_QUIET)
+    result = {'lines': None, 'rows': 0, 'statements': None}
+    # analyze-来源、extract-来源-模式、sqlgen-模式
+    kind, _, rest = name.partition('-')
+    source, _, mode = rest.partition('-') if kind != 'sqlgen' else ('native', '', rest)
+    if kind == 'sqlgen':
+        # 解析不计入耗时，只测SQL生成
+        operations = list(tool.iter_native_operations(binlog_path, flashback_mode=mode))
+        result['rows'] = len(operations)
+        result['input_bytes'] = os.path.getsize(binlog_path)
+        started = time.perf_counter()
+        statements = 0
+        output_bytes = 0
+        for sql in tool.generate_recovery_sql(operations, mode):
+            statements += 1
+            output_bytes += len(sql)
+        result['wall_seconds'] = time.perf_counter() - started
+        result['statements'] = statements
+        result['output_bytes'] = output_bytes
+    else:
+        result['input_bytes'] = os.path.getsize(text_path if source == 'text' else binlog_path)
+        started = time.perf_counter()
+        if kind == 'analyze':
+            if source == 'text':
+                stats = tool.collect_binlog_stats(read_text_lines(text_path))
+            else:
+                stats = tool.collect_native_binlog_stats(binlog_path)
+            result['rows'] = sum(data['inserts'] + data['updates'] + data['deletes'] for data in stats.values())
+        else:
+            filter_stats = tool.new_filter_stats()
+            if source == 'text':
+                operations = tool.iter_content_operations(read_text_lines(text_path), flashback_mode=mode,
+                                                          filter_stats=filter_stats)
+            else:
+                operations = tool.iter_native_operations(binlog_path, flashback_mode=mode, filter_stats=filter_stats)
+            for _ in operations:
+                result['rows'] += 1
+            if source == 'text':
+                result['lines'] = filter_stats['lines']
+        result['wall_seconds'] = time.perf_counter() - started
+    if kind == 'analyze' and source == 'text':
+        with open(text_path, encoding='utf-8') as f:
+            result['lines'] = sum(1 for _ in f)
+    seconds = result['wall_seconds'] or 1e-9
+    result['rows_per_sec'] = result['rows'] / seconds
+    result['lines_per_sec'] = result['lines'] / seconds if result['lines'] is not None else None
+    result['mb_per_sec'] = result['input_bytes'] / seconds / (1024 * 1024)
+    result['peak_rss_kb'] = peak_rss_kb()
+    return result
+
+def run_isolated(name, binlog_path, text_path):
+    """
+    在子进程中运行场景，峰值RSS只包含该场景
+    """
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-scenario', name,
+                             '--binlog', binlog_path, '--text', text_path],
+                            check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(BENCH_DIR),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def format_rate(value):
+    return '-' if value is None else f"{value:,.0f}"
+
+def print_results(results):
+    print(f"{'场景':<24} {'耗时(s)':>9} {'行/秒':>12} {'文本行/秒':>12} {'MB/秒':>8} {'峰值RSS(MB)':>12}")
+    for name, result in results.items():
+        print(f"{name:<24} {result['wall_seconds']:>9.3f} {format_rate(result['rows_per_sec']):>12} "
+              f"{format_rate(result['lines_per_sec']):>12} {result['mb_per_sec']:>8.1f} "
+              f"{result['peak_rss_kb'] / 1024:>12.1f}")
+
+def print_comparison(baseline, report):
+    """
+    与基准结果对比耗时和峰值RSS，负数表示变快/变小
+    """
+    if baseline.get('workload') != report['workload']:
+        print("警告: 两次结果的负载参数不同，对比仅供参考")
+    print(f"\n对比 {baseline.get('revision') or '?'} -> {report.get('revision') or '?'}")
+    print(f"{'场景':<24} {'耗时变化':>10} {'峰值RSS变化':>12}")
+    for name, result in report['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            continue
+        wall = (result['wall_seconds'] / old['wall_seconds'] - 1) * 100 if old['wall_seconds'] else 0
+        rss = (result['peak_rss_kb'] / old['peak_rss_kb'] - 1) * 100 if old['peak_rss_kb'] else 0
+        print(f"{name:<24} {wall:>+9.1f}% {rss:>+11.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description='解析流水线基准')
+    add_workload_arguments(parser)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='只运行指定场景（可重复）')
+    parser.add_argument('--workdir', help='负载文件目录（默认: 临时目录，结束后删除）')
+    parser.add_argument('--output', '-o', help='结果JSON文件')
+    parser.add_argument('--compare', help='与之对比的结果JSON文件')
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--binlog', help=argparse.SUPPRESS)
+    parser.add_argument('--text', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        json.dump(run_scenario(args.run_scenario, args.binlog, args.text), sys.stdout)
+        return
+
+    with tempfile.TemporaryDirectory(prefix='binlog-bench-') as tmp_dir:
+        workdir = args.workdir or tmp_dir
+        started = time.perf_counter()
+        workload = generate_workload(workdir, args)
+        counts = workload['counts']
+        print(f"负载: {counts['rows']} 行 (INSERT {counts['INSERT']}, UPDATE {counts['UPDATE']}, "
+              f"DELETE {counts['DELETE']}), {counts['transactions']} 个事务, "
+              f"binlog {os.path.getsize(workload['binlog']) / (1024 * 1024):.1f} MB, 文本 {counts['text_lines']} 行, "
+              f"生成耗时 {time.perf_counter() - started:.1f}s")
+
+        results = {}
+        for name in args.scenario or SCENARIOS:
+            results[name] = run_isolated(name, workload['binlog'], workload['text'])
+            print(f"  {name}: {results[name]['wall_seconds']:.3f}s")
+
+    report = {
+        'revision': git_revision(),
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'workload': workload['workload'],
+        'counts': counts,
+        'results': results,
+    }
+    print()
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
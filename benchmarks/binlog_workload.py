@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+合成binlog负载：同时生成二进制binlog（v4，ROW格式）和对应的mysqlbinlog -v/-vv文本
+
+两个文件描述同一组事件，文本中的位置与二进制文件一致，可以分别用于原生解析和文本解析的基准。
+
+用法: python benchmarks/binlog_workload.py 输出目录 [--tables N] [--columns N] [--rows N] ...
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from binlog_tool_rollback import (  # noqa: E402
+    BINLOG_MAGIC, DELETE_ROWS_EVENT, EVENT_HEADER, EVENT_HEADER_LEN, FORMAT_DESCRIPTION_EVENT,
+    MYSQL_TYPE_DOUBLE, MYSQL_TYPE_LONG, MYSQL_TYPE_LONGLONG, MYSQL_TYPE_VARCHAR, QUERY_EVENT,
+    TABLE_MAP_COLUMN_NAME, TABLE_MAP_EVENT, TABLE_MAP_SIMPLE_PRIMARY_KEY, UPDATE_ROWS_EVENT,
+    WRITE_ROWS_EVENT, XID_EVENT,
+)
+
+SERVER_VERSION = '8.0.36-bench'
+SERVER_ID = 1
+DATABASE = 'bench'
+# 2025-11-17 10:00:00（本地时间），每个事务推进一秒
+START_TIME = time.mktime((2025, 11, 17, 10, 0, 0, 0, 0, -1))
+TABLE_ID_BASE = 100
+
+# 第1列是INT主键，其余列按此顺序循环
+COLUMN_CYCLE = (MYSQL_TYPE_LONGLONG, MYSQL_TYPE_VARCHAR, MYSQL_TYPE_DOUBLE, MYSQL_TYPE_LONG)
+# mysqlbinlog -vv注释中的类型名
+VV_TYPE_NAMES = {MYSQL_TYPE_LONG: 'INT', MYSQL_TYPE_LONGLONG: 'LONGINT', MYSQL_TYPE_DOUBLE: 'DOUBLE'}
+SQL_TYPE_NAMES = {MYSQL_TYPE_LONG: 'INT', MYSQL_TYPE_LONGLONG: 'BIGINT', MYSQL_TYPE_DOUBLE: 'DOUBLE'}
+
+ROWS_EVENT_NAMES = {
+    'INSERT': (WRITE_ROWS_EVENT, 'Write_rows', 'INSERT INTO', None, 'SET'),
+    'UPDATE': (UPDATE_ROWS_EVENT, 'Update_rows', 'UPDATE', 'WHERE', 'SET'),
+    'DELETE': (DELETE_ROWS_EVENT, 'Delete_rows', 'DELETE FROM', 'WHERE', None),
+}
+
+ASCII_WORDS = ('alpha', 'bravo', 'delta', 'gamma', 'kilo', 'lima', 'oscar', 'sierra', 'tango', 'zulu')
+MULTIBYTE_WORDS = ('订单', '用户', '支付', '库存', '物流', '退款', '备注', '地址', 'データ', '한국')
+
+def packed_int(value):
+    """
+    长度编码整数
+    """
+    if value < 251:
+        return bytes([value])
+    if value < 1 << 16:
+        return b'\xfc' + value.to_bytes(2, 'little')
+    if value < 1 << 24:
+        return b'\xfd' + value.to_bytes(3, 'little')
+    return b'\xfe' + value.to_bytes(8, 'little')
+
+def bitmap(bits):
+    """
+    按位序（低位在前）打包的位图
+    """
+    data = bytearray((len(bits) + 7) // 8)
+    for i, bit in enumerate(bits):
+        if bit:
+            data[i >> 3] |= 1 << (i & 7)
+    return bytes(data)
+
+class WorkloadTable:
+    """
+    一张合成表：列类型、VARCHAR长度和当前存在的主键
+    """
+
+    def __init__(self, number, columns, string_bytes):
+        self.table_id = TABLE_ID_BASE + number
+        self.name = f"t{number:03d}"
+        self.column_types = [MYSQL_TYPE_LONG] + [COLUMN_CYCLE[i % len(COLUMN_CYCLE)] for i in range(columns - 1)]
+        self.column_names = ['id'] + [f"c{i}" for i in range(1, columns)]
+        # VARCHAR元数据是最大字节数，超过255时长度前缀为2字节
+        self.string_meta = max(string_bytes, 64)
+        self.live_ids = []
+        self.next_id = 1
+
+    def create_sql(self):
+        definitions = ['`id` INT NOT NULL']
+        for name, column_type in zip(self.column_names[1:], self.column_types[1:]):
+            if column_type == MYSQL_TYPE_VARCHAR:
+                definitions.append(f"`{name}` VARCHAR({self.string_meta // 4}) DEFAULT NULL")
+            else:
+                definitions.append(f"`{name}` {SQL_TYPE_NAMES[column_type]} DEFAULT NULL")
+        definitions.append('PRIMARY KEY (`id`)')
+        return f"CREATE TABLE `{self.name}` ({', '.join(definitions)}) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+
+    def table_map_body(self):
+        name = self.name.encode()
+        meta = bytearray()
+        for column_type in self.column_types:
+            if column_type == MYSQL_TYPE_VARCHAR:
+                meta += self.string_meta.to_bytes(2, 'little')
+            elif column_type == MYSQL_TYPE_DOUBLE:
+                meta.append(8)
+        names = b''.join(packed_int(len(n)) + n.encode() for n in self.column_names)
+        body = (self.table_id.to_bytes(6, 'little') + b'\x01\x00' +
+                bytes([len(DATABASE)]) + DATABASE.encode() + b'\0' + bytes([len(name)]) + name + b'\0' +
+                packed_int(len(self.column_types)) + bytes(self.column_types) +
+                packed_int(len(meta)) + bytes(meta) +
+                bitmap([i > 0 for i in range(len(self.column_types))]))
+        body += bytes([TABLE_MAP_COLUMN_NAME]) + packed_int(len(names)) + names
+        body += bytes([TABLE_MAP_SIMPLE_PRIMARY_KEY]) + packed_int(1) + packed_int(0)
+        return body
+
+class WorkloadGenerator:
+    """
+    按配置生成事务，同时写二进制binlog和mysqlbinlog文本
+    """
+
+    def __init__(self, tables=4, columns=8, mix=(50, 30, 20), rows_per_event=10, events_per_txn=2,
+                 long_string_bytes=0, multibyte=False, null_ratio=0.1, seed=1):
+        self.random = random.Random(seed)
+        self.string_bytes = long_string_bytes or 24
+        self.tables = [WorkloadTable(n, max(columns, 2), self.string_bytes) for n in range(1, tables + 1)]
+        self.mix = mix
+        self.rows_per_event = rows_per_event
+        self.events_per_txn = events_per_txn
+        self.words = MULTIBYTE_WORDS if multibyte else ASCII_WORDS
+        self.null_ratio = null_ratio
+        self.timestamp = int(START_TIME)
+        self.xid = 0
+        self.counts = {'INSERT': 0, 'UPDATE': 0, 'DELETE': 0, 'events': 0, 'transactions': 0, 'text_lines': 0}
+
+    # -- 数据 --
+
+    def string_value(self, row_id):
+        parts = []
+        size = 0
+        n = row_id
+        while size < self.string_bytes:
+            word = self.words[n % len(self.words)]
+            parts.append(word)
+            size += len(word.encode('utf-8')) + 1
+            n = n * 7 + 3
+        text = ' '.join(parts).encode('utf-8')[:self.string_bytes]
+        # 截断不能落在多字节字符中间
+        return text.decode('utf-8', errors='ignore')
+
+    def make_row(self, table, row_id, version=0):
+        row = [row_id]
+        for i, column_type in enumerate(table.column_types[1:], 1):
+            if self.random.random() < self.null_ratio:
+                row.append(None)
+            elif column_type == MYSQL_TYPE_VARCHAR:
+                row.append(self.string_value(row_id + version + i))
+            elif column_type == MYSQL_TYPE_DOUBLE:
+                row.append((row_id * 31 + version) % 100000 / 4)
+            elif column_type == MYSQL_TYPE_LONGLONG:
+                row.append(row_id * 1000003 + version)
+            else:
+                row.append((row_id + version * 17 + i) % 2147483647)
+        return row
+
+    def encode_row(self, table, row):
+        data = bytearray(bitmap([value is None for value in row]))
+        for column_type, value in zip(table.column_types, row):
+            if value is None:
+                continue
+            if column_type == MYSQL_TYPE_LONG:
+                data += struct.pack('<i', value)
+            elif column_type == MYSQL_TYPE_LONGLONG:
+                data += struct.pack('<q', value)
+            elif column_type == MYSQL_TYPE_DOUBLE:
+                data += struct.pack('<d', value)
+            else:
+                raw = value.encode('utf-8')
+                data += len(raw).to_bytes(1 if table.string_meta < 256 else 2, 'little') + raw
+        return bytes(data)
+
+    def format_value(self, table, column, value, vv):
+        column_type = table.column_types[column]
+        if value is None:
+            text = 'NULL'
+        elif column_type == MYSQL_TYPE_VARCHAR:
+            text = f"'{value}'"
+        else:
+            text = repr(value) if column_type == MYSQL_TYPE_DOUBLE else str(value)
+        if not vv:
+            return text
+        if column_type == MYSQL_TYPE_VARCHAR:
+            type_name = f"VARSTRING({table.string_meta})"
+            meta = table.string_meta
+        else:
+            type_name = VV_TYPE_NAMES[column_type]
+            meta = 8 if column_type == MYSQL_TYPE_DOUBLE else 0
+        return f"{text} /* {type_name} meta={meta} nullable={int(column > 0)} is_null={int(value is None)} */"
+
+    # -- 事件 --
+
+    def choose_kind(self, table):
+        if not table.live_ids:
+            return 'INSERT'
+        return self.random.choices(('INSERT', 'UPDATE', 'DELETE'), self.mix)[0]
+
+    def rows_event(self, table, kind, count):
+        """
+        返回(事件类型, 事件名, 行事件体, 文本行列表, 行数)
+        """
+        event_type, event_name, verb, before_label, after_label = ROWS_EVENT_NAMES[kind]
+        column_count = len(table.column_types)
+        present = bitmap([True] * column_count)
+        body = bytearray(table.table_id.to_bytes(6, 'little') + b'\x01\x00' + b'\x02\x00' +
+                         packed_int(column_count) + present)
+        if kind == 'UPDATE':
+            body += present
+        text = []
+        generated = 0
+        for _ in range(count):
+            if kind == 'INSERT':
+                row_id = table.next_id
+                table.next_id += 1
+                table.live_ids.append(row_id)
+                images = [self.make_row(table, row_id)]
+            elif kind == 'UPDATE':
+                row_id = self.random.choice(table.live_ids)
+                before = self.make_row(table, row_id)
+                images = [before, self.make_row(table, row_id, version=1)]
+            else:
+                index = self.random.randrange(len(table.live_ids))
+                table.live_ids[index], table.live_ids[-1] = table.live_ids[-1], table.live_ids[index]
+                row_id = table.live_ids.pop()
+                images = [self.make_row(table, row_id)]
+            for image in images:
+                body += self.encode_row(table, image)
+            text.append(f"### {verb} `{DATABASE}`.`{table.name}`")
+            labels = [label for label in (before_label, after_label) if label]
+            for label, image in zip(labels, images):
+                text.append(f"### {label}")
+                for column, value in enumerate(image):
+                    text.append(f"###   @{column + 1}={self.format_value(table, column, value, self.vv)}")
+            self.counts[kind] += 1
+            generated += 1
+            if not table.live_ids and kind != 'INSERT':
+                break
+        return event_type, event_name, bytes(body), text, generated
+
+    def write_event(self, event_type, body, header_suffix, lines):
+        """
+        写一个事件：二进制事件和"# at"/事件头/事件内容文本行
+        """
+        size = EVENT_HEADER_LEN + len(body)
+        end_pos = self.position + size
+        self.binlog.write(EVENT_HEADER.pack(self.timestamp, event_type, SERVER_ID, size, end_pos, 0) + body)
+        stamp = time.strftime('%y%m%d %H:%M:%S', time.localtime(self.timestamp))
+        self.text_lines([f"# at {self.position}",
+                         f"#{stamp} server id {SERVER_ID}  end_log_pos {end_pos} \t{header_suffix}"] + lines)
+        self.position = end_pos
+        self.counts['events'] += 1
+
+    def text_lines(self, lines):
+        self.text.write('\n'.join(lines) + '\n')
+        self.counts['text_lines'] += len(lines)
+
+    def query_event(self, sql, database=''):
+        body = (struct.pack('<IIB', 8, 0, len(database)) + b'\0\0' + b'\0\0' + database.encode() + b'\0' +
+                sql.encode('utf-8'))
+        lines = [f"SET TIMESTAMP={self.timestamp}/*!*/;"]
+        if database:
+            lines.insert(0, f"use `{database}`/*!*/;")
+        self.write_event(QUERY_EVENT, body, 'Query\tthread_id=8\texec_time=0\terror_code=0',
+                         lines + [sql, '/*!*/;'])
+
+    def format_description(self):
+        post_header_len = bytearray(40)
+        post_header_len[QUERY_EVENT - 1] = 13
+        post_header_len[TABLE_MAP_EVENT - 1] = 8
+        for event_type in (WRITE_ROWS_EVENT, UPDATE_ROWS_EVENT, DELETE_ROWS_EVENT):
+            post_header_len[event_type - 1] = 10
+        # 末尾: 校验算法(0=不校验) + 4字节校验值
+        body = (struct.pack('<H', 4) + SERVER_VERSION.encode().ljust(50, b'\0') + struct.pack('<I', self.timestamp) +
+                bytes([EVENT_HEADER_LEN]) + bytes(post_header_len) + b'\0' + b'\0\0\0\0')
+        stamp = time.strftime('%y%m%d %H:%M:%S', time.localtime(self.timestamp))
+        self.write_event(FORMAT_DESCRIPTION_EVENT, body,
+                         f"Start: binlog v 4, server v {SERVER_VERSION} created {stamp} at startup", [])
+
+    def transaction(self, remaining):
+        self.query_event('BEGIN')
+        for _ in range(self.events_per_txn):
+            if remaining <= 0:
+                break
+            table = self.random.choice(self.tables)
+            kind = self.choose_kind(table)
+            count = min(self.rows_per_event, remaining)
+            event_type, event_name, body, lines, generated = self.rows_event(table, kind, count)
+            self.write_event(TABLE_MAP_EVENT, table.table_map_body(),
+                             f"Table_map: `{DATABASE}`.`{table.name}` mapped to number {table.table_id}", [])
+            self.write_event(event_type, body, f"{event_name}: table id {table.table_id} flags: STMT_END_F", lines)
+            remaining -= generated
+        self.xid += 1
+        self.write_event(XID_EVENT, struct.pack('<Q', self.xid), f"Xid = {self.xid}", ['COMMIT/*!*/;'])
+        self.counts['transactions'] += 1
+        self.timestamp += 1
+        return remaining
+
+    def generate(self, binlog_path, text_path, rows, verbose_flag='-v'):
+        """
+        生成rows行变更，写入binlog_path和text_path，返回计数
+        """
+        self.vv = verbose_flag == '-vv'
+        self.position = 4
+        with open(binlog_path, 'wb') as self.binlog, open(text_path, 'w', encoding='utf-8') as self.text:
+            self.binlog.write(BINLOG_MAGIC)
+            self.text_lines(['/*!50530 SET @@SESSION.PSEUDO_SLAVE_MODE=1*/;', 'DELIMITER /*!*/;'])
+            self.format_description()
+            for table in self.tables:
+                self.query_event(table.create_sql(), DATABASE)
+            remaining = rows
+            while remaining > 0:
+                remaining = self.transaction(remaining)
+            self.text_lines(['SET @@SESSION.GTID_NEXT= \'AUTOMATIC\' /* added by mysqlbinlog */ /*!*/;',
+                             'DELIMITER ;', '# End of log file'])
+        counts = dict(self.counts)
+        counts['rows'] = counts['INSERT'] + counts['UPDATE'] + counts['DELETE']
+        return counts
+
+def parse_mix(value):
+    """
+    "插入:更新:删除"权重，如"50:30:20"
+    """
+    parts = value.split(':')
+    if len(parts) != 3 or not all(part.isdigit() for part in parts) or not any(int(part) for part in parts):
+        raise argparse.ArgumentTypeError(f"格式应为 插入:更新:删除，如 50:30:20，而不是 {value}")
+    return tuple(int(part) for part in parts)
+
+def add_workload_arguments(parser):
+    parser.add_argument('--tables', type=int, default=4, help='表数量（默认: 4）')
+    parser.add_argument('--columns', type=int, default=8, help='每张表的列数，含主键（默认: 8）')
+    parser.add_argument('--rows', type=int, default=100000, help='变更行数（默认: 100000）')
+    parser.add_argument('--mix', type=parse_mix, default=(50, 30, 20), help='插入:更新:删除 权重（默认: 50:30:20）')
+    parser.add_argument('--rows-per-event', type=int, default=10, help='每个行事件的行数（默认: 10）')
+    parser.add_argument('--events-per-txn', type=int, default=2, help='每个事务的行事件数（默认: 2）')
+    parser.add_argument('--long-string-bytes', type=int, default=0, help='字符串列的字节数（默认: 24）')
+    parser.add_argument('--multibyte', action='store_true', help='字符串使用中文等多字节字符')
+    parser.add_argument('--vv', action='store_true', help='文本按mysqlbinlog -vv输出（带列类型注释）')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子（默认: 1）')
+
+def generate_workload(directory, args, name='bench-bin.000001'):
+    """
+    按命令行参数生成负载，返回{'binlog', 'text', 'workload', 'counts'}
+    """
+    os.makedirs(directory, exist_ok=True)
+    binlog_path = os.path.join(directory, name)
+    text_path = binlog_path + '.txt'
+    generator = WorkloadGenerator(args.tables, args.columns, args.mix, args.rows_per_event, args.events_per_txn,
+                                  args.long_string_bytes, args.multibyte, seed=args.seed)
+    counts = generator.generate(binlog_path, text_path, args.rows, '-vv' if args.vv else '-v')
+    workload = {
+        'tables': args.tables, 'columns': args.columns, 'rows': args.rows, 'mix': ':'.join(map(str, args.mix)),
+        'rows_per_event': args.rows_per_event, 'events_per_txn': args.events_per_txn,
+        'long_string_bytes': args.long_string_bytes, 'multibyte': args.multibyte,
+        'verbose_flag': '-vv' if args.vv else '-v', 'seed': args.seed,
+    }
+    return {'binlog': binlog_path, 'text': text_path, 'workload': workload, 'counts': counts}
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成binlog负载（二进制binlog和mysqlbinlog文本）')
+    parser.add_argument('directory', help='输出目录')
+    add_workload_arguments(parser)
+    args = parser.parse_args()
+    result = generate_workload(args.directory, args)
+    counts = result['counts']
+    print(f"{result['binlog']}: {os.path.getsize(result['binlog'])} 字节, {counts['events']} 个事件, "
+          f"{counts['transactions']} 个事务")
+    print(f"{result['text']}: {counts['text_lines']} 行")
+    print(f"INSERT {counts['INSERT']}, UPDATE {counts['UPDATE']}, DELETE {counts['DELETE']}")
+
+if __name__ == "__main__":
+    main()
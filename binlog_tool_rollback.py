@@ -3,8 +3,36 @@ import re
 import sys
 import os
 import argparse
+import bisect
+import bz2
+import cProfile
+import csv
+import fnmatch
+import glob
+import gzip
+import hashlib
+import heapq
+import importlib
+import json
+import lzma
+import queue
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import parse_qs, unquote, urlparse
+
+try:
+    import resource
+except ImportError:
+    # Windows没有resource模块，不统计内存和子进程CPU
+    resource = None
 
 # 输出级别常量
 VERBOSE_QUIET = 0    # 只输出必要信息
@@ -31,283 +59,3517 @@ def log_debug(message):
     if verbose_level >= VERBOSE_DEBUG:
         print(message, file=sys.stderr)
 
-def run_mysqlbinlog(binlog_file, extra_args=[]):
+# ---------------------------------------------------------------------------
+# 分阶段计时（--stats / --metrics-json）
+# ---------------------------------------------------------------------------
+
+# 每隔多少次阶段切换采样一次峰值RSS（getrusage是系统调用）
+RSS_SAMPLE_INTERVAL = 256
+
+def peak_rss_kb(who=None):
+    """
+    进程（或已回收子进程）的峰值RSS，单位KB
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    # macOS上ru_maxrss的单位是字节
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def children_cpu_seconds():
+    """
+    已回收子进程（mysqlbinlog、工作进程）的CPU时间
+    """
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+class PhaseMetrics:
+    """
+    按阶段累计墙钟时间、CPU时间、处理量和峰值RSS
+
+    同一时刻只有一个阶段在计时：流式流水线中下游向上游取数据时切换到上游阶段，
+    所以各阶段的时间互不重叠。阶段的峰值RSS是该阶段运行期间采样到的进程最高值。
+    """
+
+    COUNTERS = ('lines', 'bytes', 'events', 'rows', 'statements')
+
+    def __init__(self):
+        self.phases = {}
+        self.current = None
+        self.switches = 0
+        self.started = self.mark = time.perf_counter()
+        self.cpu_started = self.cpu_mark = time.process_time()
+        self.children_cpu_started = children_cpu_seconds()
+
+    def get(self, name):
+        """
+        返回阶段的统计字典，不存在时按调用顺序新建
+        """
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = dict.fromkeys(self.COUNTERS, 0)
+            phase.update(wall=0.0, cpu=0.0, peak_rss_kb=0)
+        return phase
+
+    def sample(self, name):
+        phase = self.phases[name]
+        phase['peak_rss_kb'] = max(phase['peak_rss_kb'], peak_rss_kb())
+
+    def switch(self, name):
+        """
+        把上次切换以来的时间记到当前阶段，切换到name（None表示不计时），返回原来的阶段
+        """
+        now = time.perf_counter()
+        cpu = time.process_time()
+        previous = self.current
+        if previous is not None:
+            phase = self.phases[previous]
+            phase['wall'] += now - self.mark
+            phase['cpu'] += cpu - self.cpu_mark
+            self.switches += 1
+            if self.switches % RSS_SAMPLE_INTERVAL == 0:
+                self.sample(previous)
+        if name is not None:
+            self.get(name)
+        self.current = name
+        self.mark = now
+        self.cpu_mark = cpu
+        return previous
+
+    def enter(self, name):
+        """
+        顺序执行的阶段：结束当前阶段并开始name（None表示停止计时）
+        """
+        if self.current is not None:
+            self.sample(self.current)
+        self.switch(name)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        with块内的时间记到name阶段
+        """
+        previous = self.switch(name)
+        try:
+            yield self.phases[name]
+        finally:
+            self.sample(name)
+            self.switch(previous)
+
+    def wrap(self, name, iterable, counter='rows', size=None):
+        """
+        透传iterable，取每个元素的时间记到name阶段，每个元素counter加1，size(元素)累加到bytes
+        """
+        self.get(name)
+        return self.iter_phase(name, iter(iterable), counter, size)
+
+    def iter_phase(self, name, iterator, counter, size):
+        phase = self.phases[name]
+        while True:
+            previous = self.switch(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.sample(name)
+                self.switch(previous)
+                return
+            except BaseException:
+                self.switch(previous)
+                raise
+            self.switch(previous)
+            phase[counter] += 1
+            if size is not None:
+                phase['bytes'] += size(item)
+            yield item
+
+    def report(self):
+        """
+        返回可写成JSON的报告：各阶段的时间、处理量、速率和峰值RSS，以及子进程的CPU和峰值RSS
+        """
+        wall = time.perf_counter() - self.started
+        phases = {}
+        for name, phase in self.phases.items():
+            phase = dict(phase)
+            seconds = phase['wall']
+            for counter in self.COUNTERS:
+                if phase[counter] and seconds > 0:
+                    phase[f"{counter}_per_sec"] = phase[counter] / seconds
+            phases[name] = phase
+        return {
+            'wall': wall,
+            'cpu': time.process_time() - self.cpu_started,
+            'untracked_wall': max(wall - sum(phase['wall'] for phase in self.phases.values()), 0.0),
+            'peak_rss_kb': peak_rss_kb(),
+            'children_cpu': children_cpu_seconds() - self.children_cpu_started,
+            'children_peak_rss_kb': peak_rss_kb(resource.RUSAGE_CHILDREN) if resource is not None else 0,
+            'phases': phases,
+        }
+
+def metrics_phase(metrics, name):
+    """
+    metrics为None时不计时
+    """
+    return metrics.phase(name) if metrics is not None else nullcontext()
+
+def format_metrics_report(report):
+    """
+    把PhaseMetrics.report()的结果格式化为文本表格
+    """
+    lines = [f"{'阶段':<12} {'耗时(s)':>9} {'CPU(s)':>8} {'文本行':>10} {'字节':>12} {'事件':>9} "
+             f"{'行':>10} {'语句':>10} {'行/秒':>10} {'MB/秒':>8} {'峰值RSS(MB)':>11}"]
+    for name, phase in report['phases'].items():
+        rows_per_sec = phase.get('rows_per_sec') or phase.get('statements_per_sec') or 0
+        lines.append(f"{name:<12} {phase['wall']:>9.3f} {phase['cpu']:>8.3f} {phase['lines']:>10} "
+                     f"{phase['bytes']:>12} {phase['events']:>9} {phase['rows']:>10} {phase['statements']:>10} "
+                     f"{rows_per_sec:>10.0f} {phase.get('bytes_per_sec', 0) / (1024 * 1024):>8.1f} "
+                     f"{phase['peak_rss_kb'] / 1024:>11.1f}")
+    lines.append(f"总耗时 {report['wall']:.3f}s (未归入阶段 {report['untracked_wall']:.3f}s), CPU {report['cpu']:.3f}s, "
+                 f"峰值RSS {report['peak_rss_kb'] / 1024:.1f}MB; 子进程CPU {report['children_cpu']:.3f}s, "
+                 f"子进程峰值RSS {report['children_peak_rss_kb'] / 1024:.1f}MB")
+    return '\n'.join(lines)
+
+def emit_metrics(metrics, show=False, json_file=None):
     """
-    运行mysqlbinlog命令并捕获输出
+    输出计时报告：show为True时打印表格，指定json_file时写入JSON
+    """
+    report = metrics.report()
+    if show:
+        log_quiet(format_metrics_report(report))
+    if json_file:
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        log_normal(f"计时报告已保存到: {json_file}")
+    return report
+
+# mysqlbinlog输出的候选编码，按顺序逐块尝试
+DECODE_ENCODINGS = ['utf-8', 'latin1', 'gbk', 'gb2312', 'cp1252']
+
+# 每次从mysqlbinlog管道读取的字节数
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+def decode_chunk(data, encodings=DECODE_ENCODINGS):
+    """
+    按候选编码解码一块数据，全部失败时忽略无法解码的字节
+    """
+    for encoding in encodings:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='ignore')
+
+# ---------------------------------------------------------------------------
+# 压缩归档的binlog：按扩展名流式解压，不在磁盘上生成解压后的副本
+# ---------------------------------------------------------------------------
+
+COMPRESSED_BINLOG_SUFFIXES = ('.gz', '.xz', '.bz2', '.zst', '.zstd')
+
+def is_compressed_binlog(binlog_file):
+    """
+    是否为压缩归档的binlog
+    """
+    return binlog_file.endswith(COMPRESSED_BINLOG_SUFFIXES)
+
+class DecompressPipe:
+    """
+    外部解压命令（如zstd -dc）的标准输出，提供read/tell和只能向前的seek
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.position = 0
+
+    def read(self, size=-1):
+        data = self.process.stdout.read(size)
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence != os.SEEK_SET or offset < self.position:
+            raise OSError(f"{' '.join(self.cmd)}: 解压流只能向前跳转")
+        while self.position < offset:
+            if not self.read(min(offset - self.position, STREAM_CHUNK_SIZE)):
+                break
+        return self.position
+
+    def close(self):
+        self.process.stdout.close()
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_binlog_stream(binlog_file):
+    """
+    以二进制只读方式打开binlog，压缩文件边读边解压（向前seek时解压并丢弃中间数据）
+
+    .zst优先使用zstandard模块，没有安装时调用zstd命令。
+    """
+    if binlog_file.endswith('.gz'):
+        return gzip.open(binlog_file, 'rb')
+    if binlog_file.endswith('.xz'):
+        return lzma.open(binlog_file, 'rb')
+    if binlog_file.endswith('.bz2'):
+        return bz2.open(binlog_file, 'rb')
+    if binlog_file.endswith(('.zst', '.zstd')):
+        try:
+            import zstandard
+        except ImportError:
+            return DecompressPipe(['zstd', '-dcq', binlog_file])
+        return zstandard.ZstdDecompressor().stream_reader(open(binlog_file, 'rb'))
+    return open(binlog_file, 'rb')
+
+def feed_decompressed(binlog_file, stdin, errors):
+    """
+    在线程中把解压后的binlog写入子进程的标准输入
     """
-    cmd = ['mysqlbinlog', '--base64-output=decode-rows', '-vv'] + extra_args + [binlog_file]
     try:
-        result = subprocess.run(cmd, capture_output=True, encoding='utf-8', errors='replace', check=True)
-        return result.stdout
-    except subprocess.CalledProcessError as e:
-        print(f"Error running mysqlbinlog: {e.stderr}")
-        return None
+        with open_binlog_stream(binlog_file) as stream:
+            while True:
+                chunk = stream.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                stdin.write(chunk)
+    except BrokenPipeError:
+        # mysqlbinlog提前退出（如到达--stop-position）
+        pass
+    except (OSError, EOFError, lzma.LZMAError, zlib.error) as e:
+        errors.append(e)
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
 
-def run_mysqlbinlog_robust(binlog_file, extra_args=[]):
+def iter_mysqlbinlog_lines(binlog_file, extra_args=None, verbose_flag='-v', encodings=DECODE_ENCODINGS,
+                           metrics=None):
     """
-    处理编码问题的方法
+    流式运行mysqlbinlog，逐行产出解码后的输出
+
+    输出按块从管道读取并按块解码，内存占用与binlog大小无关。压缩的binlog在线程中边解压
+    边写入mysqlbinlog的标准输入（文件名为"-"）。
+    mysqlbinlog执行失败时在迭代结束后抛出CalledProcessError，解压失败时抛出ValueError。
+    传入metrics（PhaseMetrics）时，读管道和解码的时间按块记到mysqlbinlog阶段。
+    """
+    compressed = is_compressed_binlog(binlog_file)
+    cmd = (['mysqlbinlog', '--base64-output=decode-rows', verbose_flag] + list(extra_args or []) +
+           ['-' if compressed else binlog_file])
+    log_debug(f"执行命令: {' '.join(cmd)}")
+
+    # stderr写入临时文件，避免管道写满导致死锁
+    with tempfile.TemporaryFile() as err_file:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err_file,
+                                   stdin=subprocess.PIPE if compressed else None)
+        feed_errors = []
+        feeder = None
+        if compressed:
+            feeder = threading.Thread(target=feed_decompressed, args=(binlog_file, process.stdin, feed_errors),
+                                      daemon=True)
+            feeder.start()
+        finished = False
+        try:
+            pending = b''
+            read_phase = metrics.get('mysqlbinlog') if metrics is not None else None
+            while True:
+                if read_phase is not None:
+                    previous = metrics.switch('mysqlbinlog')
+                chunk = process.stdout.read(STREAM_CHUNK_SIZE)
+                lines = None
+                if chunk:
+                    chunk = pending + chunk
+                    cut = chunk.rfind(b'\n') + 1
+                    if cut == 0:
+                        pending = chunk
+                    else:
+                        pending = chunk[cut:]
+                        lines = decode_chunk(chunk[:cut], encodings).split('\n')
+                        lines.pop()
+                if read_phase is not None:
+                    if lines:
+                        read_phase['bytes'] += len(chunk) - len(pending)
+                        read_phase['lines'] += len(lines)
+                    else:
+                        metrics.sample('mysqlbinlog')
+                    metrics.switch(previous)
+                if not chunk:
+                    break
+                if lines:
+                    yield from lines
+            if pending:
+                yield from decode_chunk(pending, encodings).split('\n')
+            finished = True
+        finally:
+            process.stdout.close()
+            if not finished and process.poll() is None:
+                # 调用方提前结束迭代
+                process.kill()
+            returncode = process.wait()
+            if feeder is not None:
+                feeder.join()
+
+        if feed_errors:
+            raise ValueError(f"解压 {binlog_file} 失败: {feed_errors[0]}")
+        if returncode != 0:
+            err_file.seek(0)
+            stderr = err_file.read().decode('utf-8', errors='ignore')
+            raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr)
+
+# ---------------------------------------------------------------------------
+# 原生binlog解析（v4格式），不依赖mysqlbinlog
+# ---------------------------------------------------------------------------
+
+BINLOG_MAGIC = b'\xfebin'
+EVENT_HEADER_LEN = 19
+
+# 事件类型
+QUERY_EVENT = 2
+STOP_EVENT = 3
+ROTATE_EVENT = 4
+FORMAT_DESCRIPTION_EVENT = 15
+XID_EVENT = 16
+TABLE_MAP_EVENT = 19
+WRITE_ROWS_EVENT_V1 = 23
+UPDATE_ROWS_EVENT_V1 = 24
+DELETE_ROWS_EVENT_V1 = 25
+WRITE_ROWS_EVENT = 30
+UPDATE_ROWS_EVENT = 31
+DELETE_ROWS_EVENT = 32
+GTID_EVENT = 33
+ANONYMOUS_GTID_EVENT = 34
+
+ROWS_EVENT_KINDS = {
+    WRITE_ROWS_EVENT_V1: 'INSERT', WRITE_ROWS_EVENT: 'INSERT',
+    UPDATE_ROWS_EVENT_V1: 'UPDATE', UPDATE_ROWS_EVENT: 'UPDATE',
+    DELETE_ROWS_EVENT_V1: 'DELETE', DELETE_ROWS_EVENT: 'DELETE',
+}
+ROWS_EVENT_V2 = (WRITE_ROWS_EVENT, UPDATE_ROWS_EVENT, DELETE_ROWS_EVENT)
+
+# 列类型
+MYSQL_TYPE_DECIMAL = 0
+MYSQL_TYPE_TINY = 1
+MYSQL_TYPE_SHORT = 2
+MYSQL_TYPE_LONG = 3
+MYSQL_TYPE_FLOAT = 4
+MYSQL_TYPE_DOUBLE = 5
+MYSQL_TYPE_NULL = 6
+MYSQL_TYPE_TIMESTAMP = 7
+MYSQL_TYPE_LONGLONG = 8
+MYSQL_TYPE_INT24 = 9
+MYSQL_TYPE_DATE = 10
+MYSQL_TYPE_TIME = 11
+MYSQL_TYPE_DATETIME = 12
+MYSQL_TYPE_YEAR = 13
+MYSQL_TYPE_NEWDATE = 14
+MYSQL_TYPE_VARCHAR = 15
+MYSQL_TYPE_BIT = 16
+MYSQL_TYPE_TIMESTAMP2 = 17
+MYSQL_TYPE_DATETIME2 = 18
+MYSQL_TYPE_TIME2 = 19
+MYSQL_TYPE_VECTOR = 242
+MYSQL_TYPE_JSON = 245
+MYSQL_TYPE_NEWDECIMAL = 246
+MYSQL_TYPE_ENUM = 247
+MYSQL_TYPE_SET = 248
+MYSQL_TYPE_TINY_BLOB = 249
+MYSQL_TYPE_MEDIUM_BLOB = 250
+MYSQL_TYPE_LONG_BLOB = 251
+MYSQL_TYPE_BLOB = 252
+MYSQL_TYPE_VAR_STRING = 253
+MYSQL_TYPE_STRING = 254
+MYSQL_TYPE_GEOMETRY = 255
+
+NUMERIC_TYPES = (MYSQL_TYPE_TINY, MYSQL_TYPE_SHORT, MYSQL_TYPE_INT24, MYSQL_TYPE_LONG,
+                 MYSQL_TYPE_LONGLONG, MYSQL_TYPE_FLOAT, MYSQL_TYPE_DOUBLE,
+                 MYSQL_TYPE_DECIMAL, MYSQL_TYPE_NEWDECIMAL)
+
+# TABLE_MAP可选元数据类型（列名和主键需要binlog_row_metadata=FULL）
+TABLE_MAP_SIGNEDNESS = 1
+TABLE_MAP_COLUMN_NAME = 4
+TABLE_MAP_SIMPLE_PRIMARY_KEY = 8
+TABLE_MAP_PRIMARY_KEY_WITH_PREFIX = 9
+
+EVENT_HEADER = struct.Struct('<IBIIIH')
+INT_FORMATS = {
+    MYSQL_TYPE_TINY: (struct.Struct('<b'), struct.Struct('<B')),
+    MYSQL_TYPE_SHORT: (struct.Struct('<h'), struct.Struct('<H')),
+    MYSQL_TYPE_LONG: (struct.Struct('<i'), struct.Struct('<I')),
+    MYSQL_TYPE_LONGLONG: (struct.Struct('<q'), struct.Struct('<Q')),
+}
+FLOAT_FORMAT = struct.Struct('<f')
+DOUBLE_FORMAT = struct.Struct('<d')
+DECIMAL_DIG_BYTES = [0, 1, 1, 2, 2, 3, 3, 4, 4, 4]
+
+def read_packed_int(data, offset):
+    """
+    读取长度编码整数，返回(值, 新偏移)
+    """
+    first = data[offset]
+    if first < 251:
+        return first, offset + 1
+    if first == 252:
+        return int.from_bytes(data[offset + 1:offset + 3], 'little'), offset + 3
+    if first == 253:
+        return int.from_bytes(data[offset + 1:offset + 4], 'little'), offset + 4
+    if first == 254:
+        return int.from_bytes(data[offset + 1:offset + 9], 'little'), offset + 9
+    return None, offset + 1
+
+def parse_format_description(body):
+    """
+    解析FORMAT_DESCRIPTION事件，返回{'server_version', 'post_header_len', 'checksum'}
+    """
+    server_version = body[2:52].split(b'\0', 1)[0].decode('ascii', errors='ignore')
+    header_len = body[56]
+    version = tuple(int(part) for part in re.findall(r'\d+', server_version)[:3])
+    # 5.6.1起FORMAT_DESCRIPTION末尾带1字节校验算法和4字节校验值
+    has_checksum_alg = version >= (5, 6, 1)
+    end = len(body) - 5 if has_checksum_alg else len(body)
+    checksum = has_checksum_alg and body[-5] == 1
+    return {
+        'server_version': server_version,
+        'header_len': header_len,
+        'post_header_len': body[57:end],
+        'checksum': checksum,
+    }
+
+def open_binlog(binlog_file):
+    """
+    打开binlog文件（压缩文件边读边解压）并校验魔数
+    """
+    f = open_binlog_stream(binlog_file)
+    if f.read(4) != BINLOG_MAGIC:
+        f.close()
+        raise ValueError(f"{binlog_file} 不是有效的binlog文件")
+    return f
+
+def iter_binlog_events(binlog_file, start_position=None, stop_position=None):
+    """
+    直接读取二进制binlog，逐个产出事件(类型, 时间戳, 起始位置, 结束位置, 事件体)
+
+    事件体已去掉通用头和CRC32校验值。指定start_position时，
+    先读取FORMAT_DESCRIPTION事件再跳转到该位置。
+    """
+    with open_binlog(binlog_file) as f:
+        pos = 4
+        checksum = False
+        seek_to = start_position if start_position and start_position > 4 else None
+        while True:
+            if stop_position and pos >= stop_position:
+                break
+            header = f.read(EVENT_HEADER_LEN)
+            if len(header) < EVENT_HEADER_LEN:
+                break
+            timestamp, event_type, _server_id, event_size, _log_pos, _flags = EVENT_HEADER.unpack(header)
+            if event_size < EVENT_HEADER_LEN:
+                # 长度比事件头还短说明文件损坏或位置不在事件边界上，f.read(负数)会读到文件末尾
+                raise ValueError(f"{binlog_file} 位置 {pos} 的事件长度 {event_size} 无效，"
+                                 f"文件损坏或位置不是事件起点")
+            body = f.read(event_size - EVENT_HEADER_LEN)
+            if len(body) < event_size - EVENT_HEADER_LEN:
+                # 活跃binlog末尾可能是写了一半的事件
+                break
+            next_pos = pos + event_size
+
+            if event_type == FORMAT_DESCRIPTION_EVENT:
+                fde = parse_format_description(body)
+                checksum = fde['checksum']
+                if checksum:
+                    body = body[:-4]
+                yield event_type, timestamp, pos, next_pos, body
+                if seek_to:
+                    f.seek(seek_to)
+                    pos = seek_to
+                    seek_to = None
+                    continue
+            else:
+                if checksum:
+                    body = body[:-4]
+                yield event_type, timestamp, pos, next_pos, body
+            pos = next_pos
+
+def scan_event_headers(binlog_file, start_position=None, stop_position=None):
+    """
+    只读取事件头，逐个产出(类型, 时间戳, 起始位置, 结束位置)，事件体直接跳过
+    """
+    with open_binlog(binlog_file) as f:
+        # 压缩文件不知道解压后的大小，写了一半的事件只会出现在活跃binlog中
+        file_size = None if is_compressed_binlog(binlog_file) else os.fstat(f.fileno()).st_size
+        pos = start_position if start_position and start_position > 4 else 4
+        f.seek(pos)
+        while not stop_position or pos < stop_position:
+            header = f.read(EVENT_HEADER_LEN)
+            if len(header) < EVENT_HEADER_LEN:
+                break
+            timestamp, event_type, _server_id, event_size, _log_pos, _flags = EVENT_HEADER.unpack(header)
+            next_pos = pos + event_size
+            if event_size < EVENT_HEADER_LEN or (file_size is not None and next_pos > file_size):
+                break
+            yield event_type, timestamp, pos, next_pos
+            f.seek(next_pos)
+            pos = next_pos
+
+def plan_split_ranges(binlog_file, parts, start_position=None, stop_position=None):
+    """
+    按事务边界把binlog切成最多parts个位置区间，返回[(start, stop), ...]，None表示不限
+
+    只扫描事件头：GTID事件的位置和XID事件之后的位置都是事务起点，
+    每个区间都从事务起点开始，TABLE_MAP和行事件不会被切开。
+    """
+    if parts <= 1:
+        return [(start_position, stop_position)]
+    if is_compressed_binlog(binlog_file):
+        # 每个区间都要从头解压，切分只会增加解压量
+        log_detail(f"{binlog_file} 是压缩文件，不切分")
+        return [(start_position, stop_position)]
+    file_size = os.path.getsize(binlog_file)
+    begin = start_position or 4
+    end = min(stop_position or file_size, file_size)
+    step = (end - begin) / parts
+    targets = [begin + step * k for k in range(1, parts)]
+
+    cuts = []
+    for event_type, _timestamp, pos, next_pos in scan_event_headers(binlog_file, begin, end):
+        if event_type in (GTID_EVENT, ANONYMOUS_GTID_EVENT):
+            boundary = pos
+        elif event_type == XID_EVENT:
+            boundary = next_pos
+        else:
+            continue
+        if boundary <= begin or boundary >= end:
+            continue
+        if boundary >= targets[0]:
+            if not cuts or cuts[-1] != boundary:
+                cuts.append(boundary)
+            while targets and boundary >= targets[0]:
+                targets.pop(0)
+            if not targets:
+                break
+
+    points = [start_position] + cuts + [stop_position]
+    return list(zip(points[:-1], points[1:]))
+
+def parse_table_map(body, post_header_len=8):
+    """
+    解析TABLE_MAP事件，返回表结构描述
+    """
+    table_id_len = 4 if post_header_len == 6 else 6
+    table_id = int.from_bytes(body[:table_id_len], 'little')
+    offset = table_id_len + 2
+    db_len = body[offset]
+    database = body[offset + 1:offset + 1 + db_len].decode('utf-8', errors='replace')
+    offset += db_len + 2
+    table_len = body[offset]
+    table = body[offset + 1:offset + 1 + table_len].decode('utf-8', errors='replace')
+    offset += table_len + 2
+
+    column_count, offset = read_packed_int(body, offset)
+    column_types = list(body[offset:offset + column_count])
+    offset += column_count
+    meta_len, offset = read_packed_int(body, offset)
+    meta_end = offset + meta_len
+
+    column_meta = []
+    for column_type in column_types:
+        if column_type in (MYSQL_TYPE_FLOAT, MYSQL_TYPE_DOUBLE, MYSQL_TYPE_BLOB, MYSQL_TYPE_GEOMETRY,
+                           MYSQL_TYPE_JSON, MYSQL_TYPE_VECTOR, MYSQL_TYPE_TIMESTAMP2,
+                           MYSQL_TYPE_DATETIME2, MYSQL_TYPE_TIME2):
+            column_meta.append(body[offset])
+            offset += 1
+        elif column_type in (MYSQL_TYPE_VARCHAR, MYSQL_TYPE_VAR_STRING):
+            column_meta.append(int.from_bytes(body[offset:offset + 2], 'little'))
+            offset += 2
+        elif column_type in (MYSQL_TYPE_STRING, MYSQL_TYPE_ENUM, MYSQL_TYPE_SET,
+                             MYSQL_TYPE_BIT, MYSQL_TYPE_NEWDECIMAL):
+            column_meta.append((body[offset] << 8) | body[offset + 1])
+            offset += 2
+        else:
+            column_meta.append(0)
+    offset = meta_end
+    offset += (column_count + 7) // 8
+
+    unsigned = [False] * column_count
+    column_names = None
+    primary_key = None
+    while offset < len(body):
+        field_type = body[offset]
+        field_len, offset = read_packed_int(body, offset + 1)
+        field = body[offset:offset + field_len]
+        offset += field_len
+        if field_type == TABLE_MAP_SIGNEDNESS:
+            numeric_index = 0
+            for i, column_type in enumerate(column_types):
+                if column_type in NUMERIC_TYPES:
+                    if field[numeric_index // 8] & (0x80 >> (numeric_index % 8)):
+                        unsigned[i] = True
+                    numeric_index += 1
+        elif field_type == TABLE_MAP_COLUMN_NAME:
+            column_names = []
+            pos = 0
+            while pos < len(field):
+                name_len, pos = read_packed_int(field, pos)
+                column_names.append(field[pos:pos + name_len].decode('utf-8', errors='replace'))
+                pos += name_len
+        elif field_type in (TABLE_MAP_SIMPLE_PRIMARY_KEY, TABLE_MAP_PRIMARY_KEY_WITH_PREFIX):
+            # 列序号从1开始，与行镜像的键一致；带前缀的主键忽略前缀长度
+            primary_key = []
+            pos = 0
+            while pos < len(field):
+                column, pos = read_packed_int(field, pos)
+                primary_key.append(column + 1)
+                if field_type == TABLE_MAP_PRIMARY_KEY_WITH_PREFIX:
+                    _, pos = read_packed_int(field, pos)
+
+    return {
+        'table_id': table_id,
+        'database': database,
+        'table': table,
+        'column_types': column_types,
+        'column_meta': column_meta,
+        'unsigned': unsigned,
+        'column_names': column_names,
+        'primary_key': primary_key,
+    }
+
+def quote_sql_string(text):
+    """
+    转义字符串并加上单引号
+    """
+    text = (text.replace('\\', '\\\\').replace("'", "''").replace('\0', '\\0')
+            .replace('\n', '\\n').replace('\r', '\\r').replace('\x1a', '\\Z'))
+    return f"'{text}'"
+
+def format_sql_bytes(raw):
+    """
+    字节串转为SQL字面量，非UTF-8内容使用十六进制字面量
     """
-    cmd = ['mysqlbinlog', '--base64-output=decode-rows', '-v'] + extra_args + [binlog_file]
-    
     try:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
-        
-        if process.returncode != 0:
-            print(f"错误: mysqlbinlog执行失败: {stderr.decode('utf-8', errors='ignore')}")
-            return None
-        
-        content = None
-        for encoding in ['utf-8', 'latin1', 'gbk', 'gb2312', 'cp1252']:
-            try:
-                content = stdout.decode(encoding)
+        return quote_sql_string(raw.decode('utf-8'))
+    except UnicodeDecodeError:
+        return f"X'{raw.hex()}'" if raw else "''"
+
+def format_sql_float(raw):
+    """
+    FLOAT列取能还原为同一单精度值的最短表示
+    """
+    value = FLOAT_FORMAT.unpack(raw)[0]
+    for precision in range(6, 10):
+        text = '%.*g' % (precision, value)
+        if FLOAT_FORMAT.pack(float(text)) == raw:
+            return text
+    return repr(value)
+
+def decode_newdecimal(data, offset, precision, scale):
+    """
+    解析DECIMAL二进制格式，返回(字符串, 新偏移)
+    """
+    integral = precision - scale
+    int_full, int_rest = divmod(integral, 9)
+    frac_full, frac_rest = divmod(scale, 9)
+    size = int_full * 4 + DECIMAL_DIG_BYTES[int_rest] + frac_full * 4 + DECIMAL_DIG_BYTES[frac_rest]
+    raw = bytearray(data[offset:offset + size])
+    negative = not raw[0] & 0x80
+    raw[0] ^= 0x80
+    if negative:
+        raw = bytearray(b ^ 0xff for b in raw)
+
+    pos = 0
+    int_parts = []
+    size = DECIMAL_DIG_BYTES[int_rest]
+    if size:
+        int_parts.append(str(int.from_bytes(raw[pos:pos + size], 'big')))
+        pos += size
+    for _ in range(int_full):
+        int_parts.append('%09d' % int.from_bytes(raw[pos:pos + 4], 'big'))
+        pos += 4
+    frac_parts = []
+    for _ in range(frac_full):
+        frac_parts.append('%09d' % int.from_bytes(raw[pos:pos + 4], 'big'))
+        pos += 4
+    size = DECIMAL_DIG_BYTES[frac_rest]
+    if size:
+        frac_parts.append('%0*d' % (frac_rest, int.from_bytes(raw[pos:pos + size], 'big')))
+        pos += size
+
+    text = ''.join(int_parts).lstrip('0') or '0'
+    if frac_parts:
+        text += '.' + ''.join(frac_parts)
+    if negative:
+        text = '-' + text
+    return text, offset + pos
+
+def read_fraction(data, offset, fsp):
+    """
+    读取TIME2/DATETIME2/TIMESTAMP2的小数秒部分，返回(原始整数, 字节数)
+    """
+    size = (fsp + 1) // 2
+    if not size:
+        return 0, 0
+    return int.from_bytes(data[offset:offset + size], 'big'), size
+
+def format_fraction(microsecond, fsp):
+    """
+    按精度格式化小数秒
+    """
+    return '.' + ('%06d' % microsecond)[:fsp] if fsp else ''
+
+def format_timestamp_value(seconds, microsecond=0, fsp=0):
+    """
+    TIMESTAMP按Unix秒数输出FROM_UNIXTIME()；秒数为0表示零值，FROM_UNIXTIME(0)超出TIMESTAMP范围，改写零日期
+    """
+    if not seconds and not microsecond:
+        return f"'0000-00-00 00:00:00{format_fraction(0, fsp)}'"
+    return f"FROM_UNIXTIME({seconds}{format_fraction(microsecond, fsp)})"
+
+def decode_datetime2(data, offset, fsp):
+    """
+    解析DATETIME2，返回(SQL字面量, 新偏移)
+    """
+    packed = int.from_bytes(data[offset:offset + 5], 'big') - 0x8000000000
+    frac, size = read_fraction(data, offset + 5, fsp)
+    microsecond = frac * (10 ** (6 - 2 * size)) if size else 0
+    ymd, hms = packed >> 17, packed % (1 << 17)
+    year_month, day = ymd >> 5, ymd % 32
+    year, month = divmod(year_month, 13)
+    text = '%04d-%02d-%02d %02d:%02d:%02d' % (year, month, day, hms >> 12, (hms >> 6) % 64, hms % 64)
+    return f"'{text}{format_fraction(microsecond, fsp)}'", offset + 5 + size
+
+def decode_time2(data, offset, fsp):
+    """
+    解析TIME2，返回(SQL字面量, 新偏移)
+    """
+    intpart = int.from_bytes(data[offset:offset + 3], 'big') - 0x800000
+    size = (fsp + 1) // 2
+    if size == 3:
+        packed = int.from_bytes(data[offset:offset + 6], 'big') - 0x800000000000
+    else:
+        frac = int.from_bytes(data[offset + 3:offset + 3 + size], 'big') if size else 0
+        if intpart < 0 and frac:
+            intpart += 1
+            frac -= 0x100 if size == 1 else 0x10000
+        packed = (intpart << 24) + frac * (10000 if size == 1 else 100)
+    sign = '-' if packed < 0 else ''
+    packed = abs(packed)
+    hms, microsecond = packed >> 24, packed % (1 << 24)
+    text = '%s%02d:%02d:%02d' % (sign, (hms >> 12) % (1 << 10), (hms >> 6) % 64, hms % 64)
+    return f"'{text}{format_fraction(microsecond, fsp)}'", offset + 3 + size
+
+def decode_json_value(value_type, data, offset):
+    """
+    解析MySQL二进制JSON中的单个值
+    """
+    if value_type in (0x00, 0x01, 0x02, 0x03):
+        large = value_type in (0x01, 0x03)
+        width = 4 if large else 2
+        count = int.from_bytes(data[offset:offset + width], 'little')
+        entry_pos = offset + 2 * width
+        keys = []
+        if value_type in (0x00, 0x01):
+            for _ in range(count):
+                key_offset = int.from_bytes(data[entry_pos:entry_pos + width], 'little')
+                key_len = int.from_bytes(data[entry_pos + width:entry_pos + width + 2], 'little')
+                keys.append(data[offset + key_offset:offset + key_offset + key_len].decode('utf-8'))
+                entry_pos += width + 2
+        values = []
+        for _ in range(count):
+            item_type = data[entry_pos]
+            inline = item_type in (0x04, 0x05, 0x06) or (large and item_type in (0x07, 0x08))
+            if inline:
+                values.append(decode_json_value(item_type, data, entry_pos + 1))
+            else:
+                item_offset = int.from_bytes(data[entry_pos + 1:entry_pos + 1 + width], 'little')
+                values.append(decode_json_value(item_type, data, offset + item_offset))
+            entry_pos += 1 + width
+        return dict(zip(keys, values)) if value_type in (0x00, 0x01) else values
+    if value_type == 0x04:
+        return {0: None, 1: True, 2: False}[data[offset]]
+    if value_type in (0x05, 0x06, 0x07, 0x08, 0x09, 0x0a):
+        size = {0x05: 2, 0x06: 2, 0x07: 4, 0x08: 4, 0x09: 8, 0x0a: 8}[value_type]
+        return int.from_bytes(data[offset:offset + size], 'little', signed=value_type in (0x05, 0x07, 0x09))
+    if value_type == 0x0b:
+        return DOUBLE_FORMAT.unpack_from(data, offset)[0]
+    if value_type in (0x0c, 0x0f):
+        if value_type == 0x0f:
+            offset += 1
+        length = 0
+        shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            length |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
                 break
-            except UnicodeDecodeError:
-                continue
-        
-        if content is None:
-            content = stdout.decode('utf-8', errors='ignore')
-            
-        return content
-        
-    except Exception as e:
-        print(f"错误: 执行mysqlbinlog失败: {e}")
+        raw = bytes(data[offset:offset + length])
+        return raw.decode('utf-8', errors='replace')
+    raise ValueError(f"未知的JSON值类型: {value_type}")
+
+def decode_column_value(column_type, meta, unsigned, data, offset):
+    """
+    按列类型解析一个字段值，返回(SQL字面量, 新偏移)
+    """
+    if column_type in INT_FORMATS:
+        fmt = INT_FORMATS[column_type][1 if unsigned else 0]
+        return str(fmt.unpack_from(data, offset)[0]), offset + fmt.size
+    if column_type == MYSQL_TYPE_INT24:
+        return str(int.from_bytes(data[offset:offset + 3], 'little', signed=not unsigned)), offset + 3
+    if column_type in (MYSQL_TYPE_VARCHAR, MYSQL_TYPE_VAR_STRING):
+        size = 1 if meta < 256 else 2
+        length = int.from_bytes(data[offset:offset + size], 'little')
+        offset += size
+        return format_sql_bytes(bytes(data[offset:offset + length])), offset + length
+    if column_type in (MYSQL_TYPE_STRING, MYSQL_TYPE_ENUM, MYSQL_TYPE_SET):
+        real_type, length = meta >> 8, meta & 0xff
+        if real_type and (real_type & 0x30) != 0x30:
+            length |= ((real_type & 0x30) ^ 0x30) << 4
+            real_type |= 0x30
+        if real_type in (MYSQL_TYPE_ENUM, MYSQL_TYPE_SET):
+            # ENUM/SET输出序号/位图，插入时MySQL按数值解释
+            return str(int.from_bytes(data[offset:offset + length], 'little')), offset + length
+        size = 1 if length < 256 else 2
+        value_len = int.from_bytes(data[offset:offset + size], 'little')
+        offset += size
+        return format_sql_bytes(bytes(data[offset:offset + value_len])), offset + value_len
+    if column_type == MYSQL_TYPE_NEWDECIMAL:
+        return decode_newdecimal(data, offset, meta >> 8, meta & 0xff)
+    if column_type == MYSQL_TYPE_DATETIME2:
+        return decode_datetime2(data, offset, meta)
+    if column_type == MYSQL_TYPE_TIMESTAMP2:
+        seconds = int.from_bytes(data[offset:offset + 4], 'big')
+        frac, size = read_fraction(data, offset + 4, meta)
+        microsecond = frac * (10 ** (6 - 2 * size)) if size else 0
+        return format_timestamp_value(seconds, microsecond, meta), offset + 4 + size
+    if column_type == MYSQL_TYPE_TIME2:
+        return decode_time2(data, offset, meta)
+    if column_type in (MYSQL_TYPE_DATE, MYSQL_TYPE_NEWDATE):
+        value = int.from_bytes(data[offset:offset + 3], 'little')
+        return "'%04d-%02d-%02d'" % (value >> 9, (value >> 5) & 15, value & 31), offset + 3
+    if column_type in (MYSQL_TYPE_BLOB, MYSQL_TYPE_GEOMETRY, MYSQL_TYPE_TINY_BLOB,
+                       MYSQL_TYPE_MEDIUM_BLOB, MYSQL_TYPE_LONG_BLOB, MYSQL_TYPE_VECTOR):
+        length = int.from_bytes(data[offset:offset + meta], 'little')
+        offset += meta
+        return format_sql_bytes(bytes(data[offset:offset + length])), offset + length
+    if column_type == MYSQL_TYPE_JSON:
+        length = int.from_bytes(data[offset:offset + meta], 'little')
+        offset += meta
+        raw = data[offset:offset + length]
+        doc = decode_json_value(raw[0], raw, 1) if length else None
+        return quote_sql_string(json.dumps(doc, ensure_ascii=False)), offset + length
+    if column_type == MYSQL_TYPE_FLOAT:
+        return format_sql_float(bytes(data[offset:offset + 4])), offset + 4
+    if column_type == MYSQL_TYPE_DOUBLE:
+        return repr(DOUBLE_FORMAT.unpack_from(data, offset)[0]), offset + 8
+    if column_type == MYSQL_TYPE_YEAR:
+        year = data[offset]
+        return str(1900 + year if year else 0), offset + 1
+    if column_type == MYSQL_TYPE_BIT:
+        bits, nbytes = meta >> 8, meta & 0xff
+        size = nbytes + (1 if bits else 0)
+        value = int.from_bytes(data[offset:offset + size], 'big')
+        return f"b'{value:b}'", offset + size
+    if column_type == MYSQL_TYPE_TIMESTAMP:
+        return format_timestamp_value(int.from_bytes(data[offset:offset + 4], 'little')), offset + 4
+    if column_type == MYSQL_TYPE_DATETIME:
+        value = int.from_bytes(data[offset:offset + 8], 'little')
+        date, clock = divmod(value, 1000000)
+        return "'%04d-%02d-%02d %02d:%02d:%02d'" % (
+            date // 10000, date // 100 % 100, date % 100, clock // 10000, clock // 100 % 100, clock % 100), offset + 8
+    if column_type == MYSQL_TYPE_TIME:
+        value = int.from_bytes(data[offset:offset + 3], 'little', signed=True)
+        sign = '-' if value < 0 else ''
+        value = abs(value)
+        return "'%s%02d:%02d:%02d'" % (sign, value // 10000, value // 100 % 100, value % 100), offset + 3
+    if column_type == MYSQL_TYPE_NULL:
+        return 'NULL', offset
+    raise ValueError(f"不支持的列类型: {column_type}")
+
+def decode_row_image(table_map, present, data, offset):
+    """
+    解析一个行镜像，返回({列序号(从1开始): SQL字面量}, 新偏移)
+    """
+    null_bitmap_len = (len(present) + 7) // 8
+    null_bitmap = data[offset:offset + null_bitmap_len]
+    offset += null_bitmap_len
+    column_types = table_map['column_types']
+    column_meta = table_map['column_meta']
+    unsigned = table_map['unsigned']
+    values = {}
+    for n, column in enumerate(present):
+        if null_bitmap[n >> 3] & (1 << (n & 7)):
+            values[column + 1] = 'NULL'
+            continue
+        values[column + 1], offset = decode_column_value(
+            column_types[column], column_meta[column], unsigned[column], data, offset)
+    return values, offset
+
+def read_column_bitmap(data, offset, column_count):
+    """
+    读取列位图，返回(出现的列下标列表, 新偏移)
+    """
+    size = (column_count + 7) // 8
+    bitmap = data[offset:offset + size]
+    present = [i for i in range(column_count) if bitmap[i >> 3] & (1 << (i & 7))]
+    return present, offset + size
+
+def decode_rows_event(event_type, body, table_maps, post_header_len=8):
+    """
+    解析WRITE/UPDATE/DELETE_ROWS事件(v1/v2)
+
+    返回(table_map, 行列表)，UPDATE的每行为(前镜像, 后镜像)，其余为单个镜像；
+    找不到对应TABLE_MAP时返回(None, [])。
+    """
+    table_id_len = 4 if post_header_len == 6 else 6
+    table_id = int.from_bytes(body[:table_id_len], 'little')
+    table_map = table_maps.get(table_id)
+    if table_map is None:
+        return None, []
+    offset = table_id_len + 2
+    if event_type in ROWS_EVENT_V2:
+        extra_len = int.from_bytes(body[offset:offset + 2], 'little')
+        offset += extra_len
+    column_count, offset = read_packed_int(body, offset)
+    present, offset = read_column_bitmap(body, offset, column_count)
+    is_update = ROWS_EVENT_KINDS[event_type] == 'UPDATE'
+    if is_update:
+        present_after, offset = read_column_bitmap(body, offset, column_count)
+
+    data = memoryview(body)
+    rows = []
+    while offset < len(body):
+        before, offset = decode_row_image(table_map, present, data, offset)
+        if is_update:
+            after, offset = decode_row_image(table_map, present_after, data, offset)
+            rows.append((before, after))
+        else:
+            rows.append(before)
+    return table_map, rows
+
+def parse_query_event(body):
+    """
+    解析QUERY事件，返回(默认库, SQL文本)
+    """
+    db_len = body[8]
+    status_len = int.from_bytes(body[11:13], 'little')
+    offset = 13 + status_len
+    database = body[offset:offset + db_len].decode('utf-8', errors='replace')
+    query = body[offset + db_len + 1:].decode('utf-8', errors='replace')
+    return database, query
+
+def parse_gtid_event(body):
+    """
+    解析GTID事件，返回"uuid:gno"
+    """
+    sid = body[1:17].hex()
+    gno = int.from_bytes(body[17:25], 'little')
+    return f"{sid[:8]}-{sid[8:12]}-{sid[12:16]}-{sid[16:20]}-{sid[20:]}:{gno}"
+
+# 命令行时间参数: "2025-11-17 10:10:57" 或 "2025-11-17_10:10:57"
+DATETIME_ARG_RE = re.compile(r'^\d{4}-\d{2}-\d{2}[ _]\d{2}:\d{2}:\d{2}$')
+
+def parse_datetime_arg(value):
+    """
+    将命令行时间参数转为时间戳（按本地时区，与mysqlbinlog一致）
+    """
+    if not value:
         return None
+    return time.mktime(datetime.strptime(value.replace('_', ' '), '%Y-%m-%d %H:%M:%S').timetuple())
 
-def analyze_binlog(binlog_file, starttime=None, stoptime=None):
+def post_header_length(post_header_len, event_type, default):
     """
-    分析binlog，生成统计报告，支持DML事件
+    从FORMAT_DESCRIPTION中取指定事件类型的post-header长度
     """
-    extra_args = []
-    if starttime:
-        extra_args.append('--start-datetime={}'.format(starttime))
-    if stoptime:
-        extra_args.append('--stop-datetime={}'.format(stoptime))
-    output = run_mysqlbinlog(binlog_file, extra_args)
-    if output is None:
-        sys.exit(1)
-    lines = output.splitlines()
+    if len(post_header_len) >= event_type:
+        return post_header_len[event_type - 1]
+    return default
 
-    stats = defaultdict(lambda: {'inserts': 0, 'updates': 0, 'deletes': 0, 'starttime': None, 'stoptime': None, 'startpos': float('inf'), 'stoppos': 0})
-    current_db = ''
-    current_table = ''
-    current_pos = 0
-    current_time = ''
-    in_event = False
-    event_type = ''
-    row_count = 0
-    stoppos = 0
-    in_query = False
-    current_sql = ''
-    prev_line = ''
-    key = None
-    current_table_map_pos = 0
+def iter_native_events(binlog_file, start_position=None, stop_position=None,
+                       start_datetime=None, stop_datetime=None, table_filter=None, filter_stats=None):
+    """
+    原生读取binlog，逐个产出解码后的事件(类型, table_map, 数据, 时间戳, 起始位置, 结束位置)
 
-    for line in lines:
-        pos_match = re.search(r'at (\d+)', line)
-        if pos_match:
-            if in_event:
-                if key is not None:
-                    stats[key][event_type] += row_count
-                    stats[key]['stoppos'] = max(stats[key]['stoppos'], stoppos)
-                in_event = False
-            current_pos = int(pos_match.group(1))
+    类型为INSERT/UPDATE/DELETE时数据是行列表，TABLE_MAP只带table_map，
+    QUERY为(默认库, SQL)，GTID为"uuid:gno"，XID为事务号，其余事件不产出。
+    table_filter(库, 表)返回False的表，其TABLE_MAP和行事件都不产出，行数据不解码。
+    """
+    start_ts = parse_datetime_arg(start_datetime)
+    stop_ts = parse_datetime_arg(stop_datetime)
+    table_maps = {}
+    skipped_tables = set()
+    post_header_len = b''
+
+    for event_type, timestamp, pos, next_pos, body in iter_binlog_events(binlog_file, start_position, stop_position):
+        if event_type == FORMAT_DESCRIPTION_EVENT:
+            post_header_len = parse_format_description(body)['post_header_len']
+            continue
+        if stop_ts is not None and timestamp >= stop_ts:
+            break
+        if start_ts is not None and timestamp < start_ts:
             continue
 
-        time_match = re.match(r'#(\d{6} \d{2}:\d{2}:\d{2})', line)
-        if time_match:
-            current_time = datetime.strptime('20{}'.format(time_match.group(1)), '%Y%m%d %H:%M:%S').strftime('%Y-%m-%d_%H:%M:%S')
-
-        use_match = re.search(r'USE `(.*?)`', line, re.IGNORECASE)
-        if use_match:
-            current_db = use_match.group(1)
-
-        table_map = re.search(r'Table_map: `(.*?)`\.`(.*?)`', line, re.IGNORECASE)
-        if table_map:
-            current_db = table_map.group(1)
-            current_table = table_map.group(2)
-            key = (current_db, current_table)
-            current_table_map_pos = current_pos
-
-        if 'Write_rows' in line:
-            event_type = 'inserts'
-            in_event = True
-            row_count = 0
-            end_pos_match = re.search(r'end_log_pos (\d+)', line)
-            if end_pos_match:
-                stoppos = int(end_pos_match.group(1))
-        elif 'Update_rows' in line:
-            event_type = 'updates'
-            in_event = True
-            row_count = 0
-            end_pos_match = re.search(r'end_log_pos (\d+)', line)
-            if end_pos_match:
-                stoppos = int(end_pos_match.group(1))
-        elif 'Delete_rows' in line:
-            event_type = 'deletes'
-            in_event = True
-            row_count = 0
-            end_pos_match = re.search(r'end_log_pos (\d+)', line)
-            if end_pos_match:
-                stoppos = int(end_pos_match.group(1))
-
-        if in_event and key is not None:
-            if current_time:
-                if stats[key]['starttime'] is None or current_time < stats[key]['starttime']:
-                    stats[key]['starttime'] = current_time
-                    stats[key]['startpos'] = min(stats[key]['startpos'], current_table_map_pos)
-                stats[key]['stoptime'] = max(stats[key]['stoptime'] or current_time, current_time)
-
-            if event_type == 'inserts' and '### SET' in line:
-                row_count += 1
-            elif event_type in ('updates', 'deletes') and '### WHERE' in line:
-                row_count += 1
+        if event_type == TABLE_MAP_EVENT:
+            table_map = parse_table_map(body, post_header_length(post_header_len, TABLE_MAP_EVENT, 8))
+            if table_filter is not None and not table_filter(table_map['database'], table_map['table']):
+                table_maps.pop(table_map['table_id'], None)
+                skipped_tables.add(table_map['table_id'])
+                continue
+            skipped_tables.discard(table_map['table_id'])
+            table_maps[table_map['table_id']] = table_map
+            yield 'TABLE_MAP', table_map, None, timestamp, pos, next_pos
+        elif event_type in ROWS_EVENT_KINDS:
+            default_len = 10 if event_type in ROWS_EVENT_V2 else 8
+            rows_post_header_len = post_header_length(post_header_len, event_type, default_len)
+            if filter_stats is not None:
+                filter_stats['rows_events'] += 1
+                filter_stats['bytes'] += len(body)
+            if skipped_tables:
+                table_id = int.from_bytes(body[:4 if rows_post_header_len == 6 else 6], 'little')
+                if table_id in skipped_tables:
+                    if filter_stats is not None:
+                        filter_stats['skipped_events'] += 1
+                        filter_stats['skipped_bytes'] += len(body)
+                    continue
+            table_map, rows = decode_rows_event(event_type, body, table_maps, rows_post_header_len)
+            if table_map is not None:
+                yield ROWS_EVENT_KINDS[event_type], table_map, rows, timestamp, pos, next_pos
+        elif event_type == QUERY_EVENT:
+            yield 'QUERY', None, parse_query_event(body), timestamp, pos, next_pos
+        elif event_type in (GTID_EVENT, ANONYMOUS_GTID_EVENT):
+            yield 'GTID', None, parse_gtid_event(body), timestamp, pos, next_pos
+        elif event_type == XID_EVENT:
+            yield 'XID', None, int.from_bytes(body[:8], 'little'), timestamp, pos, next_pos
 
-        if 'Query' in line and 'thread_id' in line:
-            in_query = True
-            current_sql = ''
-            end_pos_match = re.search(r'end_log_pos (\d+)', line)
-            if end_pos_match:
-                stoppos = int(end_pos_match.group(1))
-        if in_query:
-            if not line.startswith('#') and line.strip():
-                current_sql += line.strip() + ' '
-            if ';' in line:
-                current_sql = current_sql.strip()
-                full_match = re.search(r'(`?(\w+)`?\.`?(\w+)`?)', current_sql, re.IGNORECASE)
-                if full_match:
-                    db = full_match.group(2)
-                    table = full_match.group(3)
-                    key = (db, table)
-                else:
-                    table_match = re.search(r'TABLE\s+(\w+)', current_sql, re.IGNORECASE)
-                    table = table_match.group(1) if table_match else 'unknown'
-                    db = current_db if current_db else 'unknown'
-                    key = (db, table)
-
-                sql_upper = current_sql.upper()
-                if any(kw in sql_upper for kw in ['CREATE', 'ALTER', 'DROP', 'TRUNCATE', 'RENAME']):
-                    stats[key]['updates'] += 1
-                elif 'INSERT' in sql_upper:
-                    stats[key]['inserts'] += 1
-                elif 'UPDATE' in sql_upper:
-                    stats[key]['updates'] += 1
-                elif 'DELETE' in sql_upper:
-                    stats[key]['deletes'] += 1
-
-                if current_time:
-                    if stats[key]['starttime'] is None or current_time < stats[key]['starttime']:
-                        stats[key]['starttime'] = current_time
-                        stats[key]['startpos'] = min(stats[key]['startpos'], current_pos)
-                    stats[key]['stoptime'] = max(stats[key]['stoptime'] or current_time, current_time)
-                stats[key]['stoppos'] = max(stats[key]['stoppos'], stoppos)
+# ---------------------------------------------------------------------------
+# 时间戳 -> 位置 索引（binlog旁的.tsidx文件）
+# ---------------------------------------------------------------------------
 
-                in_query = False
+BINLOG_INDEX_SUFFIX = '.tsidx'
+BINLOG_INDEX_VERSION = 1
 
-        prev_line = line
+def binlog_index_path(binlog_file):
+    """
+    索引文件路径
+    """
+    return binlog_file + BINLOG_INDEX_SUFFIX
 
-    if in_event and key is not None:
-        stats[key][event_type] += row_count
-        stats[key]['stoppos'] = max(stats[key]['stoppos'], stoppos)
+def binlog_identity(binlog_file):
+    """
+    返回用于判断binlog是否变化的(大小, 修改时间)
+    """
+    st = os.stat(binlog_file)
+    return st.st_size, st.st_mtime_ns
 
-    for stat_key in list(stats.keys()):
-        data = stats[stat_key]
-        if data['starttime'] is None:
-            del stats[stat_key]
+def build_binlog_index(binlog_file):
+    """
+    扫描binlog，生成检查点列表[(时间戳, 事务起始位置, GTID, 表集合), ...]
+
+    只在事务起始时间戳超过此前所有事件的最大时间戳时记录检查点，
+    因此检查点按时间戳严格递增，每秒至多一个：检查点之前的事件时间戳
+    都小于该检查点的时间戳。表集合记录该检查点到下一个检查点之间涉及的表。
+    """
+    checkpoints = []
+    max_timestamp = -1
+    # None: 事务之外；'gtid': GTID之后尚未BEGIN；'begin': BEGIN之后
+    transaction_state = None
+    tables = None
+
+    for event_type, timestamp, pos, next_pos, body in iter_binlog_events(binlog_file):
+        if event_type == FORMAT_DESCRIPTION_EVENT:
             continue
-        if data['stoptime'] is None:
-            data['stoptime'] = data['starttime']
-        if data['startpos'] == float('inf'):
-            data['startpos'] = data['stoppos']
 
-    binlog_name = binlog_file.split('/')[-1]
-    with open('binlog_stats.txt', 'w') as f:
-        header = "{0:<20} {1:<20} {2:<20} {3:<12} {4:<12} {5:<8} {6:<8} {7:<8} {8:<20} {9:<30}".format('binlog', 'starttime', 'stoptime', 'startpos', 'stoppos', 'inserts', 'updates', 'deletes', 'database', 'table')
-        f.write(header + '\n')
-        for (db, table), data in sorted(stats.items(), key=lambda x: x[1]['starttime'] or '9999-99-99_99:99:99'):
-            if any([data['inserts'], data['updates'], data['deletes']]):
-                line = "{0:<20} {1:<20} {2:<20} {3:<12} {4:<12} {5:<8} {6:<8} {7:<8} {8:<20} {9:<30}".format(binlog_name, data['starttime'], data['stoptime'], data['startpos'], data['stoppos'], data['inserts'], data['updates'], data['deletes'], db, table)
-                f.write(line + '\n')
-    print("Generated binlog_stats.txt")
+        starts_transaction = False
+        gtid = ''
+        if event_type in (GTID_EVENT, ANONYMOUS_GTID_EVENT):
+            starts_transaction = True
+            transaction_state = 'gtid'
+            if event_type == GTID_EVENT:
+                gtid = parse_gtid_event(body)
+        elif event_type == QUERY_EVENT:
+            statement = parse_query_event(body)[1].strip().upper()
+            if transaction_state is None:
+                starts_transaction = True
+            if statement == 'BEGIN':
+                transaction_state = 'begin'
+            elif statement in ('COMMIT', 'ROLLBACK') or transaction_state != 'begin':
+                # DDL自成一个事务
+                transaction_state = None
+        elif event_type == XID_EVENT:
+            transaction_state = None
+        elif event_type == TABLE_MAP_EVENT and tables is not None:
+            table_map = parse_table_map(body)
+            tables.add(f"{table_map['database']}.{table_map['table']}")
+
+        if starts_transaction and timestamp > max_timestamp:
+            tables = set()
+            checkpoints.append((timestamp, pos, gtid, tables))
+        if timestamp > max_timestamp:
+            max_timestamp = timestamp
+
+    return checkpoints
+
+def write_binlog_index(binlog_file, checkpoints, identity):
+    """
+    写入索引文件：首行为JSON头，之后每行"时间戳\t位置\tGTID\t库.表,库.表"
+    """
+    size, mtime_ns = identity
+    header = {'version': BINLOG_INDEX_VERSION, 'binlog': os.path.basename(binlog_file),
+              'size': size, 'mtime_ns': mtime_ns, 'checkpoints': len(checkpoints)}
+    index_file = binlog_index_path(binlog_file)
+    temp_file = index_file + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(header) + '\n')
+        for timestamp, pos, gtid, tables in checkpoints:
+            f.write(f"{timestamp}\t{pos}\t{gtid}\t{','.join(sorted(tables))}\n")
+    os.replace(temp_file, index_file)
+    return index_file
+
+def load_binlog_index(binlog_file):
+    """
+    读取索引文件，返回检查点列表；索引不存在或binlog大小/修改时间已变化时返回None
+    """
+    index_file = binlog_index_path(binlog_file)
+    try:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != BINLOG_INDEX_VERSION:
+                return None
+            if (header.get('size'), header.get('mtime_ns')) != binlog_identity(binlog_file):
+                log_detail(f"索引已过期，忽略: {index_file}")
+                return None
+            checkpoints = []
+            for line in f:
+                timestamp, pos, gtid, tables = line.rstrip('\n').split('\t')
+                checkpoints.append((int(timestamp), int(pos), gtid, set(tables.split(',')) if tables else set()))
+            return checkpoints
+    except (OSError, ValueError):
+        return None
+
+def index_binlog(binlog_file, force=False):
+    """
+    为binlog生成索引文件，已有有效索引且未指定force时跳过；返回(索引文件, 检查点数, 是否重建)
+    """
+    if not force:
+        checkpoints = load_binlog_index(binlog_file)
+        if checkpoints is not None:
+            return binlog_index_path(binlog_file), len(checkpoints), False
+    identity = binlog_identity(binlog_file)
+    checkpoints = build_binlog_index(binlog_file)
+    if binlog_identity(binlog_file) != identity:
+        # 扫描期间文件仍在写入，按扫描前的大小记录会导致误判，下次重建
+        identity = (0, 0)
+    return write_binlog_index(binlog_file, checkpoints, identity), len(checkpoints), True
+
+def resolve_datetime_positions(binlog_file, start_datetime=None, stop_datetime=None,
+                               start_position=None, stop_position=None):
+    """
+    利用索引把时间范围换算成位置范围，返回(开始位置, 结束位置)
+
+    没有有效索引或没有时间过滤时原样返回。时间过滤仍需同时传给解析器，
+    换算出的位置只用于跳过范围之外的数据。
+    """
+    if not (start_datetime or stop_datetime):
+        return start_position, stop_position
+    checkpoints = load_binlog_index(binlog_file)
+    if not checkpoints:
+        return start_position, stop_position
+
+    timestamps = [checkpoint[0] for checkpoint in checkpoints]
+    start_ts = parse_datetime_arg(start_datetime)
+    stop_ts = parse_datetime_arg(stop_datetime)
+
+    if start_ts is not None:
+        k = bisect.bisect_right(timestamps, start_ts) - 1
+        if k > 0:
+            start_position = max(start_position or 4, checkpoints[k][1])
+    if stop_ts is not None:
+        k = bisect.bisect_left(timestamps, stop_ts)
+        if k < len(checkpoints):
+            stop_position = min(stop_position, checkpoints[k][1]) if stop_position else checkpoints[k][1]
+
+    log_detail(f"根据索引将时间范围定位到位置 {start_position}-{stop_position}")
+    return start_position, stop_position
+
+# ---------------------------------------------------------------------------
+# binlog序列的时间范围规划：按各文件首尾事件的时间戳二分查找，只读取与时间范围重叠的文件
+# ---------------------------------------------------------------------------
+
+BINLOG_BOUNDS_VERSION = 1
+BINLOG_BOUNDS_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'binlog-tools', 'bounds.json')
+# 在文件末尾这么多字节内查找ROTATE/STOP事件（文件名最长512字节）
+BINLOG_TAIL_BYTES = 1024
+# 事件时间是语句开始时间，跨越切换的长事务会以更早的时间写入下一个文件
+PLAN_TIME_SLACK_SECONDS = 300
+
+def read_first_timestamp(binlog_file):
+    """
+    第一个带时间戳的事件（FORMAT_DESCRIPTION，即文件创建时间）的时间戳
+    """
+    for _event_type, timestamp, _pos, _next_pos in scan_event_headers(binlog_file):
+        if timestamp:
+            return timestamp
+    raise ValueError(f"{binlog_file} 中没有事件")
+
+def read_tail_timestamp(binlog_file):
+    """
+    读取文件末尾的ROTATE/STOP事件，返回其时间戳；没有（活跃或异常结束的binlog）时返回None
+
+    末尾事件的结束位置等于文件大小，从文件末尾向前逐字节尝试即可找到其事件头。
+    """
+    with open(binlog_file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        begin = max(size - BINLOG_TAIL_BYTES, 4)
+        f.seek(begin)
+        tail = f.read(size - begin)
+    for offset in range(len(tail) - EVENT_HEADER_LEN, -1, -1):
+        timestamp, event_type, _server_id, event_size, log_pos, _flags = EVENT_HEADER.unpack_from(tail, offset)
+        if event_type in (ROTATE_EVENT, STOP_EVENT) and offset + event_size == len(tail) and log_pos == size:
+            return timestamp
+    return None
+
+def read_binlog_bounds(binlog_file):
+    """
+    返回(首事件时间戳, 末事件时间戳, 文件是否已关闭)
+
+    已关闭的binlog只读文件头和末尾的ROTATE/STOP事件；没有末尾事件时扫描所有事件头取最大时间戳。
+    压缩文件无法从末尾读取，同样扫描事件头，归档文件视为已关闭。
+    """
+    first = read_first_timestamp(binlog_file)
+    compressed = is_compressed_binlog(binlog_file)
+    last = None if compressed else read_tail_timestamp(binlog_file)
+    if last is not None:
+        return first, last, True
+    last = first
+    for _event_type, timestamp, _pos, _next_pos in scan_event_headers(binlog_file):
+        if timestamp > last:
+            last = timestamp
+    return first, last, compressed
+
+class BinlogBounds:
+    """
+    按需读取binlog序列中各文件的首尾时间戳，供bisect二分查找
+
+    按下标取值得到首事件时间戳，只有被访问到的文件才会打开。已关闭文件的结果
+    写入cache_file（按路径、inode、大小、修改时间识别），之后不再打开。
+    """
+
+    def __init__(self, binlog_files, cache_file=None):
+        self.binlog_files = binlog_files
+        self.cache_file = cache_file
+        self.bounds = {}
+        self.cache = {}
+        self.changed = False
+        if cache_file:
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    cache = json.load(f)
+                if cache.get('version') == BINLOG_BOUNDS_VERSION:
+                    self.cache = cache['files']
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def __len__(self):
+        return len(self.binlog_files)
+
+    def __getitem__(self, i):
+        return self.get(i)[0]
+
+    def last(self, i):
+        return self.get(i)[1]
+
+    def get(self, i):
+        bounds = self.bounds.get(i)
+        if bounds is not None:
+            return bounds
+        binlog_file = self.binlog_files[i]
+        path = os.path.abspath(binlog_file)
+        st = os.stat(binlog_file)
+        identity = [st.st_ino, st.st_size, st.st_mtime_ns]
+        entry = self.cache.get(path)
+        if entry and entry['identity'] == identity:
+            bounds = self.bounds[i] = (entry['first'], entry['last'])
+            return bounds
+        first, last, closed = read_binlog_bounds(binlog_file)
+        log_detail(f"{os.path.basename(binlog_file)}: {format_timestamp(first)} ~ {format_timestamp(last)}")
+        # 后面还有文件说明服务器已切换到新文件，异常结束（没有ROTATE）的文件也不会再增长
+        if closed or i < len(self.binlog_files) - 1:
+            self.cache[path] = {'identity': identity, 'first': first, 'last': last}
+            self.changed = True
+        bounds = self.bounds[i] = (first, last)
+        return bounds
+
+    def save(self):
+        if not (self.cache_file and self.changed):
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            temp_file = self.cache_file + '.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump({'version': BINLOG_BOUNDS_VERSION, 'files': self.cache}, f)
+            os.replace(temp_file, self.cache_file)
+        except OSError as e:
+            log_normal(f"警告: 无法写入binlog时间范围缓存 {self.cache_file}: {e}")
+
+def format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+def plan_binlog_files(binlog_files, start_datetime=None, stop_datetime=None, slack=PLAN_TIME_SLACK_SECONDS,
+                      cache_file=BINLOG_BOUNDS_CACHE):
+    """
+    从按序排列的binlog文件中选出可能包含[start_datetime, stop_datetime)内事件的连续一段
+
+    文件i的事件时间不晚于它的末尾事件（切换时间），也不晚于文件i+1的创建时间，
+    因此按首事件时间戳二分查找即可确定范围，只需打开O(log n)个文件。
+    开始一侧再读取一个文件的末尾事件排除停机造成的空档；结束一侧多留slack秒，
+    包含以更早时间写入下一个文件的长事务。时间过滤仍由解析器逐个事件判断。
+    """
+    start_ts = parse_datetime_arg(start_datetime)
+    stop_ts = parse_datetime_arg(stop_datetime)
+    if not binlog_files or (start_ts is None and stop_ts is None):
+        return list(binlog_files)
+    bounds = BinlogBounds(binlog_files, cache_file)
+    try:
+        lo = 0
+        if start_ts is not None:
+            lo = max(bisect.bisect_left(bounds, start_ts) - 1, 0)
+            if lo < len(binlog_files) - 1 and bounds.last(lo) < start_ts:
+                lo += 1
+        hi = len(binlog_files)
+        if stop_ts is not None:
+            hi = max(bisect.bisect_right(bounds, stop_ts + slack), lo)
+    finally:
+        bounds.save()
+    selected = binlog_files[lo:hi]
+    if selected:
+        log_normal(f"时间范围涉及 {len(selected)}/{len(binlog_files)} 个binlog: "
+                   f"{os.path.basename(selected[0])} ~ {os.path.basename(selected[-1])}")
+    else:
+        log_normal(f"{len(binlog_files)} 个binlog都不包含该时间范围的事件")
+    return selected
+
+# mysqlbinlog事件头: "#251117 10:10:57 server id 1  end_log_pos 430 CRC32 0x... \tDelete_rows: ..."
+EVENT_HEADER_RE = re.compile(r'end_log_pos (\d+)[^\t]*\t(\w+)')
+TABLE_MAP_RE = re.compile(r'Table_map: `(.*?)`\.`(.*?)`')
+USE_RE = re.compile(r'use `(.*?)`')
+
+# 行事件类型 -> 统计项
+ROWS_EVENT_COUNTERS = {
+    'Write_rows': 'inserts', 'Write_rows_v1': 'inserts',
+    'Update_rows': 'updates', 'Update_rows_v1': 'updates',
+    'Delete_rows': 'deletes', 'Delete_rows_v1': 'deletes',
+}
+
+# 行事件内每行以"### INSERT/UPDATE/DELETE"开头
+ROW_START_CHARS = frozenset('IUD')
+
+def new_table_stats():
+    """
+    单个表的初始统计项
+    """
+    return {'inserts': 0, 'updates': 0, 'deletes': 0, 'starttime': None, 'stoptime': None, 'startpos': float('inf'), 'stoppos': 0}
+
+def format_header_time(stamp, cache):
+    """
+    将事件头中的"251117 10:10:57"转为"2025-11-17_10:10:57"，同一秒只解析一次
+    """
+    value = cache.get(stamp)
+    if value is None:
+        if len(cache) > 65536:
+            cache.clear()
+        # mysqlbinlog的小时按%2d输出，个位数小时前面是空格
+        clock = stamp[7:].strip().rjust(8, '0')
+        value = '20{}-{}-{}_{}'.format(stamp[0:2], stamp[2:4], stamp[4:6], clock)
+        cache[stamp] = value
+    return value
+
+def classify_query(sql):
+    """
+    按SQL关键字判断QUERY事件计入哪个统计项，不计入时返回None
+    """
+    sql_upper = sql.upper()
+    if any(kw in sql_upper for kw in ['CREATE', 'ALTER', 'DROP', 'TRUNCATE', 'RENAME']):
+        return 'updates'
+    elif 'INSERT' in sql_upper:
+        return 'inserts'
+    elif 'UPDATE' in sql_upper:
+        return 'updates'
+    elif 'DELETE' in sql_upper:
+        return 'deletes'
+    return None
+
+def query_table_key(sql, current_db):
+    """
+    从SQL文本中提取(库, 表)
+    """
+    full_match = re.search(r'(`?(\w+)`?\.`?(\w+)`?)', sql, re.IGNORECASE)
+    if full_match:
+        return full_match.group(2), full_match.group(3)
+    table_match = re.search(r'TABLE\s+`?(\w+)`?', sql, re.IGNORECASE)
+    table = table_match.group(1) if table_match else 'unknown'
+    return current_db if current_db else 'unknown', table
+
+def collect_binlog_stats(lines, histogram=None, transactions=None):
+    """
+    逐行统计mysqlbinlog输出，返回按(库, 表)汇总的统计字典
+
+    按行首字符分派处理：只有"# at"和事件头需要解析，
+    行数据("###")只计数，不做其他处理。传入histogram（ActivityHistogram）时
+    同时按事件时间累计各时间桶的行数，传入transactions（TransactionTracker）时按事务累计。
+    """
+    stats = defaultdict(new_table_stats)
+    time_cache = {}
+    current_db = ''
+    current_pos = 0
+    current_time = ''
+    key = None
+    table_map_pos = 0
+    end_log_pos = 0
+
+    # 当前行事件
+    row_counter = None
+    row_count = 0
+    # 当前QUERY事件
+    in_query = False
+    sql_parts = []
+
+    for line in lines:
+        head = line[:2]
+
+        if head == '##':
+            # 行数据，只统计行数
+            if row_counter is not None and line[4:5] in ROW_START_CHARS:
+                row_count += 1
+            continue
+
+        if head == '# ':
+            if line.startswith('# at '):
+                if row_counter is not None:
+                    data = stats[key]
+                    data[row_counter] += row_count
+                    if histogram is not None and row_count:
+                        histogram.add(current_time, key, row_counter, row_count)
+                    if transactions is not None:
+                        transactions.rows(key, row_counter, row_count)
+                    if end_log_pos > data['stoppos']:
+                        data['stoppos'] = end_log_pos
+                    row_counter = None
+                in_query = False
+                current_pos = int(line[5:])
+            continue
+
+        if head[:1] == '#':
+            if not head[1:].isdigit():
+                continue
+
+            # 事件头
+            stamp = line[1:16]
+            current_time = time_cache.get(stamp) or format_header_time(stamp, time_cache)
+            header = EVENT_HEADER_RE.search(line)
+            if not header:
+                continue
+            end_log_pos = int(header.group(1))
+            event_name = header.group(2)
+
+            if event_name == 'Table_map':
+                table_map = TABLE_MAP_RE.search(line)
+                if table_map:
+                    current_db = table_map.group(1)
+                    key = (current_db, table_map.group(2))
+                    table_map_pos = current_pos
+            elif event_name in ROWS_EVENT_COUNTERS:
+                if key is None:
+                    continue
+                row_counter = ROWS_EVENT_COUNTERS[event_name]
+                row_count = 0
+                data = stats[key]
+                if data['starttime'] is None or current_time < data['starttime']:
+                    data['starttime'] = current_time
+                    data['startpos'] = min(data['startpos'], table_map_pos)
+                if data['stoptime'] is None or current_time > data['stoptime']:
+                    data['stoptime'] = current_time
+            elif event_name == 'Query':
+                in_query = True
+                sql_parts = []
+            elif transactions is not None:
+                if event_name == 'Xid':
+                    xid = line.rpartition('= ')[2].strip()
+                    transactions.commit(end_log_pos, current_time, int(xid) if xid.isdigit() else None)
+                elif event_name in ('GTID', 'Anonymous_GTID'):
+                    transactions.gtid(current_pos, None)
+            continue
+
+        if not in_query:
+            if transactions is not None and line.startswith('SET @@SESSION.GTID_NEXT='):
+                gtid = line.split("'")[1] if line.count("'") >= 2 else ''
+                if gtid and gtid != 'ANONYMOUS' and gtid != 'AUTOMATIC':
+                    transactions.gtid(current_pos, gtid)
+            continue
+
+        # QUERY事件体: 会话设置行以"/*!*/;"结尾，语句之后单独一行"/*!*/;"
+        if line.endswith('/*!*/;'):
+            if line != '/*!*/;':
+                if line.startswith('use '):
+                    use_match = USE_RE.match(line)
+                    if use_match:
+                        current_db = use_match.group(1)
+                continue
+            sql = ' '.join(sql_parts).strip()
+            sql_parts = []
+            if not sql or sql.upper() in ('BEGIN', 'COMMIT', 'ROLLBACK'):
+                if transactions is not None and sql:
+                    transactions.boundary(sql.upper(), current_pos, end_log_pos, current_time)
+                continue
+            counter = classify_query(sql)
+            if counter is None:
+                continue
+            query_key = query_table_key(sql, current_db)
+            data = stats[query_key]
+            data[counter] += 1
+            if histogram is not None:
+                histogram.add(current_time, query_key, counter, 1)
+            if transactions is not None:
+                transactions.rows(query_key, counter, 1)
+            if data['starttime'] is None or current_time < data['starttime']:
+                data['starttime'] = current_time
+                data['startpos'] = min(data['startpos'], current_pos)
+            if data['stoptime'] is None or current_time > data['stoptime']:
+                data['stoptime'] = current_time
+            if end_log_pos > data['stoppos']:
+                data['stoppos'] = end_log_pos
+        else:
+            sql_parts.append(line.strip())
+
+    if row_counter is not None:
+        data = stats[key]
+        data[row_counter] += row_count
+        if histogram is not None and row_count:
+            histogram.add(current_time, key, row_counter, row_count)
+        if transactions is not None:
+            transactions.rows(key, row_counter, row_count)
+        if end_log_pos > data['stoppos']:
+            data['stoppos'] = end_log_pos
+
+    for stat_key in list(stats.keys()):
+        data = stats[stat_key]
+        if data['starttime'] is None:
+            del stats[stat_key]
+            continue
+        if data['stoptime'] is None:
+            data['stoptime'] = data['starttime']
+        if data['startpos'] == float('inf'):
+            data['startpos'] = data['stoppos']
+
+    return dict(stats)
+
+def collect_native_binlog_stats(binlog_file, starttime=None, stoptime=None, start_position=None, stop_position=None,
+                                histogram=None, transactions=None):
+    """
+    原生读取binlog统计，结果格式与collect_binlog_stats一致
+    """
+    stats = defaultdict(new_table_stats)
+    time_cache = {}
+    table_map_pos = 0
+    counters = {'INSERT': 'inserts', 'UPDATE': 'updates', 'DELETE': 'deletes'}
+
+    def event_time(timestamp):
+        current_time = time_cache.get(timestamp)
+        if current_time is None:
+            current_time = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d_%H:%M:%S')
+            time_cache[timestamp] = current_time
+        return current_time
+
+    for kind, table_map, data, timestamp, pos, next_pos in iter_native_events(
+            binlog_file, start_position, stop_position, starttime, stoptime):
+        if kind == 'TABLE_MAP':
+            table_map_pos = pos
+            continue
+        if kind in counters:
+            key = (table_map['database'], table_map['table'])
+            counter = counters[kind]
+            startpos = table_map_pos
+            rows = len(data)
+        elif kind == 'QUERY':
+            current_db, sql = data
+            sql = sql.strip()
+            if sql.upper() in ('BEGIN', 'COMMIT', 'ROLLBACK'):
+                if transactions is not None:
+                    transactions.boundary(sql.upper(), pos, next_pos, event_time(timestamp))
+                continue
+            counter = classify_query(sql)
+            key = query_table_key(sql, current_db)
+            startpos = pos
+            rows = 1 if counter else 0
+        else:
+            if transactions is not None:
+                if kind == 'XID':
+                    transactions.commit(next_pos, event_time(timestamp), data)
+                elif kind == 'GTID':
+                    # 匿名GTID的uuid全为0
+                    transactions.gtid(pos, None if data.startswith('00000000-0000-0000-0000-000000000000') else data)
+            continue
+
+        current_time = event_time(timestamp)
+        data = stats[key]
+        if counter:
+            data[counter] += rows
+            if histogram is not None and rows:
+                histogram.add(current_time, key, counter, rows)
+            if transactions is not None:
+                transactions.rows(key, counter, rows)
+        if data['starttime'] is None or current_time < data['starttime']:
+            data['starttime'] = current_time
+            data['startpos'] = min(data['startpos'], startpos)
+        data['stoptime'] = max(data['stoptime'] or current_time, current_time)
+        data['stoppos'] = max(data['stoppos'], next_pos)
+
+    return dict(stats)
+
+STATS_FORMAT = "{0:<20} {1:<20} {2:<20} {3:<12} {4:<12} {5:<8} {6:<8} {7:<8} {8:<20} {9:<30}"
+MERGED_STATS_FORMAT = "{0:<20} {1:<20} {2:<20} {3:<20} {4:<12} {5:<12} {6:<8} {7:<8} {8:<8} {9:<20} {10:<30}"
+
+def expand_binlog_inputs(inputs):
+    """
+    展开binlog输入：普通文件、通配符或mysql-bin.index，返回去重后的文件列表
+    """
+    files = []
+    for item in inputs:
+        if item.endswith('.index'):
+            index_dir = os.path.dirname(os.path.abspath(item))
+            with open(item, 'r') as f:
+                for entry in f:
+                    entry = entry.strip()
+                    if entry:
+                        files.append(entry if os.path.isabs(entry) else os.path.normpath(os.path.join(index_dir, entry)))
+        elif glob.has_magic(item):
+            matched = sorted(glob.glob(item))
+            if not matched:
+                print(f"警告: 没有匹配 {item} 的文件")
+            files.extend(matched)
+        else:
+            files.append(item)
+
+    unique_files = []
+    seen = set()
+    for binlog_file in files:
+        if binlog_file not in seen:
+            seen.add(binlog_file)
+            unique_files.append(binlog_file)
+    return unique_files
+
+def collect_file_stats(binlog_file, starttime=None, stoptime=None, native=False,
+                       start_position=None, stop_position=None, histogram=None, transactions=None):
+    """
+    统计单个binlog文件（或其中一个位置区间），可在工作进程中执行
+    """
+    if native:
+        return collect_native_binlog_stats(binlog_file, starttime, stoptime, start_position, stop_position,
+                                           histogram, transactions)
+    extra_args = []
+    if starttime:
+        extra_args.append('--start-datetime={}'.format(starttime))
+    if stoptime:
+        extra_args.append('--stop-datetime={}'.format(stoptime))
+    if start_position:
+        extra_args.append('--start-position={}'.format(start_position))
+    if stop_position:
+        extra_args.append('--stop-position={}'.format(stop_position))
+    return collect_binlog_stats(iter_mysqlbinlog_lines(binlog_file, extra_args, verbose_flag='-vv'), histogram,
+                                transactions)
+
+def merge_table_stats(target, source):
+    """
+    合并同一binlog文件内的两份统计（如不同位置区间的结果），结果写入target
+    """
+    for key, data in source.items():
+        merged = target.get(key)
+        if merged is None:
+            target[key] = dict(data)
+            continue
+        for counter in ('inserts', 'updates', 'deletes'):
+            merged[counter] += data[counter]
+        if data['starttime'] < merged['starttime']:
+            merged['starttime'] = data['starttime']
+            merged['startpos'] = data['startpos']
+        elif data['starttime'] == merged['starttime']:
+            merged['startpos'] = min(merged['startpos'], data['startpos'])
+        merged['stoptime'] = max(merged['stoptime'], data['stoptime'])
+        merged['stoppos'] = max(merged['stoppos'], data['stoppos'])
+    return target
+
+def merge_file_stats(file_stats):
+    """
+    按binlog顺序合并多个文件的统计
+
+    位置只在文件内有意义，因此合并结果记录开始位置所在文件和结束位置所在文件。
+    """
+    merged = {}
+    for binlog_name, stats in file_stats:
+        for key, data in stats.items():
+            total = merged.get(key)
+            if total is None:
+                total = dict(data)
+                total['startfile'] = binlog_name
+                total['stopfile'] = binlog_name
+                merged[key] = total
+                continue
+            for counter in ('inserts', 'updates', 'deletes'):
+                total[counter] += data[counter]
+            # 时间、位置和所在文件一起更新，开始位置始终对应最早的开始时间
+            if data['starttime'] < total['starttime']:
+                total['starttime'] = data['starttime']
+                total['startpos'] = data['startpos']
+                total['startfile'] = binlog_name
+            # 文件按序处理，时间相同时结束位置取最后出现的文件
+            if data['stoptime'] >= total['stoptime']:
+                total['stoptime'] = data['stoptime']
+                total['stoppos'] = data['stoppos']
+                total['stopfile'] = binlog_name
+    return merged
+
+def write_binlog_stats(output_file, file_stats, merged=None, transactions=None, transaction_sort='rows'):
+    """
+    写统计报告：每个文件的明细，多文件时追加合并结果，传入transactions时追加最大的事务
+    """
+    def has_changes(data):
+        return any([data['inserts'], data['updates'], data['deletes']])
+
+    def by_starttime(item):
+        return item[1]['starttime'] or '9999-99-99_99:99:99'
+
+    with open(output_file, 'w') as f:
+        f.write(STATS_FORMAT.format('binlog', 'starttime', 'stoptime', 'startpos', 'stoppos', 'inserts', 'updates', 'deletes', 'database', 'table') + '\n')
+        for binlog_name, stats in file_stats:
+            for (db, table), data in sorted(stats.items(), key=by_starttime):
+                if has_changes(data):
+                    f.write(STATS_FORMAT.format(binlog_name, data['starttime'], data['stoptime'], data['startpos'], data['stoppos'], data['inserts'], data['updates'], data['deletes'], db, table) + '\n')
+
+        if merged is not None:
+            f.write('\n# 合计 ({} 个文件)\n'.format(len(file_stats)))
+            f.write(MERGED_STATS_FORMAT.format('startbinlog', 'stopbinlog', 'starttime', 'stoptime', 'startpos', 'stoppos', 'inserts', 'updates', 'deletes', 'database', 'table') + '\n')
+            for (db, table), data in sorted(merged.items(), key=by_starttime):
+                if has_changes(data):
+                    f.write(MERGED_STATS_FORMAT.format(data['startfile'], data['stopfile'], data['starttime'], data['stoptime'], data['startpos'], data['stoppos'], data['inserts'], data['updates'], data['deletes'], db, table) + '\n')
+
+        if transactions is not None:
+            write_transaction_report(f, transactions, transaction_sort)
+
+# ---------------------------------------------------------------------------
+# analyze --bucket：按时间桶统计各表的变更行数
+# ---------------------------------------------------------------------------
+
+BUCKET_UNITS = {'s': 1, 'm': 60, 'h': 3600}
+# 事件时间是语句开始时间，按提交顺序写入时会略有回退；桶在最新时间之后这么久才输出
+BUCKET_LATENESS_SECONDS = 300
+ACTIVITY_COUNTERS = ('inserts', 'updates', 'deletes')
+ACTIVITY_COLUMNS = ('bucket', 'database', 'table', 'inserts', 'updates', 'deletes')
+
+def parse_bucket_arg(value):
+    """
+    把"1s"、"5m"、"1h"转为秒数，桶必须能整除一天（按本地时间从零点对齐）
+    """
+    match = re.match(r'^(\d+)([smh])$', value.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"时间桶格式应为 数字+s/m/h，如 1s、1m、1h，而不是 {value}")
+    seconds = int(match.group(1)) * BUCKET_UNITS[match.group(2)]
+    if 86400 % seconds:
+        raise ValueError(f"时间桶 {value} 必须能整除一天")
+    return seconds
+
+def time_text_seconds(time_text):
+    """
+    "2025-11-17_10:10:57"转为 日序号*86400+当天秒数（本地时间，不经过时区换算）
+    """
+    moment = datetime.strptime(time_text, '%Y-%m-%d_%H:%M:%S')
+    return moment.toordinal() * 86400 + moment.hour * 3600 + moment.minute * 60 + moment.second
+
+def format_bucket(bucket):
+    """
+    桶编号（本地时间的 日序号*86400+当天秒数）转为"YYYY-MM-DD HH:MM:SS"
+    """
+    day, seconds = divmod(bucket, 86400)
+    return '{} {:02d}:{:02d}:{:02d}'.format(datetime.fromordinal(day).strftime('%Y-%m-%d'),
+                                             seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+class ActivityHistogram:
+    """
+    按时间桶累计各表的insert/update/delete行数
+
+    只保留最新时间之前BUCKET_LATENESS_SECONDS内的桶，更早的桶按时间顺序交给
+    sink(桶编号, {(库, 表): [inserts, updates, deletes]})，内存与时间范围长度无关。
+    迟于窗口到达、所属桶已输出的事件不再交给sink，累计在late中（同样按桶、按表），
+    由调用方最后并入已输出的结果，sink收到的桶编号严格递增且不重复。
+    """
+
+    def __init__(self, bucket_seconds, sink, lateness=BUCKET_LATENESS_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.sink = sink
+        self.lateness = max(lateness, bucket_seconds)
+        self.buckets = {}
+        self.newest = None
+        self.time_cache = {}
+        # 早于此编号的桶已输出，之后到达的计入late
+        self.flushed_before = None
+        self.late = {}
+
+    def bucket_of(self, time_text):
+        """
+        "2025-11-17_10:10:57"所在的桶编号，同一秒只计算一次
+        """
+        bucket = self.time_cache.get(time_text)
+        if bucket is None:
+            if len(self.time_cache) > 65536:
+                self.time_cache.clear()
+            seconds = time_text_seconds(time_text)
+            bucket = self.time_cache[time_text] = seconds - seconds % self.bucket_seconds
+        return bucket
+
+    def add(self, time_text, key, counter, rows):
+        if not time_text:
+            return
+        counts = [0, 0, 0]
+        counts[ACTIVITY_COUNTERS.index(counter)] = rows
+        self.add_counts(self.bucket_of(time_text), key, counts)
+
+    def add_counts(self, bucket, key, counts):
+        if self.flushed_before is not None and bucket < self.flushed_before:
+            add_bucket_counts(self.late.setdefault(bucket, {}), key, counts)
+            return
+        tables = self.buckets.get(bucket)
+        if tables is None:
+            tables = self.buckets[bucket] = {}
+            if self.newest is None or bucket > self.newest:
+                self.newest = bucket
+                self.flush(bucket - self.lateness)
+        add_bucket_counts(tables, key, counts)
+
+    def flush(self, before=None):
+        """
+        按时间顺序输出早于before的桶（before为None时输出全部，late中的桶不输出）
+        """
+        for bucket in sorted(bucket for bucket in self.buckets if before is None or bucket < before):
+            self.sink(bucket, self.buckets.pop(bucket))
+        if before is None:
+            before = self.newest + 1 if self.newest is not None else None
+        if before is not None and (self.flushed_before is None or before > self.flushed_before):
+            self.flushed_before = before
+
+def add_bucket_counts(tables, key, counts):
+    """
+    把一张表的[inserts, updates, deletes]累加到桶内
+    """
+    total = tables.get(key)
+    if total is None:
+        tables[key] = list(counts)
+    else:
+        for n, count in enumerate(counts):
+            total[n] += count
+
+def write_spilled_buckets(spill, bucket, tables):
+    """
+    工作进程把输出的桶逐表写入临时文件（JSON行）
+    """
+    for (db, table), counts in tables.items():
+        spill.write(json.dumps([bucket, db, table] + counts, ensure_ascii=False) + '\n')
+
+class ActivityWriter:
+    """
+    把时间桶写成CSV或JSON行（文件名以.json/.jsonl结尾），每个桶先写一行合计（库、表为空）
+    """
+
+    def __init__(self, output_file):
+        self.output = open(output_file, 'w', encoding='utf-8', newline='')
+        self.json_lines = output_file.endswith(('.json', '.jsonl'))
+        self.csv = None
+        if not self.json_lines:
+            self.csv = csv.writer(self.output)
+            self.csv.writerow(ACTIVITY_COLUMNS)
+        self.rows = 0
+
+    def write_row(self, bucket_text, db, table, counts):
+        if self.json_lines:
+            self.output.write(json.dumps(dict(zip(ACTIVITY_COLUMNS, [bucket_text, db, table] + counts)),
+                                         ensure_ascii=False) + '\n')
+        else:
+            self.csv.writerow([bucket_text, db or '', table or ''] + counts)
+        self.rows += 1
+
+    def write_bucket(self, bucket, tables):
+        self.write_tables(format_bucket(bucket), tables)
+
+    def write_tables(self, bucket_text, tables):
+        total = [sum(counts[n] for counts in tables.values()) for n in range(len(ACTIVITY_COUNTERS))]
+        self.write_row(bucket_text, None, None, total)
+        for (db, table), counts in sorted(tables.items()):
+            self.write_row(bucket_text, db, table, counts)
+
+    def close(self):
+        self.output.close()
+
+def merge_activity_files(spill_files, output_file, bucket_seconds):
+    """
+    按区间顺序合并工作进程的时间桶临时文件并写出（区间边界上被分开的桶重新合并），返回写出的行数
+    """
+    writer = ActivityWriter(output_file)
+    try:
+        histogram = ActivityHistogram(bucket_seconds, writer.write_bucket)
+        for spill_file in spill_files:
+            with open(spill_file, encoding='utf-8') as f:
+                for line in f:
+                    bucket, db, table, *counts = json.loads(line)
+                    histogram.add_counts(bucket, (db, table), counts)
+        histogram.flush()
+    finally:
+        writer.close()
+    if histogram.late:
+        return merge_late_buckets(output_file, histogram.late)
+    return writer.rows
+
+def read_activity_buckets(activity_file):
+    """
+    按桶读回ActivityWriter写出的文件，逐个产出(桶文本, {(库, 表): 计数})，不含每个桶的合计行
+    """
+    with open(activity_file, encoding='utf-8', newline='') as f:
+        if activity_file.endswith(('.json', '.jsonl')):
+            rows = ([row[column] for column in ACTIVITY_COLUMNS] for row in map(json.loads, f))
+        else:
+            rows = csv.reader(f)
+            next(rows, None)
+        bucket_text = None
+        tables = {}
+        for bucket, db, table, *counts in rows:
+            if bucket != bucket_text:
+                if bucket_text is not None:
+                    yield bucket_text, tables
+                # 每个桶的第一行是合计
+                bucket_text = bucket
+                tables = {}
+                continue
+            tables[(db, table)] = [int(count) for count in counts]
+        if bucket_text is not None:
+            yield bucket_text, tables
+
+def merge_late_buckets(activity_file, late):
+    """
+    把迟到的桶计数并入已写出的时间桶文件：已有的桶逐表累加并重算合计，没有的桶按时间插入。
+    逐桶读写，内存只与迟到的计数有关。返回写出的行数
+    """
+    late = sorted((format_bucket(bucket), tables) for bucket, tables in late.items())
+    # 临时文件保留扩展名，按同一格式写出
+    root, ext = os.path.splitext(activity_file)
+    temp_file = root + '.tmp' + ext
+    writer = ActivityWriter(temp_file)
+    try:
+        pending = iter(late)
+        next_late = next(pending, None)
+        for bucket_text, tables in read_activity_buckets(activity_file):
+            while next_late is not None and next_late[0] < bucket_text:
+                writer.write_tables(*next_late)
+                next_late = next(pending, None)
+            if next_late is not None and next_late[0] == bucket_text:
+                for key, counts in next_late[1].items():
+                    add_bucket_counts(tables, key, counts)
+                next_late = next(pending, None)
+            writer.write_tables(bucket_text, tables)
+        while next_late is not None:
+            writer.write_tables(*next_late)
+            next_late = next(pending, None)
+    except BaseException:
+        writer.close()
+        os.remove(temp_file)
+        raise
+    writer.close()
+    os.replace(temp_file, activity_file)
+    return writer.rows
+
+# ---------------------------------------------------------------------------
+# analyze --top-transactions：按行数、字节数或耗时找出最大的事务
+# ---------------------------------------------------------------------------
+
+TRANSACTION_SORT_KEYS = ('rows', 'bytes', 'duration')
+TRANSACTION_FORMAT = "{0:<20} {1:<12} {2:<12} {3:<20} {4:<20} {5:>8} {6:>10} {7:>12} {8:<44} {9}"
+# 报告中每个事务最多列出的表
+TRANSACTION_MAX_TABLES = 5
+
+def new_transaction(binlog_name, start_pos, gtid=None):
+    return {
+        'binlog': binlog_name, 'gtid': gtid, 'xid': None,
+        'start_pos': start_pos, 'end_pos': None, 'starttime': None, 'stoptime': None, 'duration': 0,
+        'rows': 0, 'inserts': 0, 'updates': 0, 'deletes': 0, 'bytes': 0, 'tables': {},
+    }
+
+def transaction_sort_key(txn, sort_by):
+    """
+    排序键：先按指定指标，相同时依次按行数、字节数，最后按位置保证结果稳定
+    """
+    return (txn[sort_by], txn['rows'], txn['bytes'], txn['binlog'], -txn['start_pos'])
+
+class TransactionTracker:
+    """
+    把事件按事务（GTID/BEGIN ... XID/COMMIT）归组，只保留最大的top个
+
+    事务从GTID事件开始（没有GTID时从BEGIN开始），到XID或COMMIT事件结束，
+    字节数为两者之间的事件总大小。用大小为top的最小堆筛选，内存与事务数无关；
+    回滚的事务和文件/区间末尾未结束的事务不计入。
+    """
+
+    def __init__(self, top, sort_by='rows', binlog_name=''):
+        self.top = top
+        self.sort_by = sort_by
+        self.binlog_name = binlog_name
+        self.heap = []
+        self.seq = 0
+        self.current = None
+        self.pending_gtid = None
+
+    def gtid(self, pos, gtid):
+        """
+        GTID事件：记录事务起点，gtid为None（匿名GTID）时保留已知的值
+        """
+        if self.pending_gtid and self.pending_gtid[0] == pos and gtid is None:
+            return
+        self.current = None
+        self.pending_gtid = (pos, gtid)
+
+    def boundary(self, statement, pos, end_pos, time_text):
+        """
+        BEGIN/COMMIT/ROLLBACK查询事件
+        """
+        if statement == 'BEGIN':
+            if self.pending_gtid:
+                start_pos, gtid = self.pending_gtid
+            else:
+                start_pos, gtid = pos, None
+            self.pending_gtid = None
+            self.current = new_transaction(self.binlog_name, start_pos, gtid)
+            self.current['starttime'] = time_text
+        elif statement == 'COMMIT':
+            self.commit(end_pos, time_text)
+        else:
+            self.current = None
+
+    def rows(self, key, counter, count):
+        txn = self.current
+        if txn is None or not count:
+            return
+        txn['rows'] += count
+        txn[counter] += count
+        tables = txn['tables']
+        tables[key] = tables.get(key, 0) + count
+
+    def commit(self, end_pos, time_text, xid=None):
+        txn = self.current
+        self.current = None
+        self.pending_gtid = None
+        if txn is None:
+            return
+        txn['xid'] = xid
+        txn['end_pos'] = end_pos
+        txn['stoptime'] = time_text
+        txn['bytes'] = end_pos - txn['start_pos']
+        if txn['starttime'] and time_text:
+            txn['duration'] = time_text_seconds(time_text) - time_text_seconds(txn['starttime'])
+        self.seq += 1
+        item = (transaction_sort_key(txn, self.sort_by), self.seq, txn)
+        if len(self.heap) < self.top:
+            heapq.heappush(self.heap, item)
+        elif item[0] > self.heap[0][0]:
+            heapq.heappushpop(self.heap, item)
+
+    def results(self):
+        """
+        按排序键从大到小返回保留的事务，表统计转为[[库, 表, 行数], ...]
+        """
+        transactions = []
+        for _key, _seq, txn in sorted(self.heap, key=lambda item: item[0], reverse=True):
+            txn = dict(txn)
+            txn['tables'] = [[db, table, count] for (db, table), count in
+                             sorted(txn['tables'].items(), key=lambda item: -item[1])]
+            transactions.append(txn)
+        return transactions
+
+def merge_top_transactions(transaction_lists, top, sort_by='rows'):
+    """
+    合并各区间的候选事务，返回最大的top个
+    """
+    return heapq.nlargest(top, (txn for transactions in transaction_lists for txn in transactions),
+                          key=lambda txn: transaction_sort_key(txn, sort_by))
+
+def format_transaction_tables(tables):
+    text = ', '.join(f"{db}.{table}({count})" for db, table, count in tables[:TRANSACTION_MAX_TABLES])
+    if len(tables) > TRANSACTION_MAX_TABLES:
+        text += f" (+{len(tables) - TRANSACTION_MAX_TABLES})"
+    return text
+
+def write_transaction_report(f, transactions, sort_by):
+    f.write('\n# 最大的 {} 个事务（按{}排序）\n'.format(len(transactions), sort_by))
+    f.write(TRANSACTION_FORMAT.format('binlog', 'startpos', 'stoppos', 'starttime', 'stoptime', 'duration',
+                                      'rows', 'bytes', 'gtid', 'tables') + '\n')
+    for txn in transactions:
+        f.write(TRANSACTION_FORMAT.format(txn['binlog'], txn['start_pos'], txn['end_pos'], txn['starttime'],
+                                          txn['stoptime'], txn['duration'], txn['rows'], txn['bytes'],
+                                          txn['gtid'] or '-', format_transaction_tables(txn['tables'])) + '\n')
+
+def collect_file_details(binlog_file, starttime=None, stoptime=None, native=False,
+                         start_position=None, stop_position=None, bucket_seconds=None, top=0,
+                         sort_by='rows', spill_dir=None):
+    """
+    同collect_file_stats，同时按需统计时间桶和最大的事务
+
+    返回(统计字典, 时间桶临时文件路径或None, 最大的top个事务)。
+    时间桶写入临时文件（JSON行），由merge_activity_files合并。
+    """
+    histogram = None
+    spill = None
+    transactions = TransactionTracker(top, sort_by, os.path.basename(binlog_file)) if top else None
+    if bucket_seconds:
+        spill = tempfile.NamedTemporaryFile('w', encoding='utf-8', prefix='binlog-activity-', suffix='.jsonl',
+                                            dir=spill_dir, delete=False)
+        histogram = ActivityHistogram(
+            bucket_seconds, lambda bucket, tables: write_spilled_buckets(spill, bucket, tables))
+    try:
+        stats = collect_file_stats(binlog_file, starttime, stoptime, native, start_position, stop_position,
+                                   histogram, transactions)
+        if spill is not None:
+            histogram.flush()
+            # 迟到的计数照常写入临时文件，合并时再并入所属的桶
+            for bucket, tables in sorted(histogram.late.items()):
+                write_spilled_buckets(spill, bucket, tables)
+            spill.close()
+    except BaseException:
+        if spill is not None:
+            spill.close()
+            os.unlink(spill.name)
+        raise
+    return (stats, spill.name if spill is not None else None,
+            transactions.results() if transactions is not None else [])
+
+# ---------------------------------------------------------------------------
+# analyze结果缓存（按binlog路径、inode、大小、修改时间识别）
+# ---------------------------------------------------------------------------
+
+ANALYZE_CACHE_VERSION = 1
+ANALYZE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'binlog-tools', 'analyze')
+ANALYZE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def find_transaction_end(binlog_file, start_position=None):
+    """
+    从start_position扫描事件头，返回最后一个完整事务的结束位置
+
+    XID之后、GTID事件处、ROTATE/STOP事件之后都是事务边界；
+    活跃binlog末尾未写完的事务不计入，下次从该位置继续。
+    """
+    end = start_position or 4
+    for event_type, _timestamp, pos, next_pos in scan_event_headers(binlog_file, start_position):
+        if event_type in (GTID_EVENT, ANONYMOUS_GTID_EVENT):
+            end = pos
+        elif event_type in (XID_EVENT, ROTATE_EVENT, STOP_EVENT):
+            end = next_pos
+    return end
+
+def analyze_cache_path(cache_dir, binlog_file, starttime, stoptime, native):
+    """
+    缓存文件路径：同一binlog在不同时间过滤、解析方式下分别缓存
+    """
+    key = json.dumps([os.path.abspath(binlog_file), starttime, stoptime, bool(native)])
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+def load_analyze_cache(cache_file, binlog_file):
+    """
+    读取缓存，返回(缓存内容, 是否完全命中)；binlog被替换或截断时返回(None, False)
+
+    同一inode且只增长的binlog可从缓存的结束位置继续统计。
+    """
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        st = os.stat(binlog_file)
+    except (OSError, ValueError):
+        return None, False
+    if entry.get('version') != ANALYZE_CACHE_VERSION or entry.get('inode') != st.st_ino:
+        return None, False
+    if is_compressed_binlog(binlog_file) and (st.st_size != entry['size'] or st.st_mtime_ns != entry['mtime_ns']):
+        # 归档文件不会增长，有变化就重新分析
+        return None, False
+    if st.st_size < entry['size'] or (st.st_size == entry['size'] and st.st_mtime_ns != entry['mtime_ns']):
+        return None, False
+    # 访问时间用于LRU淘汰
+    try:
+        os.utime(cache_file)
+    except OSError:
+        pass
+    entry['stats'] = {(db, table): data for db, table, data in entry['stats']}
+    hit = st.st_size == entry['size'] and (entry['end_position'] is None or entry['end_position'] >= st.st_size)
+    return entry, hit
+
+def save_analyze_cache(cache_file, binlog_file, identity, end_position, stats, max_bytes=ANALYZE_CACHE_MAX_BYTES):
+    """
+    写入缓存，然后按最近使用时间淘汰旧缓存，使缓存目录不超过max_bytes
+    """
+    cache_dir = os.path.dirname(cache_file)
+    inode, size, mtime_ns = identity
+    entry = {
+        'version': ANALYZE_CACHE_VERSION,
+        'binlog': os.path.abspath(binlog_file),
+        'inode': inode,
+        'size': size,
+        'mtime_ns': mtime_ns,
+        'end_position': end_position,
+        'stats': [[db, table, data] for (db, table), data in stats.items()],
+    }
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_file = cache_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(temp_file, cache_file)
+        evict_analyze_cache(cache_dir, max_bytes, keep=cache_file)
+    except OSError as e:
+        log_normal(f"警告: 无法写入analyze缓存 {cache_file}: {e}")
+
+def evict_analyze_cache(cache_dir, max_bytes, keep=None):
+    """
+    LRU淘汰：按修改时间从旧到新删除缓存文件（keep除外），直到总大小不超过max_bytes
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime_ns, st.st_size, path))
+        total += st.st_size
+    entries.sort()
+    for _mtime, size, path in entries:
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+            log_detail(f"淘汰analyze缓存: {path}")
+        except OSError:
+            pass
+
+def analyze_binlogs(binlog_files, starttime=None, stoptime=None, native=False, workers=None,
+                    output_file='binlog_stats.txt', split=1, cache_dir=None,
+                    cache_max_bytes=ANALYZE_CACHE_MAX_BYTES, metrics=None, bucket_seconds=None,
+                    bucket_output='binlog_activity.csv', top_transactions=0, transaction_sort='rows'):
+    """
+    分析多个binlog文件，最后合并生成报告
+
+    每个文件按事务边界切成split个位置区间，所有区间在进程池中并行统计，
+    再按文件合并。指定cache_dir时缓存每个文件的统计结果：文件未变化直接
+    复用，只增长时从上次的结束位置继续统计并合并到缓存结果中。
+    传入metrics（PhaseMetrics）时分阶段计时：plan、collect、merge、report；
+    collect阶段的CPU在工作进程中，计入报告的子进程CPU。
+    指定bucket_seconds时在同一遍统计中按时间桶累计各表行数，写入bucket_output（CSV或JSON行），
+    指定top_transactions时同样在这一遍中找出最大的事务（按transaction_sort排序），追加到报告末尾。
+    这两项都不使用缓存（缓存中只有按表汇总的统计）。
+    """
+    if starttime:
+        starttime = starttime.replace('_', ' ')
+    if stoptime:
+        stoptime = stoptime.replace('_', ' ')
+
+    failed = False
+    details = bool(bucket_seconds or top_transactions)
+    if details and cache_dir:
+        log_detail("按时间桶或事务统计需要完整解析，不使用缓存")
+        cache_dir = None
+    if details:
+        collector = collect_file_details
+        collector_args = (bucket_seconds, top_transactions, transaction_sort)
+    else:
+        collector = collect_file_stats
+        collector_args = ()
+    bucket_files = {}
+    transaction_lists = {}
+
+    def report_error(binlog_file, e):
+        if isinstance(e, subprocess.CalledProcessError):
+            print(f"Error running mysqlbinlog on {binlog_file}: {e.stderr}")
+        else:
+            print(f"Error reading {binlog_file}: {e}")
+
+    # 任务: (文件序号, 区间序号, 开始位置, 结束位置)
+    tasks = []
+    range_counts = [0] * len(binlog_files)
+    # 每个文件: 缓存命中的统计、续算的基础统计、(缓存文件, 标识, 结束位置)、末尾未完成事务的区间序号
+    cached_stats = [None] * len(binlog_files)
+    base_stats = [None] * len(binlog_files)
+    cache_plans = [None] * len(binlog_files)
+    tail_ranges = [None] * len(binlog_files)
+    if metrics is not None:
+        metrics.enter('plan')
+    for i, binlog_file in enumerate(binlog_files):
+        binlog_name = os.path.basename(binlog_file)
+        start_position, stop_position = resolve_datetime_positions(binlog_file, starttime, stoptime)
+
+        if cache_dir:
+            cache_file = analyze_cache_path(cache_dir, binlog_file, starttime, stoptime, native)
+            entry, hit = load_analyze_cache(cache_file, binlog_file)
+            if hit:
+                print(f"{binlog_name} 未变化，使用缓存结果")
+                cached_stats[i] = entry['stats']
+                continue
+            try:
+                st = os.stat(binlog_file)
+                resume_position = entry['end_position'] if entry else start_position
+                # 压缩的归档文件已经关闭，整个文件都是完整事务，不必先扫描一遍
+                end_position = (None if is_compressed_binlog(binlog_file)
+                                else find_transaction_end(binlog_file, resume_position))
+            except (OSError, ValueError) as e:
+                log_detail(f"{binlog_name} 无法缓存: {e}")
+            else:
+                if entry:
+                    print(f"{binlog_name} 从缓存位置 {resume_position} 继续分析")
+                    start_position = resume_position
+                    base_stats[i] = entry['stats']
+                cache_plans[i] = (cache_file, (st.st_ino, st.st_size, st.st_mtime_ns), end_position)
+
+        ranges = None
+        if cache_plans[i] and cache_plans[i][2] is not None:
+            # 完整事务部分写入缓存；末尾未完成的事务只计入本次报告
+            end_position = cache_plans[i][2]
+            main_stop = min(stop_position, end_position) if stop_position else end_position
+            ranges = []
+            if main_stop > (start_position or 4):
+                ranges = plan_split_ranges(binlog_file, split, start_position, main_stop)
+            if end_position < cache_plans[i][1][1] and (not stop_position or stop_position > end_position):
+                tail_ranges[i] = len(ranges)
+                ranges.append((end_position, stop_position))
+        else:
+            try:
+                ranges = plan_split_ranges(binlog_file, split, start_position, stop_position)
+            except (OSError, ValueError) as e:
+                print(f"警告: 无法切分 {binlog_file}，按单个区间分析: {e}")
+                ranges = [(start_position, stop_position)]
+        range_counts[i] = len(ranges)
+        if split > 1 and len(ranges) > 1:
+            print(f"{binlog_name} 切分为 {len(ranges)} 个区间并行分析")
+        for j, (start_position, stop_position) in enumerate(ranges):
+            tasks.append((i, j, start_position, stop_position))
+
+    partials = {}
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+    if metrics is not None:
+        metrics.enter('collect')
+
+    if workers <= 1:
+        for i, j, start_position, stop_position in tasks:
+            try:
+                partials[(i, j)] = collector(binlog_files[i], starttime, stoptime, native,
+                                             start_position, stop_position, *collector_args)
+            except (OSError, ValueError, subprocess.CalledProcessError) as e:
+                report_error(binlog_files[i], e)
+                failed = True
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(collector, binlog_files[i], starttime, stoptime, native,
+                                start_position, stop_position, *collector_args): (i, j)
+                for i, j, start_position, stop_position in tasks
+            }
+            for future in as_completed(futures):
+                i, j = futures[future]
+                try:
+                    partials[(i, j)] = future.result()
+                except (OSError, ValueError, subprocess.CalledProcessError) as e:
+                    report_error(binlog_files[i], e)
+                    failed = True
+    if details:
+        for task_key in list(partials):
+            partials[task_key], spill_file, transaction_lists[task_key] = partials[task_key]
+            if spill_file:
+                bucket_files[task_key] = spill_file
+
+    if metrics is not None:
+        collect = metrics.get('collect')
+        for (i, j), stats in partials.items():
+            collect['rows'] += sum(data['inserts'] + data['updates'] + data['deletes'] for data in stats.values())
+        for i, j, start_position, stop_position in tasks:
+            if (i, j) in partials:
+                try:
+                    end = stop_position or os.path.getsize(binlog_files[i])
+                except OSError:
+                    continue
+                collect['bytes'] += max(end - (start_position or 4), 0)
+        metrics.enter('merge')
+
+    file_stats = []
+    # 统计完整、写入报告的文件，只有它们的时间桶写入输出
+    reported_files = set()
+    for i, binlog_file in enumerate(binlog_files):
+        binlog_name = os.path.basename(binlog_file)
+        if cached_stats[i] is not None:
+            file_stats.append((binlog_name, cached_stats[i]))
+            continue
+        count = range_counts[i]
+        if not (count or cache_plans[i]) or any((i, j) not in partials for j in range(count)):
+            continue
+        stats = base_stats[i] or {}
+        for j in range(count):
+            if j != tail_ranges[i]:
+                merge_table_stats(stats, partials.pop((i, j)))
+        if cache_plans[i]:
+            cache_file, identity, end_position = cache_plans[i]
+            save_analyze_cache(cache_file, binlog_file, identity, end_position, stats, cache_max_bytes)
+        if tail_ranges[i] is not None:
+            merge_table_stats(stats, partials.pop((i, tail_ranges[i])))
+        file_stats.append((binlog_name, stats))
+        reported_files.add(i)
+    if not file_stats:
+        for spill_file in bucket_files.values():
+            os.unlink(spill_file)
+        sys.exit(1)
+
+    merged = merge_file_stats(file_stats) if len(binlog_files) > 1 else None
+    transactions = None
+    if top_transactions:
+        transactions = merge_top_transactions(
+            [transaction_lists[task_key] for task_key in transaction_lists if task_key[0] in reported_files],
+            top_transactions, transaction_sort)
+    if metrics is not None:
+        metrics.enter('report')
+    write_binlog_stats(output_file, file_stats, merged, transactions, transaction_sort)
+    if bucket_files:
+        try:
+            rows = merge_activity_files([bucket_files[task_key] for task_key in sorted(bucket_files)
+                                         if task_key[0] in reported_files], bucket_output, bucket_seconds)
+        finally:
+            for spill_file in bucket_files.values():
+                os.unlink(spill_file)
+    if metrics is not None:
+        metrics.enter(None)
+    print(f"Generated {output_file}")
+    if bucket_files:
+        print(f"Generated {bucket_output} ({rows} 行)")
+    if failed:
+        sys.exit(1)
+
+def analyze_binlog(binlog_file, starttime=None, stoptime=None, native=False, cache_dir=None):
+    """
+    分析binlog，生成统计报告，支持DML事件
+    """
+    analyze_binlogs([binlog_file], starttime, stoptime, native=native, workers=1, cache_dir=cache_dir)
+
+# ---------------------------------------------------------------------------
+# analyze --follow：持续读取正在写入的binlog，输出实时速率
+# ---------------------------------------------------------------------------
+
+FOLLOW_MAX_TABLES = 10000
+FOLLOW_TOP_TABLES = 20
+
+def next_binlog_file(binlog_file):
+    """
+    按序号推算下一个binlog文件名，如mysql-bin.000009 -> mysql-bin.000010
+    """
+    match = re.search(r'(\d+)$', binlog_file)
+    if not match:
+        return None
+    number = match.group(1)
+    return binlog_file[:match.start()] + str(int(number) + 1).zfill(len(number))
+
+def follow_binlog_events(binlog_file, start_position=None, poll_interval=1.0):
+    """
+    持续读取binlog，逐个产出(binlog文件, 类型, 时间戳, 起始位置, 结束位置, 事件体)
+
+    读到文件末尾（或写了一半的事件）时产出None并等待poll_interval秒后重试；
+    遇到ROTATE事件切换到其指向的文件，遇到STOP事件或下一个文件已出现
+    且当前文件不再增长时切换到序号加一的文件。永不结束，由调用方中断。
+    """
+    while True:
+        next_file = None
+        with open_binlog(binlog_file) as f:
+            pos = 4
+            checksum = False
+            seek_to = start_position if start_position and start_position > 4 else None
+            idle_with_next = False
+            while next_file is None:
+                header = f.read(EVENT_HEADER_LEN)
+                body = b''
+                event_size = EVENT_HEADER_LEN
+                if len(header) == EVENT_HEADER_LEN:
+                    timestamp, event_type, _server_id, event_size, _log_pos, _flags = EVENT_HEADER.unpack(header)
+                    if event_size < EVENT_HEADER_LEN:
+                        raise ValueError(f"{binlog_file} 位置 {pos} 的事件长度 {event_size} 无效，"
+                                         f"文件损坏或位置不是事件起点")
+                    body = f.read(event_size - EVENT_HEADER_LEN)
+                if len(header) < EVENT_HEADER_LEN or len(body) < event_size - EVENT_HEADER_LEN:
+                    # 事件尚未写完，回到事件起点等待
+                    f.seek(pos)
+                    candidate = next_binlog_file(binlog_file)
+                    if candidate and os.path.exists(candidate):
+                        # 再确认一次当前文件没有新数据后再切换（服务器异常重启时没有ROTATE）
+                        if idle_with_next:
+                            next_file = candidate
+                            break
+                        idle_with_next = True
+                    yield None
+                    time.sleep(poll_interval)
+                    continue
+                idle_with_next = False
+                next_pos = pos + event_size
+
+                if event_type == FORMAT_DESCRIPTION_EVENT:
+                    checksum = parse_format_description(body)['checksum']
+                if checksum:
+                    body = body[:-4]
+                yield binlog_file, event_type, timestamp, pos, next_pos, body
+
+                if event_type == ROTATE_EVENT:
+                    name = body[8:].decode('utf-8', errors='replace')
+                    next_file = os.path.join(os.path.dirname(binlog_file), name)
+                elif event_type == STOP_EVENT:
+                    next_file = next_binlog_file(binlog_file)
+                    while next_file and not os.path.exists(next_file):
+                        yield None
+                        time.sleep(poll_interval)
+                if event_type == FORMAT_DESCRIPTION_EVENT and seek_to:
+                    f.seek(seek_to)
+                    pos = seek_to
+                    seek_to = None
+                else:
+                    pos = next_pos
+        if next_file is None:
+            return
+        log_normal(f"切换到 {next_file}")
+        binlog_file = next_file
+        start_position = None
+
+class FollowStats:
+    """
+    follow模式的滚动统计：按表累计计数，按binlog事件时间统计最近window秒的速率
+
+    每秒一个桶，只保留window秒；表数超过max_tables时淘汰最久没有变化的表，
+    内存占用与运行时长无关。
+    """
+
+    def __init__(self, window=60, max_tables=FOLLOW_MAX_TABLES):
+        self.window = window
+        self.max_tables = max_tables
+        self.tables = {}
+        # (秒, 事件数, 行数, {表: 行数})
+        self.buckets = deque()
+        self.events = 0
+        self.rows = 0
+        self.evicted = 0
+        self.binlog_file = None
+        self.position = 0
+        self.last_timestamp = 0
+
+    def add_event(self, timestamp):
+        """
+        记录一个事件，返回当前秒的桶
+        """
+        self.events += 1
+        if timestamp > self.last_timestamp:
+            self.last_timestamp = timestamp
+        if not self.buckets or self.buckets[-1][0] != timestamp:
+            if self.buckets and timestamp < self.buckets[-1][0]:
+                # 时间回退（多线程提交或时钟调整）时并入最新的桶
+                timestamp = self.buckets[-1][0]
+            else:
+                self.buckets.append([timestamp, 0, 0, {}])
+                self.expire()
+        bucket = self.buckets[-1]
+        bucket[1] += 1
+        return bucket
+
+    def add_rows(self, bucket, key, counter, rows):
+        """
+        记录表的行变化
+        """
+        data = self.tables.pop(key, None)
+        if data is None:
+            data = {'inserts': 0, 'updates': 0, 'deletes': 0}
+        # 重新插入保持按最近变化排序，淘汰时从最旧的开始
+        self.tables[key] = data
+        data[counter] += rows
+        self.rows += rows
+        bucket[2] += rows
+        bucket[3][key] = bucket[3].get(key, 0) + rows
+        if len(self.tables) > self.max_tables:
+            del self.tables[next(iter(self.tables))]
+            self.evicted += 1
+
+    def expire(self):
+        """
+        丢弃窗口之外的桶
+        """
+        while self.buckets and self.buckets[0][0] <= self.last_timestamp - self.window:
+            self.buckets.popleft()
+
+    def snapshot(self, top=FOLLOW_TOP_TABLES):
+        """
+        返回当前统计快照（可直接序列化为JSON）
+        """
+        self.expire()
+        window_events = sum(bucket[1] for bucket in self.buckets)
+        window_rows = sum(bucket[2] for bucket in self.buckets)
+        table_rows = defaultdict(int)
+        for bucket in self.buckets:
+            for key, rows in bucket[3].items():
+                table_rows[key] += rows
+        active = sorted(table_rows.items(), key=lambda item: item[1], reverse=True)[:top]
+
+        tables = []
+        for (db, table), rows in active:
+            data = self.tables.get((db, table), {'inserts': 0, 'updates': 0, 'deletes': 0})
+            tables.append({
+                'database': db, 'table': table,
+                'rows_per_sec': round(rows / self.window, 2),
+                'inserts': data['inserts'], 'updates': data['updates'], 'deletes': data['deletes'],
+            })
+        return {
+            'time': datetime.fromtimestamp(self.last_timestamp).strftime('%Y-%m-%d %H:%M:%S') if self.last_timestamp else None,
+            'binlog': os.path.basename(self.binlog_file) if self.binlog_file else None,
+            'position': self.position,
+            'events': self.events,
+            'rows': self.rows,
+            'events_per_sec': round(window_events / self.window, 2),
+            'rows_per_sec': round(window_rows / self.window, 2),
+            'tables_tracked': len(self.tables),
+            'tables_evicted': self.evicted,
+            'tables': tables,
+        }
+
+def format_follow_snapshot(snapshot):
+    """
+    把快照格式化为文本
+    """
+    lines = [f"[{snapshot['time'] or '-'}] {snapshot['binlog']}:{snapshot['position']} "
+             f"events/s={snapshot['events_per_sec']} rows/s={snapshot['rows_per_sec']} "
+             f"events={snapshot['events']} rows={snapshot['rows']}"]
+    for data in snapshot['tables']:
+        lines.append("  {0:<40} rows/s={1:<10} inserts={2:<10} updates={3:<10} deletes={4}".format(
+            f"{data['database']}.{data['table']}", data['rows_per_sec'],
+            data['inserts'], data['updates'], data['deletes']))
+    return '\n'.join(lines)
+
+def follow_binlog(binlog_file, start_position=None, interval=5.0, window=60, json_output=False,
+                  poll_interval=1.0, max_tables=FOLLOW_MAX_TABLES):
+    """
+    analyze --follow：从start_position（默认当前末尾）持续读取binlog，
+    每interval秒向标准输出打印一次快照，Ctrl-C结束
+    """
+    if start_position is None:
+        start_position = find_transaction_end(binlog_file)
+    log_normal(f"跟踪 {binlog_file}，从位置 {start_position} 开始")
+
+    stats = FollowStats(window, max_tables)
+    stats.binlog_file = binlog_file
+    stats.position = start_position
+    counters = {'INSERT': 'inserts', 'UPDATE': 'updates', 'DELETE': 'deletes'}
+    table_maps = {}
+    post_header_len = b''
+    next_report = time.monotonic() + interval
+
+    def report():
+        snapshot = stats.snapshot()
+        if json_output:
+            print(json.dumps(snapshot, ensure_ascii=False))
+        else:
+            print(format_follow_snapshot(snapshot))
+        sys.stdout.flush()
+
+    try:
+        for event in follow_binlog_events(binlog_file, start_position, poll_interval):
+            if event is not None:
+                current_file, event_type, timestamp, pos, next_pos, body = event
+                stats.binlog_file = current_file
+                if event_type == FORMAT_DESCRIPTION_EVENT:
+                    post_header_len = parse_format_description(body)['post_header_len']
+                    table_maps = {}
+                else:
+                    stats.position = next_pos
+                    bucket = stats.add_event(timestamp)
+                    if event_type == TABLE_MAP_EVENT:
+                        table_map = parse_table_map(body, post_header_length(post_header_len, TABLE_MAP_EVENT, 8))
+                        table_maps[table_map['table_id']] = table_map
+                    elif event_type in ROWS_EVENT_KINDS:
+                        default_len = 10 if event_type in ROWS_EVENT_V2 else 8
+                        table_map, rows = decode_rows_event(
+                            event_type, body, table_maps, post_header_length(post_header_len, event_type, default_len))
+                        if table_map is not None:
+                            stats.add_rows(bucket, (table_map['database'], table_map['table']),
+                                           counters[ROWS_EVENT_KINDS[event_type]], len(rows))
+                    elif event_type == QUERY_EVENT:
+                        current_db, sql = parse_query_event(body)
+                        sql = sql.strip()
+                        if sql.upper() not in ('BEGIN', 'COMMIT', 'ROLLBACK'):
+                            counter = classify_query(sql)
+                            if counter:
+                                stats.add_rows(bucket, query_table_key(sql, current_db), counter, 1)
+                    if event_type in (QUERY_EVENT, XID_EVENT, GTID_EVENT, ANONYMOUS_GTID_EVENT):
+                        # TABLE_MAP只在所属语句内有效，及时清理避免长时间运行时累积
+                        table_maps = {}
+            if time.monotonic() >= next_report:
+                report()
+                next_report = time.monotonic() + interval
+    except KeyboardInterrupt:
+        pass
+    report()
+
+# ---------------------------------------------------------------------------
+# 表结构目录：从CREATE TABLE导出或JSON文件读取列名和主键，随binlog中的DDL更新版本
+# ---------------------------------------------------------------------------
+
+SQL_IDENT = r'(?:`(?:[^`]|``)+`|[\w$]+)'
+CREATE_TABLE_RE = re.compile(
+    r'CREATE\s+(?:TEMPORARY\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(' + SQL_IDENT + r'(?:\s*\.\s*' + SQL_IDENT + r')?)\s*\(',
+    re.IGNORECASE)
+ALTER_TABLE_RE = re.compile(r'ALTER\s+(?:ONLINE\s+|IGNORE\s+)*TABLE\s+(' + SQL_IDENT + r'(?:\s*\.\s*' + SQL_IDENT + r')?)\s*',
+                            re.IGNORECASE)
+DROP_TABLE_RE = re.compile(r'DROP\s+(?:TEMPORARY\s+)?TABLE\s+(?:IF\s+EXISTS\s+)?', re.IGNORECASE)
+RENAME_TABLE_RE = re.compile(r'RENAME\s+TABLE\s+', re.IGNORECASE)
+SCHEMA_USE_RE = re.compile(r'^\s*USE\s+(' + SQL_IDENT + r')\s*;', re.IGNORECASE | re.MULTILINE)
+SQL_IDENT_RE = re.compile(SQL_IDENT)
+# 会改变表结构的语句开头（取前6个字符大写）
+DDL_HEADS = ('ALTER ', 'CREATE', 'DROP T', 'RENAME')
+# 建表语句中不是列定义的项
+TABLE_ITEM_KEYWORDS = ('PRIMARY', 'KEY', 'INDEX', 'UNIQUE', 'CONSTRAINT', 'FOREIGN', 'FULLTEXT', 'SPATIAL', 'CHECK')
+
+def unquote_identifier(name):
+    """
+    去掉标识符的反引号
+    """
+    name = name.strip()
+    if name.startswith('`') and name.endswith('`'):
+        return name[1:-1].replace('``', '`')
+    return name
+
+def split_qualified_name(name, default_db=None):
+    """
+    "`库`.`表`"或"表"拆成(库, 表)
+    """
+    parts = SQL_IDENT_RE.findall(name)
+    if len(parts) >= 2:
+        return unquote_identifier(parts[0]), unquote_identifier(parts[1])
+    return default_db, unquote_identifier(parts[0])
+
+def split_sql_items(text, start=0):
+    """
+    从text[start]处的左括号开始，按顶层逗号拆分括号内的内容，返回(各项, 右括号之后的位置)
+    """
+    items = []
+    depth = 0
+    quote = None
+    item_start = start + 1
+    pos = start
+    while pos < len(text):
+        char = text[pos]
+        if quote:
+            if char == quote:
+                quote = None
+            elif char == '\\' and quote != '`':
+                pos += 1
+        elif char in '\'"`':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                items.append(text[item_start:pos].strip())
+                return [item for item in items if item], pos + 1
+        elif char == ',' and depth == 1:
+            items.append(text[item_start:pos].strip())
+            item_start = pos + 1
+        pos += 1
+    raise ValueError("括号不匹配")
+
+def split_top_level(text):
+    """
+    按顶层逗号拆分一段SQL（不含外层括号）
+    """
+    items, _ = split_sql_items('(' + text + ')')
+    return items
+
+def parse_key_columns(text):
+    """
+    "(`a`(10), `b`)"中的列名列表，忽略前缀长度
+    """
+    items, _ = split_sql_items(text, text.index('('))
+    return [unquote_identifier(SQL_IDENT_RE.match(item).group(0)) for item in items]
+
+def parse_create_table_body(text, start):
+    """
+    解析建表语句括号内的定义，返回({'columns': [...], 'primary_key': [...] 或 None}, 结束位置)
+    """
+    items, end = split_sql_items(text, start)
+    columns = []
+    primary_key = None
+    for item in items:
+        first = item.split(None, 1)[0].upper()
+        if first in TABLE_ITEM_KEYWORDS:
+            if first == 'PRIMARY' or (first == 'CONSTRAINT' and re.search(r'\bPRIMARY\s+KEY\b', item, re.I)):
+                primary_key = parse_key_columns(item)
+            continue
+        name = SQL_IDENT_RE.match(item)
+        if name is None:
+            continue
+        columns.append(unquote_identifier(name.group(0)))
+        if re.search(r'\bPRIMARY\s+KEY\b', item, re.I):
+            primary_key = [columns[-1]]
+    return {'columns': columns, 'primary_key': primary_key}, end
+
+def apply_alter_clause(schema, clause):
+    """
+    对表结构应用一个ALTER子句，返回新的表结构；无法识别会改变列布局的子句时返回None
+    """
+    columns = list(schema['columns'])
+    primary_key = schema['primary_key']
+    upper = clause.upper()
+    words = upper.split()
+    if not words:
+        return schema
+
+    def position(text, index):
+        # 处理FIRST/AFTER，返回新列应插入的位置
+        after = re.search(r'\bAFTER\s+(' + SQL_IDENT + r')\s*$', text, re.I)
+        if after:
+            return columns.index(unquote_identifier(after.group(1))) + 1
+        if re.search(r'\bFIRST\s*$', text, re.I):
+            return 0
+        return index
+
+    if words[0] == 'ADD':
+        if len(words) > 1 and words[1] in TABLE_ITEM_KEYWORDS:
+            if words[1] == 'PRIMARY' or (words[1] == 'CONSTRAINT' and 'PRIMARY' in words):
+                primary_key = parse_key_columns(clause)
+            return {'columns': columns, 'primary_key': primary_key}
+        rest = re.sub(r'^ADD\s+(?:COLUMN\s+)?', '', clause, flags=re.I)
+        if rest.startswith('('):
+            return None
+        name = unquote_identifier(SQL_IDENT_RE.match(rest).group(0))
+        columns.insert(position(rest, len(columns)), name)
+    elif words[0] == 'DROP':
+        if len(words) > 1 and words[1] == 'PRIMARY':
+            primary_key = None
+        elif len(words) > 1 and words[1] in ('INDEX', 'KEY', 'FOREIGN', 'CHECK', 'CONSTRAINT'):
+            pass
+        else:
+            rest = re.sub(r'^DROP\s+(?:COLUMN\s+)?', '', clause, flags=re.I)
+            name = unquote_identifier(SQL_IDENT_RE.match(rest).group(0))
+            columns.remove(name)
+            if primary_key:
+                primary_key = [column for column in primary_key if column != name] or None
+    elif words[0] in ('CHANGE', 'MODIFY'):
+        rest = re.sub(r'^(?:CHANGE|MODIFY)\s+(?:COLUMN\s+)?', '', clause, flags=re.I)
+        names = SQL_IDENT_RE.findall(rest)
+        old = unquote_identifier(names[0])
+        new = unquote_identifier(names[1]) if words[0] == 'CHANGE' else old
+        index = columns.index(old)
+        columns.pop(index)
+        columns.insert(position(rest, index), new)
+        if primary_key:
+            primary_key = [new if column == old else column for column in primary_key]
+    elif words[0] == 'RENAME' and len(words) > 1 and words[1] == 'COLUMN':
+        names = SQL_IDENT_RE.findall(clause)
+        old, new = unquote_identifier(names[2]), unquote_identifier(names[4])
+        columns[columns.index(old)] = new
+        if primary_key:
+            primary_key = [new if column == old else column for column in primary_key]
+    elif words[0] in ('RENAME', 'CONVERT', 'PARTITION') or words[0] in ('ALTER', 'ALGORITHM', 'LOCK', 'ENGINE',
+                                                                       'COMMENT', 'AUTO_INCREMENT', 'ROW_FORMAT',
+                                                                       'DEFAULT', 'CHARACTER', 'CHARSET', 'COLLATE',
+                                                                       'FORCE', 'ENABLE', 'DISABLE', 'ORDER',
+                                                                       'KEY_BLOCK_SIZE', 'STATS_PERSISTENT'):
+        pass
+    else:
+        return None
+    return {'columns': columns, 'primary_key': primary_key}
+
+class SchemaCatalog:
+    """
+    按(库, 表)保存的列名和主键，每张表只解析一次
+
+    lookup结果按(库, 表)缓存；binlog中出现ALTER/CREATE/DROP/RENAME TABLE时该表的版本号加一、
+    缓存失效，之后的行按新结构命名。无法解析的ALTER会让该表之后的行退回col_N和TABLE_MAP元数据。
+    """
+
+    def __init__(self):
+        # (库或None, 表) -> {'columns': [...], 'primary_key': [...]}，None表示结构未知
+        self.tables = {}
+        self.versions = {}
+        self.cache = {}
+        # 已警告过列数不符的(库, 表)
+        self.mismatched = set()
+
+    @classmethod
+    def load(cls, paths):
+        """
+        读取一组结构文件：.json为{"库.表": {"columns": [...], "primary_key": [...]}}，其余按CREATE TABLE导出解析
+        """
+        catalog = cls()
+        for path in paths or ():
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            if path.endswith('.json'):
+                catalog.load_json(json.loads(text))
+            else:
+                catalog.load_sql(text)
+            log_detail(f"读取表结构: {path}")
+        return catalog
+
+    def load_json(self, data):
+        for name, schema in data.items():
+            database, _, table = name.rpartition('.')
+            self.tables[(database or None, table)] = {
+                'columns': list(schema['columns']),
+                'primary_key': list(schema['primary_key']) if schema.get('primary_key') else None,
+            }
+
+    def load_sql(self, text):
+        """
+        解析mysqldump --no-data之类的导出，USE语句决定之后未带库名的表属于哪个库
+        """
+        uses = [(match.start(), unquote_identifier(match.group(1))) for match in SCHEMA_USE_RE.finditer(text)]
+        for match in CREATE_TABLE_RE.finditer(text):
+            default_db = None
+            for offset, database in uses:
+                if offset > match.start():
+                    break
+                default_db = database
+            schema, _ = parse_create_table_body(text, match.end() - 1)
+            self.tables[split_qualified_name(match.group(1), default_db)] = schema
+
+    def schema_key(self, database, table):
+        if (database, table) in self.tables:
+            return (database, table)
+        if (None, table) in self.tables:
+            return (None, table)
+        return None
+
+    def lookup(self, database, table):
+        """
+        返回(列名元组, 主键列序号元组或None)，结构未知时返回None
+        """
+        key = (database, table)
+        if key in self.cache:
+            return self.cache[key]
+        result = None
+        schema_key = self.schema_key(database, table)
+        schema = self.tables.get(schema_key) if schema_key else None
+        if schema is not None:
+            columns = tuple(schema['columns'])
+            primary_key = None
+            if schema['primary_key'] and all(column in columns for column in schema['primary_key']):
+                primary_key = tuple(columns.index(column) + 1 for column in schema['primary_key'])
+            result = (columns, primary_key)
+        self.cache[key] = result
+        return result
+
+    def set_schema(self, database, table, schema):
+        key = self.schema_key(database, table) or (database, table)
+        self.tables[key] = schema
+        self.cache.pop((database, table), None)
+        self.versions[key] = version = self.versions.get(key, 0) + 1
+        if schema is None:
+            log_normal(f"警告: 无法解析 {database}.{table} 的表结构变更，之后的行不使用结构目录中的列名")
+        else:
+            log_detail(f"表结构变更: {database}.{table} -> 版本{version}")
+
+    def rename_table(self, database, table, new_database, new_table):
+        """
+        表改名后结构跟着新表名走
+        """
+        key = self.schema_key(database, table)
+        if key is None:
+            return
+        schema = self.tables.pop(key)
+        self.cache.pop((database, table), None)
+        self.set_schema(new_database, new_table, schema)
+
+    def apply_ddl(self, default_db, sql):
+        """
+        根据binlog中的DDL更新表结构
+        """
+        sql = sql.strip().rstrip(';')
+        head = sql[:6].upper()
+        if head == 'ALTER ':
+            match = ALTER_TABLE_RE.match(sql)
+            if match is None:
+                return
+            database, table = split_qualified_name(match.group(1), default_db)
+            key = self.schema_key(database, table)
+            if key is None:
+                return
+            schema = self.tables[key]
+            clauses = split_top_level(sql[match.end():])
+            for clause in clauses:
+                if schema is None:
+                    break
+                rename = re.match(r'RENAME\s+(?:TO\s+|AS\s+)?(?!COLUMN\b|INDEX\b|KEY\b)(' + SQL_IDENT +
+                                  r'(?:\s*\.\s*' + SQL_IDENT + r')?)\s*$', clause, re.I)
+                if rename:
+                    new_database, new_table = split_qualified_name(rename.group(1), database)
+                    self.rename_table(database, table, new_database, new_table)
+                    database, table = new_database, new_table
+                    continue
+                try:
+                    schema = apply_alter_clause(schema, clause)
+                except (ValueError, AttributeError, IndexError):
+                    schema = None
+            self.set_schema(database, table, schema)
+        elif head == 'CREATE':
+            match = CREATE_TABLE_RE.match(sql)
+            if match:
+                database, table = split_qualified_name(match.group(1), default_db)
+                try:
+                    schema, _ = parse_create_table_body(sql, match.end() - 1)
+                except ValueError:
+                    schema = None
+                self.set_schema(database, table, schema)
+        elif head == 'DROP T':
+            match = DROP_TABLE_RE.match(sql)
+            if match:
+                for name in split_top_level(sql[match.end():]):
+                    database, table = split_qualified_name(name, default_db)
+                    if self.schema_key(database, table):
+                        self.set_schema(database, table, None)
+        elif head == 'RENAME':
+            match = RENAME_TABLE_RE.match(sql)
+            if match:
+                for pair in split_top_level(sql[match.end():]):
+                    old_name, _, new_name = re.split(r'\s+(TO)\s+', pair, maxsplit=1, flags=re.I)
+                    self.rename_table(*split_qualified_name(old_name, default_db),
+                                      *split_qualified_name(new_name, default_db))
+
+    def row_schema(self, database, table, column_count=None, highest_column=0):
+        """
+        行所属表的(列名, 主键)；结构不匹配时返回(None, None)，行退回col_N
+
+        column_count为行事件的列数，与目录中的列数不一致即不匹配；只知道行镜像中出现的
+        最大列序号时传highest_column，超出目录列数即不匹配。每张表的不匹配只警告一次。
+        """
+        result = self.lookup(database, table)
+        if result is None:
+            return None, None
+        if ((column_count is not None and column_count != len(result[0])) or
+                highest_column > len(result[0])):
+            if (database, table) not in self.mismatched:
+                self.mismatched.add((database, table))
+                log_quiet(f"警告: {database}.{table} 的行有 {column_count or highest_column} 列，"
+                          f"与表结构的 {len(result[0])} 列不符，改用col_N")
+            return None, None
+        return result
+
+# 表布局注册表：(类型, 库, 表, 前镜像列, 后镜像列, 列名, 主键) -> TableLayout，同一布局的所有行共用
+TABLE_LAYOUTS = {}
+
+class TableLayout:
+    """
+    一类行操作共享的信息：操作类型、库名、表名，前后镜像的列序号，以及已知时的列名和主键列序号
+
+    同一个表、同一组列的所有行引用同一个实例，每行不再各自保存库名、表名和列号。
+    """
+    __slots__ = ('type', 'database', 'table', 'columns', 'after_columns', 'column_names', 'primary_key')
+
+    def __init__(self, op_type, database, table, columns, after_columns=None, column_names=None,
+                 primary_key=None):
+        self.type = op_type
+        self.database = database
+        self.table = table
+        self.columns = columns
+        self.after_columns = after_columns
+        self.column_names = column_names
+        self.primary_key = primary_key
+
+    def __reduce__(self):
+        # 跨进程传递后重新登记，保持每个进程内布局唯一
+        return table_layout, (self.type, self.database, self.table, self.columns, self.after_columns,
+                              self.column_names, self.primary_key)
+
+    def column_name(self, column):
+        """
+        列序号对应的列名（已加反引号），不知道列名时为`col_N`
+        """
+        if self.column_names and column <= len(self.column_names):
+            return '`' + self.column_names[column - 1].replace('`', '``') + '`'
+        return f"`col_{column}`"
+
+def table_layout(op_type, database, table, columns, after_columns=None, column_names=None, primary_key=None):
+    """
+    返回共享的TableLayout，库名和表名做intern
+    """
+    key = (op_type, database, table, columns, after_columns, column_names, primary_key)
+    layout = TABLE_LAYOUTS.get(key)
+    if layout is None:
+        layout = TableLayout(sys.intern(op_type), sys.intern(database), sys.intern(table),
+                             columns, after_columns, column_names, primary_key)
+        TABLE_LAYOUTS[key] = layout
+    return layout
+
+class RowOperation:
+    """
+    一行数据变更：列值（前镜像在前，后镜像在后）拼成一个字符串，array记录每列的结束位置
+
+    与每行一个dict、每列一个字符串相比，每行只有本对象、一个字符串和一个array三块内存。
+    txn是所在事务BEGIN事件的起始位置（事务外为0），同一事务的行共用同一个int对象。
+    """
+    __slots__ = ('layout', 'text', 'ends', 'txn')
+
+    def __init__(self, layout, values, txn=0):
+        self.layout = layout
+        self.txn = txn
+        self.text = ''.join(values)
+        ends = array('I')
+        end = 0
+        for value in values:
+            end += len(value)
+            ends.append(end)
+        self.ends = ends
+
+    @property
+    def type(self):
+        return self.layout.type
+
+    @property
+    def database(self):
+        return self.layout.database
+
+    @property
+    def table(self):
+        return self.layout.table
+
+    def slice_values(self, start, stop):
+        """
+        取出第start到stop个列值
+        """
+        text = self.text
+        ends = self.ends
+        begin = ends[start - 1] if start else 0
+        values = []
+        for index in range(start, stop):
+            end = ends[index]
+            values.append(text[begin:end])
+            begin = end
+        return values
+
+    @property
+    def values(self):
+        """
+        前镜像的列值列表（DELETE/INSERT的整行）
+        """
+        return self.slice_values(0, len(self.layout.columns))
+
+    @property
+    def old_values(self):
+        """
+        前镜像 {列序号: 值}
+        """
+        columns = self.layout.columns
+        return dict(zip(columns, self.slice_values(0, len(columns))))
+
+    @property
+    def new_values(self):
+        """
+        后镜像 {列序号: 值}，只有UPDATE有
+        """
+        columns = self.layout.columns
+        after_columns = self.layout.after_columns or ()
+        return dict(zip(after_columns, self.slice_values(len(columns), len(columns) + len(after_columns))))
+
+def new_row_operation(op_type, database, table, columns, values, after_columns=None, after_values=(), txn=0,
+                      column_names=None, primary_key=None):
+    """
+    生成一条RowOperation；columns/after_columns为列序号序列，values/after_values为对应的SQL字面量
+    """
+    layout = table_layout(op_type, database, table, tuple(columns),
+                          tuple(after_columns) if after_columns is not None else None,
+                          tuple(column_names) if column_names else None,
+                          tuple(primary_key) if primary_key else None)
+    if after_values:
+        values = list(values)
+        values.extend(after_values)
+    return RowOperation(layout, values, txn)
+
+# 行事件头: "#251117 10:10:57 server id 1  end_log_pos 480 CRC32 0x... \tDelete_rows: table id 90 flags: STMT_END_F"
+ROWS_TABLE_ID_RE = re.compile(r'\t(?:Write|Update|Delete)_rows(?:_v1)?: table id (\d+)')
+TABLE_MAP_ID_RE = re.compile(r'mapped to number (\d+)')
+
+def split_filter_patterns(values):
+    """
+    把过滤参数拆成模式列表：支持字符串、列表，普通值可用逗号分隔，"re:"开头的正则不拆分
+    """
+    if not values:
+        return []
+    if isinstance(values, str):
+        values = [values]
+    patterns = []
+    for value in values:
+        if value.startswith('re:'):
+            patterns.append(value)
+        else:
+            patterns.extend(part.strip() for part in value.split(',') if part.strip())
+    return patterns
+
+def compile_name_filter(values):
+    """
+    编译库名/表名过滤，返回判断函数；没有过滤条件时返回None
+
+    每个模式可以是精确名称、通配符（如 order_*）或 "re:正则"（整体匹配）。
+    """
+    patterns = split_filter_patterns(values)
+    if not patterns:
+        return None
+    exact = set()
+    regexes = []
+    for pattern in patterns:
+        if pattern.startswith('re:'):
+            regexes.append(re.compile(pattern[3:]))
+        elif glob.has_magic(pattern):
+            regexes.append(re.compile(fnmatch.translate(pattern)))
+        else:
+            exact.add(pattern)
+
+    def match(name):
+        return name in exact or any(regex.fullmatch(name) for regex in regexes)
+    return match
+
+def build_table_filter(database_filter=None, table_filter=None):
+    """
+    组合库名和表名过滤，返回判断函数(库, 表) -> bool，结果按表缓存；没有过滤条件时返回None
+    """
+    database_match = compile_name_filter(database_filter)
+    table_match = compile_name_filter(table_filter)
+    if database_match is None and table_match is None:
+        return None
+    cache = {}
+
+    def match(database, table):
+        key = (database, table)
+        result = cache.get(key)
+        if result is None:
+            result = ((database_match is None or database_match(database)) and
+                      (table_match is None or table_match(table)))
+            cache[key] = result
+        return result
+    return match
+
+def new_filter_stats():
+    """
+    过滤统计：行事件总数、跳过的行事件数，以及跳过的文本行数/事件字节数
+    """
+    return {'rows_events': 0, 'skipped_events': 0, 'lines': 0, 'skipped_lines': 0,
+            'bytes': 0, 'skipped_bytes': 0}
+
+def merge_filter_stats(target, source):
+    """
+    累加过滤统计
+    """
+    for key, value in source.items():
+        target[key] = target.get(key, 0) + value
+    return target
+
+def format_filter_summary(filter_stats, seconds):
+    """
+    生成过滤效果摘要
+    """
+    total = filter_stats['rows_events']
+    skipped = filter_stats['skipped_events']
+    summary = f"过滤: 跳过 {skipped}/{total} 个行事件"
+    if filter_stats['lines']:
+        share = filter_stats['skipped_lines'] * 100.0 / filter_stats['lines']
+        summary += f"，{filter_stats['skipped_lines']}/{filter_stats['lines']} 行未逐行解析（{share:.1f}%）"
+    elif filter_stats['bytes']:
+        share = filter_stats['skipped_bytes'] * 100.0 / filter_stats['bytes']
+        summary += f"，{filter_stats['skipped_bytes']}/{filter_stats['bytes']} 字节行数据未解码（{share:.1f}%）"
+    return summary + f"，解析耗时 {seconds:.2f} 秒"
+
+def parse_binlog_content_enhanced(content, database_filter=None, table_filter=None, flashback_mode='deletes',
+                                  filter_stats=None, catalog=None):
+    """
+    binlog内容解析，支持DELETE和UPDATE操作，inserts闪回模式下还解析INSERT（flashback_mode为None时三种都解析）
+
+    content可以是完整文本，也可以是逐行产出的可迭代对象（如iter_mysqlbinlog_lines）。
+    database_filter/table_filter可以是名称、逗号分隔的列表、通配符或"re:正则"；
+    行事件所属的表不匹配时，整个事件直到下一个"# at"都直接跳过，不再逐行解析。
+    传入filter_stats时累加过滤统计。传入catalog（SchemaCatalog）时行带上列名和主键，
+    并跟随文本中的DDL更新表结构。返回RowOperation列表。
+    """
+    return list(iter_content_operations(content, database_filter, table_filter, flashback_mode, filter_stats,
+                                        catalog))
+
+def image_row_schema(catalog, database, table, columns):
+    """
+    按文本行镜像的@N列序号核对结构目录：完整镜像（@1..@N连续）要求列数相等，
+    其余镜像要求最大列序号不超过目录列数
+    """
+    if columns == list(range(1, len(columns) + 1)):
+        return catalog.row_schema(database, table, len(columns))
+    return catalog.row_schema(database, table, highest_column=max(columns))
 
-def parse_binlog_content_enhanced(content, database_filter=None, table_filter=None, flashback_mode='deletes'):
+def iter_content_operations(content, database_filter=None, table_filter=None, flashback_mode='deletes',
+                            filter_stats=None, catalog=None):
     """
-    binlog内容解析，支持DELETE和UPDATE操作
+    逐个产出mysqlbinlog文本中的RowOperation，参数同parse_binlog_content_enhanced
     """
-    operations = []
+    operation_count = 0
     
-    lines = content.split('\n')
-    i = 0
+    lines = iter(content.split('\n') if isinstance(content, str) else content)
+    line_count = 0
+    skipped_lines = 0
+    rows_events = 0
+    skipped_events = 0
     current_db = ''
     current_table = ''
+    # table id -> (库, 表)，行事件头只带table id
+    table_ids = {}
+    table_match = build_table_filter(database_filter, table_filter)
+    current_match = table_match is None
+    # INSERT只在inserts闪回模式（或flashback_mode为None，收集所有类型）下需要
+    collect_inserts = flashback_mode in ('inserts', None)
+    # 最近一个"# at"行，遇到BEGIN时取其位置作为事务标识
+    at_line = None
+    txn = 0
+    # 结构目录中当前表的(列名, 主键)，以及DDL语句的默认库
+    column_names = primary_key = None
+    query_db = None
+    # 结构目录的列名要等读到行事件的第一个行镜像、核对过列数后才确定
+    schema_pending = False
+    # 调试输出的f-string只在-vvv时构造，热循环中不做无用的格式化
+    debug = verbose_level >= VERBOSE_DEBUG
+    detail = verbose_level >= VERBOSE_DETAIL
     
-    log_detail(f"开始解析binlog内容，共{len(lines)}行")
+    log_detail(f"开始解析binlog内容")
     
-    while i < len(lines):
-        line = lines[i].strip()
+    raw_line = next(lines, None)
+    while raw_line is not None:
+        line_count += 1
+        line = raw_line.strip()
         
-        table_map = re.search(r'Table_map: `([^`]+)`\.`([^`]+)`', line)
-        if table_map:
-            current_db = table_map.group(1)
-            current_table = table_map.group(2)
-            log_debug(f"找到Table_map: {current_db}.{current_table}")
-        
-        db_match = not database_filter or current_db == database_filter
-        table_match = not table_filter or current_table == table_filter
+        if line[:1] == '#' and line[:3] != '###':
+            if line[:5] == '# at ':
+                at_line = line
+            elif 'Table_map: ' in line:
+                table_map = TABLE_MAP_RE.search(line)
+                if table_map:
+                    current_db = table_map.group(1)
+                    current_table = table_map.group(2)
+                    table_id = TABLE_MAP_ID_RE.search(line)
+                    if table_id:
+                        table_ids[table_id.group(1)] = (current_db, current_table)
+                    current_match = table_match is None or table_match(current_db, current_table)
+                    schema_pending = catalog is not None
+                    if debug:
+                        log_debug(f"找到Table_map: {current_db}.{current_table}")
+            elif ' table id ' in line:
+                rows_event = ROWS_TABLE_ID_RE.search(line)
+                if rows_event:
+                    rows_events += 1
+                    current_db, current_table = table_ids.get(rows_event.group(1), (current_db, current_table))
+                    current_match = table_match is None or table_match(current_db, current_table)
+                    schema_pending = catalog is not None
+                    if not current_match:
+                        # 整个行事件跳过，直到下一个事件的"# at"
+                        skipped_events += 1
+                        raw_line = next(lines, None)
+                        while raw_line is not None and not raw_line.startswith('# at '):
+                            skipped_lines += 1
+                            raw_line = next(lines, None)
+                        continue
+        elif line == 'BEGIN':
+            txn = int(at_line[5:]) if at_line and at_line[5:].isdigit() else 0
+        elif catalog is not None and line[:1] != '#':
+            if line[:4] == 'use ':
+                use = USE_RE.match(line)
+                if use:
+                    query_db = use.group(1)
+            elif line[:6].upper() in DDL_HEADS:
+                # DDL可能跨多行，读到"/*!*/;"为止
+                statement = [line]
+                while raw_line is not None and not raw_line.rstrip().endswith('/*!*/;'):
+                    raw_line = next(lines, None)
+                    if raw_line is not None:
+                        line_count += 1
+                        statement.append(raw_line.rstrip())
+                sql = '\n'.join(statement)
+                if sql.endswith('/*!*/;'):
+                    sql = sql[:-len('/*!*/;')]
+                catalog.apply_ddl(query_db, sql)
+                raw_line = next(lines, None)
+                continue
         
-        if not (db_match and table_match):
-            i += 1
+        if not current_match:
+            raw_line = next(lines, None)
             continue
             
-        if '### DELETE FROM' in line and current_db and current_table:
-            log_debug(f"找到DELETE操作: {current_db}.{current_table}")
-            operation = {
-                'type': 'DELETE',
-                'database': current_db,
-                'table': current_table,
-                'values': []
-            }
+        if (('### DELETE FROM' in line or (collect_inserts and '### INSERT INTO' in line))
+                and current_db and current_table):
+            op_type = 'DELETE' if '### DELETE FROM' in line else 'INSERT'
+            if debug:
+                log_debug(f"找到{op_type}操作: {current_db}.{current_table}")
+            columns = []
+            values = []
             
-            i += 1
-            while i < len(lines) and lines[i].strip().startswith('###'):
-                field_line = lines[i].strip()
+            raw_line = next(lines, None)
+            while raw_line is not None and raw_line.strip().startswith('###'):
+                field_line = raw_line.strip()
+                if field_line.startswith(('### DELETE FROM', '### INSERT INTO')):
+                    # 同一事件的下一行，交给外层循环
+                    break
+                line_count += 1
                 if '@' in field_line and '=' in field_line:
                     value_start = field_line.find('=') + 1
                     value = field_line[value_start:].strip()
                     if '/*' in value:
                         value = value.split('/*')[0].strip()
-                    operation['values'].append(process_field_value(value))
-                    log_debug(f"  DELETE字段值: {value} -> {process_field_value(value)}")
-                i += 1
+                    field_num = field_line[field_line.find('@') + 1:value_start - 1]
+                    columns.append(int(field_num) if field_num.isdigit() else len(columns) + 1)
+                    values.append(process_field_value(value))
+                    if debug:
+                        log_debug(f"  {op_type}字段值: {value} -> {values[-1]}")
+                raw_line = next(lines, None)
             
-            if operation['values']:
-                operations.append(operation)
+            if values:
+                operation_count += 1
+                if schema_pending:
+                    column_names, primary_key = image_row_schema(catalog, current_db, current_table, columns)
+                    schema_pending = False
+                yield new_row_operation(op_type, current_db, current_table, columns, values, txn=txn,
+                                        column_names=column_names, primary_key=primary_key)
             continue
                 
         elif '### UPDATE' in line and current_db and current_table:
-            log_debug(f"找到UPDATE操作: {current_db}.{current_table}")
-            operation = {
-                'type': 'UPDATE',
-                'database': current_db,
-                'table': current_table,
-                'old_values': {},
-                'new_values': {}
-            }
+            if debug:
+                log_debug(f"找到UPDATE操作: {current_db}.{current_table}")
+            old_values = {}
+            new_values = {}
             
-            i += 1
+            raw_line = next(lines, None)
             current_section = None
             changed_fields = []
             
-            while i < len(lines) and lines[i].strip().startswith('###'):
-                field_line = lines[i].strip()
+            while raw_line is not None and raw_line.strip().startswith('###'):
+                field_line = raw_line.strip()
+                if field_line.startswith('### UPDATE'):
+                    break
+                line_count += 1
+                raw_line = next(lines, None)
                 
                 if field_line == '### WHERE':
                     current_section = 'WHERE'
-                    i += 1
                     continue
                 elif field_line == '### SET':
                     current_section = 'SET'
-                    i += 1
                     continue
                 
                 if '@' in field_line and '=' in field_line and current_section:
@@ -321,33 +3583,106 @@ def parse_binlog_content_enhanced(content, database_filter=None, table_filter=No
                         processed_value = process_field_value(value)
                         
                         if current_section == 'WHERE':
-                            operation['old_values'][field_num] = processed_value
-                            log_debug(f"  UPDATE WHERE字段{field_num}: {value} -> {processed_value}")
+                            old_values[field_num] = processed_value
+                            if debug:
+                                log_debug(f"  UPDATE WHERE字段{field_num}: {value} -> {processed_value}")
                         elif current_section == 'SET':
-                            operation['new_values'][field_num] = processed_value
-                            log_debug(f"  UPDATE SET字段{field_num}: {value} -> {processed_value}")
-                            if field_num not in changed_fields:
+                            new_values[field_num] = processed_value
+                            if debug:
+                                log_debug(f"  UPDATE SET字段{field_num}: {value} -> {processed_value}")
+                            if detail and field_num not in changed_fields:
                                 changed_fields.append(field_num)
-                
-                i += 1
             
-            if operation['old_values'] and operation['new_values']:
-                operations.append(operation)
-                if changed_fields and verbose_level >= VERBOSE_DETAIL:
+            if old_values and new_values:
+                operation_count += 1
+                if schema_pending:
+                    column_names, primary_key = image_row_schema(catalog, current_db, current_table,
+                                                                 list(old_values))
+                    schema_pending = False
+                yield new_row_operation(
+                    'UPDATE', current_db, current_table, old_values.keys(), old_values.values(),
+                    new_values.keys(), new_values.values(), txn,
+                    column_names=column_names, primary_key=primary_key)
+                if changed_fields:
                     log_detail(f"  更新字段变化:")
                     for field_num in sorted(changed_fields):
-                        old_val = operation['old_values'].get(field_num, 'NULL')
-                        new_val = operation['new_values'].get(field_num, 'NULL')
+                        old_val = old_values.get(field_num, 'NULL')
+                        new_val = new_values.get(field_num, 'NULL')
                         if old_val != new_val:
                             old_display = old_val if len(str(old_val)) < 50 else str(old_val)[:47] + "..."
                             new_display = new_val if len(str(new_val)) < 50 else str(new_val)[:47] + "..."
                             log_detail(f"    字段{field_num}: {old_display} → {new_display}")
             continue
             
-        i += 1
+        raw_line = next(lines, None)
         
-    log_detail(f"解析完成，共找到{len(operations)}个操作")
-    return operations
+    line_count += skipped_lines
+    if filter_stats is not None:
+        filter_stats['rows_events'] += rows_events
+        filter_stats['skipped_events'] += skipped_events
+        filter_stats['lines'] += line_count
+        filter_stats['skipped_lines'] += skipped_lines
+    log_detail(f"解析完成，共{line_count}行，找到{operation_count}个操作")
+
+def parse_native_operations(binlog_file, startpos=None, stoppos=None, start_datetime=None, stop_datetime=None,
+                            database_filter=None, table_filter=None, flashback_mode='deletes', filter_stats=None,
+                            catalog=None):
+    """
+    原生解析binlog行事件，直接生成与parse_binlog_content_enhanced相同结构的操作列表
+
+    不匹配过滤条件的表在事件级别跳过，行数据不解码。
+    列名和主键优先取TABLE_MAP元数据，没有时从catalog中按列数一致的表结构补全。
+    """
+    return list(iter_native_operations(binlog_file, startpos, stoppos, start_datetime, stop_datetime,
+                                       database_filter, table_filter, flashback_mode, filter_stats, catalog))
+
+def iter_native_operations(binlog_file, startpos=None, stoppos=None, start_datetime=None, stop_datetime=None,
+                           database_filter=None, table_filter=None, flashback_mode='deletes', filter_stats=None,
+                           catalog=None):
+    """
+    逐个产出原生解析得到的RowOperation，参数同parse_native_operations
+    """
+    operation_count = 0
+    txn = 0
+    table_match = build_table_filter(database_filter, table_filter)
+    kinds = ('DELETE', 'UPDATE', 'INSERT') if flashback_mode in ('inserts', None) else ('DELETE', 'UPDATE')
+    debug = verbose_level >= VERBOSE_DEBUG
+
+    for kind, table_map, rows, timestamp, pos, next_pos in iter_native_events(
+            binlog_file, startpos, stoppos, start_datetime, stop_datetime, table_match, filter_stats):
+        if kind == 'QUERY':
+            query_db, sql = rows
+            if sql == 'BEGIN':
+                txn = pos
+            elif catalog is not None and sql.lstrip()[:6].upper() in DDL_HEADS:
+                catalog.apply_ddl(query_db or None, sql)
+            continue
+        if kind not in kinds:
+            continue
+        current_db = table_map['database']
+        current_table = table_map['table']
+        column_names = table_map['column_names']
+        primary_key = table_map['primary_key']
+        if catalog is not None and (column_names is None or primary_key is None):
+            catalog_names, catalog_key = catalog.row_schema(current_db, current_table, len(table_map['column_types']))
+            column_names = column_names or catalog_names
+            primary_key = primary_key or catalog_key
+
+        if debug:
+            log_debug(f"找到{kind}事件: {current_db}.{current_table} @{pos}, {len(rows)}行")
+        for row in rows:
+            if kind != 'UPDATE':
+                yield new_row_operation(kind, current_db, current_table, row.keys(), row.values(), txn=txn,
+                                        column_names=column_names, primary_key=primary_key)
+            else:
+                old_values, new_values = row
+                yield new_row_operation(
+                    'UPDATE', current_db, current_table, old_values.keys(), old_values.values(),
+                    new_values.keys(), new_values.values(), txn,
+                    column_names=column_names, primary_key=primary_key)
+        operation_count += len(rows)
+
+    log_detail(f"原生解析完成，共找到{operation_count}个操作")
 
 def process_field_value(value):
     """
@@ -369,70 +3704,794 @@ def process_field_value(value):
         # 数字或其他类型
         return value
 
-def generate_recovery_sql(operations, flashback_mode='deletes'):
+# 多行INSERT/批量DELETE单条语句的默认字节上限，需小于目标库的max_allowed_packet
+MAX_STATEMENT_BYTES = 1024 * 1024
+
+def generate_recovery_sql(operations, flashback_mode='deletes', extended_insert=False,
+                          max_statement_bytes=MAX_STATEMENT_BYTES, primary_keys=None):
+    """
+    逐条产出恢复SQL - 支持DELETE、UPDATE和INSERT闪回
+
+    extended_insert为True时，DELETE恢复按表合并为多行INSERT，每条语句不超过max_statement_bytes字节
+    （单行本身超过上限时单独成句）；各表未满的批次在最后输出。
+    INSERT闪回在主键已知时（TABLE_MAP元数据、结构目录或primary_keys）按表合并为DELETE ... WHERE 主键 IN (...)，
+    同样受max_statement_bytes限制；主键未知时逐行按全部列匹配。
+    UPDATE闪回只SET变化了的列，主键已知时WHERE只用主键，否则按更新后的整行匹配并LIMIT 1。
+    """
+    for _, sql in iter_recovery_statements(operations, flashback_mode, extended_insert, max_statement_bytes,
+                                           primary_keys=primary_keys):
+        yield sql
+
+def parse_primary_key_args(values):
+    """
+    解析--primary-key参数："[库.]表=列[,列]"，列为列序号（mysqlbinlog输出中的@N）或列名
+
+    返回{(库或None, 表): [列, ...]}
+    """
+    primary_keys = {}
+    for value in values or ():
+        target, sep, columns = value.partition('=')
+        if not sep or not columns.strip():
+            raise ValueError(f"无效的主键定义: {value}（格式: [库.]表=列[,列]）")
+        database, _, table = target.strip().rpartition('.')
+        key = []
+        for column in (part.strip() for part in columns.split(',')):
+            if not column:
+                continue
+            number = column[1:] if column.startswith('@') else column
+            if number.isdigit():
+                key.append(int(number))
+            elif column.startswith('@'):
+                raise ValueError(f"无效的列序号: {column}（格式: @N）")
+            else:
+                key.append(column)
+        primary_keys[(database or None, table)] = key
+    return primary_keys
+
+# 已警告过无法解析的--primary-key：(库, 表, 列)
+unresolved_primary_keys = set()
+
+def key_column_numbers(layout, columns):
+    """
+    把列序号/列名换成前镜像中的列序号元组，有任一列找不到时返回None
+    """
+    key = []
+    for column in columns:
+        if not isinstance(column, int):
+            if not layout.column_names or column not in layout.column_names:
+                return None
+            column = layout.column_names.index(column) + 1
+        if column not in layout.columns:
+            return None
+        key.append(column)
+    return tuple(key)
+
+def resolve_primary_key(layout, primary_keys=None):
+    """
+    返回主键的列序号元组，主键未知或不在前镜像中时返回None
+
+    --primary-key指定的优先，其次是TABLE_MAP元数据或结构目录中的主键。
+    --primary-key指定的列在该表中找不到时警告一次，改用元数据中的主键。
+    """
+    if primary_keys:
+        columns = (primary_keys.get((layout.database, layout.table)) or
+                   primary_keys.get((None, layout.table)))
+        if columns:
+            key = key_column_numbers(layout, columns)
+            if key is not None:
+                return key
+            warned = (layout.database, layout.table, tuple(columns))
+            if warned not in unresolved_primary_keys:
+                unresolved_primary_keys.add(warned)
+                log_quiet(f"警告: --primary-key {layout.database}.{layout.table}="
+                          f"{','.join(f'@{c}' if isinstance(c, int) else c for c in columns)} "
+                          f"与表结构不符（{len(layout.columns)} 列"
+                          f"{'，无列名' if not layout.column_names else ''}），忽略")
+    if not layout.primary_key:
+        return None
+    return key_column_numbers(layout, layout.primary_key)
+
+def format_row_match(layout, row, columns):
+    """
+    按列值生成WHERE条件，NULL用IS NULL
+    """
+    return ' AND '.join(f"{layout.column_name(column)} IS NULL" if row[column] == 'NULL'
+                        else f"{layout.column_name(column)} = {row[column]}"
+                        for column in columns)
+
+# 压缩阶段同时跟踪的行数上限，超过后按最久未变化的顺序先输出
+COMPACT_MAX_ROWS = 1000000
+
+def new_compact_stats():
+    """
+    压缩统计：输入操作数、输出操作数、无主键直接透传的操作数、因内存上限提前输出的行数、
+    净变化无法按闪回模式恢复的行数
+    """
+    return {'input': 0, 'output': 0, 'passthrough': 0, 'evicted': 0, 'unrestorable': 0}
+
+def net_operation(entry):
+    """
+    把一行的变化链 [布局, 最初镜像, 最终镜像, 事务标识] 合成净变化，没有净变化时返回None
+
+    不存在->存在为INSERT，存在->不存在为DELETE，存在->存在且不同为UPDATE。
+    """
+    layout, first, last, txn = entry
+    if first is None and last is None:
+        return None
+    if first is None:
+        op_type, before, after = 'INSERT', last, None
+    elif last is None:
+        op_type, before, after = 'DELETE', first, None
+    elif first == last:
+        return None
+    else:
+        op_type, before, after = 'UPDATE', first, last
+    return new_row_operation(op_type, layout.database, layout.table, before.keys(), before.values(),
+                             after.keys() if after is not None else None,
+                             after.values() if after is not None else (), txn,
+                             column_names=layout.column_names, primary_key=layout.primary_key)
+
+# 闪回模式 -> 能生成恢复SQL的操作类型
+FLASHBACK_OPERATION_TYPES = {'deletes': 'DELETE', 'updates': 'UPDATE', 'inserts': 'INSERT'}
+
+def compact_operations(operations, primary_keys=None, max_rows=COMPACT_MAX_ROWS, stats=None, op_type=None,
+                       report=None):
+    """
+    按主键把同一行的多次变更合成一次净变化后产出，例如INSERT后DELETE抵消，多次UPDATE合成一次，
+    DELETE后再INSERT合成一次UPDATE
+
+    用字典按(库, 表, 主键值)索引每行的最初和最终镜像，超过max_rows行时先输出最久未变化的行；
+    主键未知的操作原样透传。净变化在输出时才生成，顺序按最后一次变化的先后，事务边界不再保留。
+    变化链跨越三种操作类型，输入应包含所有类型的行操作。
+    指定op_type（闪回模式对应的操作类型）时只产出该类型的净变化，其他类型的净变化
+    （如updates模式下先INSERT再UPDATE的行）计入stats['unrestorable']并逐行交给report(净变化)。
+    """
+    if stats is None:
+        stats = new_compact_stats()
+    # (库, 表, 主键值) -> [布局, 最初镜像, 最终镜像, 事务标识]
+    rows = {}
+    key_columns_cache = {}
+    
+    def emit(entry):
+        op = net_operation(entry)
+        if op is None:
+            return None
+        if op_type is not None and op.type != op_type:
+            stats['unrestorable'] += 1
+            if report is not None:
+                report(op)
+            return None
+        stats['output'] += 1
+        return op
+    
+    for op in operations:
+        stats['input'] += 1
+        layout = op.layout
+        if layout not in key_columns_cache:
+            key_columns_cache[layout] = resolve_primary_key(layout, primary_keys)
+        key = key_columns_cache[layout]
+        if key is None:
+            stats['passthrough'] += 1
+            stats['output'] += 1
+            yield op
+            continue
+        
+        image = op.old_values
+        row_key = (layout.database, layout.table, tuple(image[column] for column in key))
+        entry = rows.pop(row_key, None)
+        if op.type == 'UPDATE':
+            after = dict(entry[2] if entry is not None and entry[2] is not None else image)
+            after.update(op.new_values)
+            if entry is None:
+                entry = [layout, image, after, op.txn]
+            else:
+                entry[2] = after
+            # 主键本身可能被修改
+            new_key = tuple(after[column] for column in key) if all(column in after for column in key) else None
+            if new_key is not None and new_key != row_key[2]:
+                row_key = (layout.database, layout.table, new_key)
+                previous = rows.pop(row_key, None)
+                if previous is not None:
+                    merged = emit(previous)
+                    if merged is not None:
+                        yield merged
+        elif entry is None:
+            entry = [layout, image, None, op.txn] if op.type == 'DELETE' else [layout, None, image, op.txn]
+        else:
+            entry[2] = None if op.type == 'DELETE' else image
+        entry[0] = layout
+        entry[3] = op.txn
+        rows[row_key] = entry
+        
+        if len(rows) > max_rows:
+            stats['evicted'] += 1
+            evicted = emit(rows.pop(next(iter(rows))))
+            if evicted is not None:
+                yield evicted
+    
+    for entry in rows.values():
+        op = emit(entry)
+        if op is not None:
+            yield op
+
+def format_compact_summary(stats):
+    """
+    生成压缩效果摘要
+    """
+    removed = stats['input'] - stats['output']
+    summary = f"压缩: {stats['input']} 个行操作合并为 {stats['output']} 个，减少 {removed} 个"
+    if stats['passthrough']:
+        summary += f"（{stats['passthrough']} 个主键未知，未参与合并）"
+    if stats['evicted']:
+        summary += f"，{stats['evicted']} 行因内存上限提前输出"
+    if stats['unrestorable']:
+        summary += f"，{stats['unrestorable']} 行的净变化无法按闪回模式恢复，未生成SQL"
+    return summary
+
+# 压缩时逐行列出的无法恢复的净变化行数，其余只在-v时列出
+COMPACT_REPORT_ROWS = 20
+
+def compact_reporter(flashback_mode, primary_keys=None):
+    """
+    返回compact_operations的report回调：逐行警告净变化无法按flashback_mode恢复的行
+    """
+    reported = [0]
+
+    def report(op):
+        reported[0] += 1
+        log = log_quiet if reported[0] <= COMPACT_REPORT_ROWS else log_detail
+        key = resolve_primary_key(op.layout, primary_keys) or op.layout.columns
+        row = ', '.join(f"{op.layout.column_name(column)}={op.old_values[column]}" for column in key)
+        log(f"警告: {op.database}.{op.table} ({row}) 的净变化为{op.type}，{flashback_mode}模式无法恢复，未生成SQL")
+    return report
+
+def append_to_batch(pending, key, prefix, suffix, item, txn, max_statement_bytes):
+    """
+    把一项加入key对应的批次（项之间用逗号分隔），批次放不下时先结束它
+
+    返回被结束批次的(事务标识, SQL)，没有则返回None。
+    """
+    flushed = None
+    item_bytes = len(item.encode('utf-8')) + 1
+    batch = pending.get(key)
+    if batch is not None and batch[1] + item_bytes > max_statement_bytes:
+        flushed = batch_statement(batch)
+        batch = None
+    if batch is None:
+        batch = pending[key] = [prefix, len(prefix.encode('utf-8')) + len(suffix), [], txn, suffix]
+    batch[1] += item_bytes
+    batch[2].append(item)
+    return flushed
+
+def batch_statement(batch):
+    """
+    批次 [前缀, 字节数, 项列表, 事务标识, 后缀] 拼成(事务标识, SQL)
+    """
+    prefix, _, items, txn, suffix = batch
+    return txn, prefix + ','.join(items) + suffix
+
+def iter_recovery_statements(operations, flashback_mode='deletes', extended_insert=False,
+                             max_statement_bytes=MAX_STATEMENT_BYTES, per_transaction=False, primary_keys=None):
     """
-    生成恢复SQL - 支持DELETE和UPDATE闪回
+    逐条产出(事务标识, 恢复SQL)，参数同generate_recovery_sql
+
+    per_transaction为True时批次不跨事务合并，事务切换时输出之前的所有批次。
     """
-    sql_statements = []
+    # 布局 -> [语句前缀, 已累计字节数, 项列表, 事务标识, 后缀]；同一布局的行列数相同，可以合并
+    pending = {}
+    # 布局 -> 主键列序号（None表示没有主键）
+    key_columns_cache = {}
+    current_txn = None
     
     for op in operations:
-        if op['type'] == 'DELETE' and flashback_mode == 'deletes':
-            values_str = ', '.join(op['values'])
-            insert_sql = f"INSERT INTO `{op['database']}`.`{op['table']}` VALUES ({values_str});"
-            sql_statements.append(insert_sql)
-            log_detail(f"生成INSERT恢复语句")
+        if per_transaction and op.txn != current_txn:
+            for batch in pending.values():
+                yield batch_statement(batch)
+            pending.clear()
+            current_txn = op.txn
+        if op.type == 'DELETE' and flashback_mode == 'deletes':
+            values_str = '(' + ', '.join(op.values) + ')'
+            if not extended_insert:
+                yield op.txn, f"INSERT INTO `{op.database}`.`{op.table}` VALUES {values_str};"
+                log_detail(f"生成INSERT恢复语句")
+                continue
+            flushed = append_to_batch(pending, op.layout, f"INSERT INTO `{op.database}`.`{op.table}` VALUES ", ';',
+                                      values_str, op.txn, max_statement_bytes)
+            if flushed:
+                yield flushed
             
-        elif op['type'] == 'UPDATE' and flashback_mode == 'updates':
-            set_parts = []
-            where_parts = []
+        elif op.type == 'INSERT' and flashback_mode == 'inserts':
+            layout = op.layout
+            if layout not in key_columns_cache:
+                key_columns_cache[layout] = resolve_primary_key(layout, primary_keys)
+            key = key_columns_cache[layout]
+            if key is None:
+                # 没有主键：按整行匹配，LIMIT 1保证重复行只删一行
+                yield op.txn, (f"DELETE FROM `{op.database}`.`{op.table}` "
+                               f"WHERE {format_row_match(layout, op.old_values, layout.columns)} LIMIT 1;")
+                continue
+            row = op.old_values
+            key_names = [layout.column_name(column) for column in key]
+            if len(key) == 1:
+                prefix = f"DELETE FROM `{op.database}`.`{op.table}` WHERE {key_names[0]} IN ("
+                item = row[key[0]]
+            else:
+                prefix = f"DELETE FROM `{op.database}`.`{op.table}` WHERE ({', '.join(key_names)}) IN ("
+                item = '(' + ', '.join(row[column] for column in key) + ')'
+            flushed = append_to_batch(pending, layout, prefix, ');', item, op.txn, max_statement_bytes)
+            if flushed:
+                yield flushed
             
-            field_nums = sorted(set(op['old_values'].keys()) | set(op['new_values'].keys()))
+        elif op.type == 'UPDATE' and flashback_mode == 'updates':
+            layout = op.layout
+            old_values = op.old_values
+            new_values = op.new_values
             
-            for field_num in field_nums:
-                if field_num in op['old_values'] and field_num in op['new_values']:
-                    set_parts.append(f"`col_{field_num}` = {op['old_values'][field_num]}")
-                    where_parts.append(f"`col_{field_num}` = {op['new_values'][field_num]}")
+            # 只恢复变化了的列
+            set_parts = [f"{layout.column_name(field_num)} = {old_values[field_num]}"
+                         for field_num in sorted(new_values)
+                         if field_num in old_values and old_values[field_num] != new_values[field_num]]
+            if not set_parts:
+                continue
             
-            if set_parts and where_parts:
-                set_clause = ", ".join(set_parts)
-                where_clause = " AND ".join(where_parts)
-                update_sql = f"UPDATE `{op['database']}`.`{op['table']}` SET {set_clause} WHERE {where_clause};"
-                sql_statements.append(update_sql)
-                #log_detail(f"生成UPDATE恢复语句")
+            # 更新后的整行：后镜像中没有的列没有变化，取前镜像
+            current_row = dict(old_values)
+            current_row.update(new_values)
+            if layout not in key_columns_cache:
+                key_columns_cache[layout] = resolve_primary_key(layout, primary_keys)
+            key = key_columns_cache[layout]
+            if key is not None:
+                where_clause = format_row_match(layout, current_row, key)
+                limit = ''
+            else:
+                where_clause = format_row_match(layout, current_row, sorted(current_row))
+                limit = ' LIMIT 1'
+            yield op.txn, (f"UPDATE `{op.database}`.`{op.table}` SET {', '.join(set_parts)} "
+                           f"WHERE {where_clause}{limit};")
+            #log_detail(f"生成UPDATE恢复语句")
     
-    return sql_statements
+    for batch in pending.values():
+        yield batch_statement(batch)
+
+# 倒序输出时内存中缓存的语句字节数上限，超过后整块倒序写入临时文件
+REVERSE_BUFFER_BYTES = 64 * 1024 * 1024
+
+def spill_reversed_chunk(spill, chunk):
+    """
+    把一块(事务标识, SQL)倒序追加到临时文件，返回该块的(起始偏移, 结束偏移)
+    """
+    start = spill.seek(0, os.SEEK_END)
+    for txn, sql in reversed(chunk):
+        spill.write(f"{txn}\t{sql}\n".encode('utf-8'))
+    return start, spill.tell()
+
+def iter_spilled_chunk(spill, start, end):
+    """
+    顺序读出临时文件中的一块，逐条产出(事务标识, SQL)
+    """
+    spill.seek(start)
+    while spill.tell() < end:
+        txn, sql = spill.readline().decode('utf-8').rstrip('\n').split('\t', 1)
+        yield txn, sql
+
+def reverse_sql_statements(statements, buffer_bytes=REVERSE_BUFFER_BYTES, spill_dir=None):
+    """
+    把按binlog顺序产出的(事务标识, SQL)倒序输出：事务从新到旧，事务内语句也从后往前（撤销顺序），
+    每个事务用BEGIN;/COMMIT;包起来
+
+    语句先缓存在内存中，超过buffer_bytes后整块倒序写入一个临时文件，最后从最后一块往前读出，
+    内存占用只取决于buffer_bytes，与总行数无关。
+    """
+    chunk = []
+    chunk_bytes = 0
+    chunks = []
+    with tempfile.TemporaryFile(dir=spill_dir) as spill:
+        for txn, sql in statements:
+            chunk.append((txn, sql))
+            chunk_bytes += len(sql) + 16
+            if chunk_bytes >= buffer_bytes:
+                chunks.append(spill_reversed_chunk(spill, chunk))
+                chunk = []
+                chunk_bytes = 0
+        if chunks:
+            log_detail(f"倒序输出: 写入 {len(chunks)} 个临时块")
+        # 最后一块直接在内存中倒序
+        sources = [((str(txn), sql) for txn, sql in reversed(chunk))]
+        sources.extend(iter_spilled_chunk(spill, start, end) for start, end in reversed(chunks))
+
+        current_txn = None
+        for source in sources:
+            for txn, sql in source:
+                if txn != current_txn:
+                    if current_txn is not None:
+                        yield 'COMMIT;'
+                    yield 'BEGIN;'
+                    current_txn = txn
+                yield sql
+        if current_txn is not None:
+            yield 'COMMIT;'
+
+RECOVERY_MODE_DESCRIPTION = {
+    'deletes': 'DELETE转INSERT恢复',
+    'updates': 'UPDATE反向恢复',
+    'inserts': 'INSERT转DELETE恢复'
+}
+
+def write_sql_statements(sql_statements, output):
+    """
+    把SQL逐条写入已打开的文件对象，返回语句数
+    """
+    count = 0
+    for sql in sql_statements:
+        output.write(sql + '\n')
+        count += 1
+    return count
 
 def save_to_file(sql_statements, output_file, flashback_mode='deletes'):
     """
-    保存SQL到文件
+    流式保存SQL到文件，语句数写在文件末尾的汇总中，返回语句数
+
+    先写入"<输出文件>.tmp"，全部写完才替换为输出文件；中途出错（如mysqlbinlog退出码非0）时
+    删除临时文件，不留下截断的SQL文件。
+    """
+    temp_file = output_file + '.tmp'
+    try:
+        count = write_sql_file(sql_statements, temp_file, flashback_mode)
+    except BaseException:
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
+        raise
+    os.replace(temp_file, output_file)
+    print(f"SQL已保存到: {output_file}")
+    return count
+
+def write_sql_file(sql_statements, output_file, flashback_mode):
+    """
+    写出带头尾注释的SQL文件，返回语句数
     """
-    mode_description = {
-        'deletes': 'DELETE转INSERT恢复',
-        'updates': 'UPDATE反向恢复',
-        'inserts': 'INSERT转DELETE恢复'
-    }
-    
     with open(output_file, 'w', encoding='utf-8') as f:
         f.write(f"-- Binlog数据恢复SQL\n")
         f.write(f"-- 生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"-- 恢复模式: {mode_description.get(flashback_mode, flashback_mode)}\n")
-        f.write(f"-- 共 {len(sql_statements)} 条SQL语句\n")
+        f.write(f"-- 恢复模式: {RECOVERY_MODE_DESCRIPTION.get(flashback_mode, flashback_mode)}\n")
         f.write("-- 请确认SQL正确性后再执行！\n")
         f.write("-- 建议先备份数据\n\n")
         
-        for sql in sql_statements:
-            f.write(sql + '\n')
-            
-    print(f"SQL已保存到: {output_file}")
+        count = write_sql_statements(sql_statements, f)
+        
+        f.write(f"\n-- 共 {count} 条SQL语句\n")
+        f.write(f"-- 完成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    return count
 
-def extract_sql_enhanced(binlog_file, startpos=None, stoppos=None, flashback_mode='deletes',
-                        start_datetime=None, stop_datetime=None, database=None, table=None,
-                        output_file=None, direct_parse=False, verbose=VERBOSE_NORMAL):
+# ---------------------------------------------------------------------------
+# extract --apply：通过DB-API连接直接执行恢复SQL，按表分区并行
+# ---------------------------------------------------------------------------
+
+APPLY_CHECKPOINT_VERSION = 1
+# 每个事务执行的语句数
+APPLY_BATCH_SIZE = 1000
+# 每个执行线程的待执行队列长度，队列满时生成SQL的一方等待
+APPLY_QUEUE_SIZE = 10000
+APPLY_DRIVERS = ('pymysql', 'MySQLdb', 'mysql.connector')
+# 连接串中"?键=值"可用的连接参数及其类型；主机、端口、用户、密码和库写在连接串本身
+MYSQL_DSN_OPTIONS = {
+    'unix_socket': str, 'charset': str, 'init_command': str,
+    'connect_timeout': int, 'read_timeout': int, 'write_timeout': int,
+    'ssl_ca': str, 'ssl_cert': str, 'ssl_key': str, 'ssl_verify_cert': bool,
+}
+DSN_BOOLEANS = {'1': True, 'true': True, 'yes': True, 'on': True,
+                '0': False, 'false': False, 'no': False, 'off': False}
+# 生成的SQL开头: INSERT INTO `库`.`表` / DELETE FROM `库`.`表` / UPDATE `库`.`表`
+STATEMENT_TABLE_RE = re.compile(r'^(?:INSERT INTO|DELETE FROM|UPDATE) `(.*?)`\.`(.*?)`')
+
+class ApplyError(Exception):
+    """
+    执行恢复SQL失败，已提交的进度保存在断点文件中
+    """
+
+def parse_mysql_dsn(dsn):
+    """
+    解析"mysql://用户:密码@主机:端口/库?unix_socket=...&charset=..."，返回连接参数
+
+    没有写密码时取环境变量MYSQL_PWD，避免密码出现在命令行中。
+    查询参数只接受MYSQL_DSN_OPTIONS中的键，并按其类型转换，未知的键或无效的值抛出ValueError。
+    """
+    url = urlparse(dsn)
+    if url.scheme != 'mysql':
+        raise ValueError(f"连接串应为 mysql://用户:密码@主机:端口/库，而不是 {dsn}")
+    try:
+        port = url.port
+    except ValueError:
+        raise ValueError(f"连接串中的端口无效: {url.netloc.rpartition('@')[2]}")
+    params = {
+        'host': url.hostname or 'localhost',
+        'port': port or 3306,
+        'user': unquote(url.username or ''),
+        'password': unquote(url.password) if url.password is not None else os.environ.get('MYSQL_PWD', ''),
+        'charset': 'utf8mb4',
+    }
+    database = url.path.lstrip('/')
+    if database:
+        params['database'] = unquote(database)
+    for key, values in parse_qs(url.query, keep_blank_values=True).items():
+        value_type = MYSQL_DSN_OPTIONS.get(key)
+        if value_type is None:
+            raise ValueError(f"连接串不支持参数 {key}，可用: {', '.join(sorted(MYSQL_DSN_OPTIONS))}"
+                             f"（主机、端口、用户、密码和库写在 mysql://用户:密码@主机:端口/库 中）")
+        value = values[-1]
+        if value_type is int:
+            if not value.isdigit():
+                raise ValueError(f"连接串参数 {key} 应为非负整数，而不是 {value!r}")
+            value = int(value)
+        elif value_type is bool:
+            if value.lower() not in DSN_BOOLEANS:
+                raise ValueError(f"连接串参数 {key} 应为 true/false/1/0，而不是 {value!r}")
+            value = DSN_BOOLEANS[value.lower()]
+        elif not value:
+            raise ValueError(f"连接串参数 {key} 不能为空")
+        params[key] = value
+    return params
+
+def mysql_connector(dsn, driver='pymysql'):
+    """
+    返回按需建立连接的函数，每个执行线程各用一个连接（关闭自动提交）
+    """
+    params = parse_mysql_dsn(dsn)
+    try:
+        module = importlib.import_module(driver)
+    except ImportError:
+        raise ValueError(f"--apply 需要安装MySQL驱动 {driver}（如 pip install pymysql）")
+
+    # DB-API连接默认不自动提交，事务由SqlApplier按批次提交
+    return lambda: module.connect(**params)
+
+class DryRunConnection:
+    """
+    --apply-dry-run使用的DB-API替身：只计数，不连接数据库
+    """
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        log_debug(f"[dry-run] {sql[:200]}")
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+def statement_table(sql):
+    """
+    生成的SQL作用的"库.表"，BEGIN;/COMMIT;等其他语句返回None
+    """
+    match = STATEMENT_TABLE_RE.match(sql)
+    return f"{match.group(1)}.{match.group(2)}" if match else None
+
+class SqlApplier:
+    """
+    用workers个连接并行执行恢复SQL
+
+    语句按表分到固定的执行线程（同一张表的语句按生成顺序执行），每个线程每batch_size条
+    提交一次事务；倒序模式的BEGIN;/COMMIT;不执行，事务由批次大小决定，跨表的原事务不再保持原子性。
+    每次提交后把各表已提交的语句数写入checkpoint_file；用相同参数重新运行时
+    跳过已提交的语句，从断点继续。提交后、写断点前中断时，最后一批会在续跑时再执行一次。
+    """
+
+    def __init__(self, connect, workers=4, batch_size=APPLY_BATCH_SIZE, checkpoint_file=None, dry_run=False):
+        self.connect = (lambda: DryRunConnection()) if dry_run else connect
+        self.workers = max(workers, 1)
+        self.batch_size = max(batch_size, 1)
+        self.checkpoint_file = checkpoint_file
+        self.dry_run = dry_run
+        self.lock = threading.Lock()
+        self.failed = threading.Event()
+        self.error = None
+        self.run_key = None
+        self.committed = {}
+        self.table_counts = defaultdict(int)
+        self.checkpoint_error = None
+
+    def load_checkpoint(self, checkpoint_file, run_key):
+        """
+        读取断点，返回{表: 已提交语句数}；断点属于其他参数的运行时报错，避免跳过错误的语句
+        """
+        if not checkpoint_file or not os.path.exists(checkpoint_file):
+            return {}
+        try:
+            with open(checkpoint_file, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ApplyError(f"无法读取断点文件 {checkpoint_file}: {e}")
+        if checkpoint.get('version') != APPLY_CHECKPOINT_VERSION or checkpoint.get('run') != run_key:
+            raise ApplyError(f"断点文件 {checkpoint_file} 与本次的binlog或参数不一致，请删除后重新执行")
+        return checkpoint['tables']
+
+    def checkpoint_data(self):
+        return {'version': APPLY_CHECKPOINT_VERSION, 'run': self.run_key, 'tables': self.committed}
+
+    def save_checkpoint(self):
+        if not self.checkpoint_file or self.dry_run:
+            return
+        temp_file = self.checkpoint_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.checkpoint_data(), f, ensure_ascii=False)
+        os.replace(temp_file, self.checkpoint_file)
+
+    def fail(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.failed.set()
+
+    def commit(self, connection, pending):
+        """
+        提交当前批次并写断点；数据库提交失败时抛出异常，断点写入失败不抛出（批次已经提交）
+        """
+        connection.commit()
+        with self.lock:
+            for table, count in pending.items():
+                self.committed[table] = self.committed.get(table, 0) + count
+            pending.clear()
+            try:
+                self.save_checkpoint()
+                return
+            except OSError as e:
+                self.checkpoint_error = e
+        # 内存中的进度仍然准确，停止执行，结束时再尝试写一次
+        self.fail(f"批次已提交，但写入断点文件 {self.checkpoint_file} 失败: {self.checkpoint_error}")
+
+    def worker(self, statements):
+        """
+        执行线程：按顺序执行队列中的语句，每batch_size条提交一次，出错时回滚当前批次并通知其他线程停止
+        """
+        connection = cursor = None
+        try:
+            connection = self.connect()
+            cursor = connection.cursor()
+        except Exception as e:
+            self.fail(f"连接数据库失败: {e}")
+        try:
+            pending = defaultdict(int)
+            count = 0
+            while True:
+                item = statements.get()
+                if item is None:
+                    break
+                if self.failed.is_set():
+                    # 继续取出队列中的语句，生成SQL的一方不会阻塞
+                    continue
+                table, sql = item
+                try:
+                    cursor.execute(sql)
+                except Exception as e:
+                    try:
+                        connection.rollback()
+                    except Exception:
+                        pass
+                    pending.clear()
+                    self.fail(f"{table} 执行失败: {e}\n  {sql[:500]}")
+                    continue
+                pending[table] += 1
+                count += 1
+                if count % self.batch_size == 0:
+                    try:
+                        self.commit(connection, pending)
+                    except Exception as e:
+                        pending.clear()
+                        self.fail(f"提交失败: {e}")
+            if pending:
+                # 其他线程出错时，本线程已执行的语句同样提交并记录，续跑时不会重复
+                try:
+                    self.commit(connection, pending)
+                except Exception as e:
+                    self.fail(f"提交失败: {e}")
+        finally:
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
 
+    def apply(self, statements, run_key=''):
+        """
+        执行statements中的SQL，返回本次执行的语句数；失败时抛出ApplyError
+        """
+        self.run_key = run_key
+        self.committed = dict(self.load_checkpoint(self.checkpoint_file, run_key))
+        done = dict(self.committed)
+        if done:
+            log_normal(f"从断点继续：已提交 {sum(done.values())} 条SQL（{len(done)} 张表）")
+        queues = [queue.Queue(maxsize=APPLY_QUEUE_SIZE) for _ in range(self.workers)]
+        threads = [threading.Thread(target=self.worker, args=(q,), name=f"apply-{k}", daemon=True)
+                   for k, q in enumerate(queues)]
+        for thread in threads:
+            thread.start()
+
+        applied = skipped = 0
+        seen = defaultdict(int)
+        try:
+            for sql in statements:
+                table = statement_table(sql)
+                if table is None:
+                    continue
+                seen[table] += 1
+                if seen[table] <= done.get(table, 0):
+                    skipped += 1
+                    continue
+                if self.failed.is_set():
+                    break
+                queues[zlib.crc32(table.encode('utf-8')) % self.workers].put((table, sql))
+                applied += 1
+        finally:
+            for q in queues:
+                q.put(None)
+            for thread in threads:
+                thread.join()
+
+        self.table_counts = seen
+        if skipped:
+            log_normal(f"跳过断点前已提交的 {skipped} 条SQL")
+        if self.checkpoint_error is not None:
+            try:
+                self.save_checkpoint()
+                log_quiet(f"断点文件 {self.checkpoint_file} 已补写，与已提交的进度一致")
+            except OSError as e:
+                raise ApplyError(f"{self.error}\n已提交的进度未能写入断点文件，续跑前请把以下内容写入 "
+                                 f"{self.checkpoint_file}，否则这些语句会再执行一次:\n"
+                                 f"{json.dumps(self.checkpoint_data(), ensure_ascii=False)}")
+        if self.error:
+            raise ApplyError(self.error)
+        return applied
+
+def apply_run_key(binlog_files, *args):
+    """
+    断点对应的运行标识：binlog文件路径和影响生成SQL的参数
+
+    不含文件大小，活跃binlog在续跑前继续增长时，指定了结束时间/位置的同一次恢复仍可续跑。
+    """
+    key = json.dumps([[os.path.abspath(binlog_file) for binlog_file in binlog_files]] + list(args),
+                     ensure_ascii=False, default=str)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def set_verbose_level(level):
+    """
+    设置输出级别（用于初始化工作进程）
+    """
     global verbose_level
-    verbose_level = verbose
-    
+    verbose_level = level
+
+def read_operations(binlog_file, startpos=None, stoppos=None, flashback_mode='deletes',
+                    start_datetime=None, stop_datetime=None, database=None, table=None,
+                    direct_parse=False, native=False, catalog=None, stream=False, metrics=None):
+    """
+    读取binlog（或其中一个位置区间）并解析，返回(操作列表, 过滤统计)，可在工作进程中执行
+
+    stream为True时返回逐个产出操作的生成器，过滤统计在生成器耗尽后才完整。
+    传入metrics时mysqlbinlog的读取和解码计入mysqlbinlog阶段。
+    """
+    filter_stats = new_filter_stats()
+    if native:
+        log_detail(f"使用原生解析模式")
+        operations = iter_native_operations(
+            binlog_file, startpos, stoppos, start_datetime, stop_datetime,
+            database_filter=database,
+            table_filter=table,
+            flashback_mode=flashback_mode,
+            filter_stats=filter_stats,
+            catalog=catalog
+        )
+        return (operations if stream else list(operations)), filter_stats
+
     extra_args = []
+    if metrics is not None:
+        # 先登记，报告中mysqlbinlog阶段排在parse之前
+        metrics.get('mysqlbinlog')
     
     if start_datetime:
         extra_args.extend(['--start-datetime', start_datetime])
@@ -442,105 +4501,427 @@ def extract_sql_enhanced(binlog_file, startpos=None, stoppos=None, flashback_mod
         extra_args.extend(['--start-position', str(startpos)])
     if stoppos:
         extra_args.extend(['--stop-position', str(stoppos)])
-    
-    log_quiet(f"提取参数: 位置={startpos}-{stoppos}, 数据库={database}, 表={table}, 模式={flashback_mode}")
-    
+
     if direct_parse:
         log_detail(f"使用直接解析模式")
-        
-        try:
-            temp_file = f"/tmp/binlog_content_{os.getpid()}.txt"
-            
-            cmd = ['mysqlbinlog', '--base64-output=decode-rows', '-v'] + extra_args + [binlog_file, '>', temp_file]
-            
-            subprocess.run(' '.join(cmd), shell=True, check=True)
-            
-            with open(temp_file, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-            
-            os.unlink(temp_file)
-            
-        except Exception as e:
-            log_quiet(f"错误: 直接解析binlog失败: {e}")
-            return []
+        # 直接按UTF-8解码，忽略无法解码的字节
+        content = iter_mysqlbinlog_lines(binlog_file, extra_args, encodings=(), metrics=metrics)
     else:
         log_detail(f"使用标准解析模式")
-        content = run_mysqlbinlog_robust(binlog_file, extra_args)
-    
-    if not content:
-        log_quiet("错误: 无法获取binlog内容")
-        return []
+        content = iter_mysqlbinlog_lines(binlog_file, extra_args, metrics=metrics)
     
-    operations = parse_binlog_content_enhanced(
+    operations = iter_content_operations(
         content, 
         database_filter=database, 
         table_filter=table, 
-        flashback_mode=flashback_mode
+        flashback_mode=flashback_mode,
+        filter_stats=filter_stats,
+        catalog=catalog
     )
-    
-    operation_types = defaultdict(int)
+    return (operations if stream else list(operations)), filter_stats
+
+# 多个binlog时事务标识加上 文件序号<<TXN_FILE_SHIFT，各文件的事务位置互不冲突
+TXN_FILE_SHIFT = 40
+
+def offset_transactions(operations, offset):
+    """
+    透传操作，事务标识加上offset（同一事务的行仍共用同一个int对象）
+    """
+    last = key = None
     for op in operations:
-        operation_types[op['type']] += 1
-    
-    log_normal(f"找到 {len(operations)} 个操作: {dict(operation_types)}")
+        if op.txn != last:
+            last = op.txn
+            key = op.txn + offset
+        op.txn = key
+        yield op
+
+def iter_sequence_operations(tasks, read_args, filter_stats, metrics=None):
+    """
+    按顺序逐个读取多个binlog（或区间），流式产出所有操作，过滤统计在生成器耗尽后才完整
+    """
+    for index, binlog_file, start, stop in tasks:
+        log_normal(f"读取 {binlog_file}")
+        operations, file_filter_stats = read_operations(binlog_file, start, stop, *read_args,
+                                                        stream=True, metrics=metrics)
+        yield from offset_transactions(operations, index << TXN_FILE_SHIFT) if index else operations
+        merge_filter_stats(filter_stats, file_filter_stats)
+
+def count_operation_types(operations, operation_types):
+    """
+    透传操作，同时按类型计数
+    """
+    for op in operations:
+        operation_types[op.type] += 1
+        yield op
+
+def report_partial_apply(applier):
+    """
+    --apply中途失败时提示已提交的进度
+    """
+    if applier is not None and applier.checkpoint_file and not applier.dry_run:
+        log_quiet(f"已提交的进度保存在 {applier.checkpoint_file}，用相同参数重新运行可从断点继续")
+
+def extract_sql_enhanced(binlog_file, startpos=None, stoppos=None, flashback_mode='deletes',
+                        start_datetime=None, stop_datetime=None, database=None, table=None,
+                        output_file=None, direct_parse=False, verbose=VERBOSE_NORMAL, native=False,
+                        split=1, workers=None, extended_insert=False, max_statement_bytes=MAX_STATEMENT_BYTES,
+                        reverse=False, reverse_buffer_bytes=REVERSE_BUFFER_BYTES, spill_dir=None,
+                        primary_keys=None, schema_files=None, compact=False, compact_max_rows=COMPACT_MAX_ROWS,
+                        metrics=None, profile_file=None, applier=None):
+    """
+    提取binlog中的行变更并生成恢复SQL，边生成边写出，返回SQL语句数
+
+    binlog_file可以是按序排列的文件列表：指定时间范围时先用plan_binlog_files选出相关文件，
+    位置范围与mysqlbinlog一致，开始位置作用于第一个文件、结束位置作用于最后一个文件，
+    所有文件的结果写入同一个输出。
+    不切分时操作从解析器逐个流向输出，不在内存中保存完整列表；reverse为True时按事务从新到旧输出。
+    传入metrics（PhaseMetrics）时分阶段计时：resolve、schema、mysqlbinlog/decode、parse、compact、sqlgen、write。
+    指定profile_file时用cProfile记录读取到写出的整个循环（切分时不含工作进程）。
+    传入applier（SqlApplier）时不写文件，直接在数据库中执行，write阶段记为apply。
+    读取binlog或执行失败时退出码为1：SQL是边生成边输出的，出错前的部分可能已经写出或执行。
+    """
+
+    global verbose_level
+    verbose_level = verbose
     
-    sql_statements = generate_recovery_sql(operations, flashback_mode)
+    log_quiet(f"提取参数: 位置={startpos}-{stoppos}, 数据库={database}, 表={table}, 模式={flashback_mode}")
     
-    log_normal(f"生成 {len(sql_statements)} 条SQL语句")
+    with metrics_phase(metrics, 'resolve'):
+        binlog_files = [binlog_file] if isinstance(binlog_file, str) else list(binlog_file)
+        if len(binlog_files) > 1:
+            try:
+                binlog_files = plan_binlog_files(binlog_files, start_datetime, stop_datetime)
+            except (OSError, ValueError) as e:
+                log_quiet(f"警告: 无法按时间范围筛选binlog，读取全部文件: {e}")
+        # 任务: (文件序号, 文件, 开始位置, 结束位置)
+        tasks = []
+        for index, path in enumerate(binlog_files):
+            start = startpos if index == 0 else None
+            stop = stoppos if index == len(binlog_files) - 1 else None
+            start, stop = resolve_datetime_positions(path, start_datetime, stop_datetime, start, stop)
+            ranges = [(start, stop)]
+            if split > 1:
+                try:
+                    ranges = plan_split_ranges(path, split, start, stop)
+                except (OSError, ValueError) as e:
+                    log_quiet(f"警告: 无法切分binlog，按单个区间解析: {e}")
+            tasks.extend((index, path, start, stop) for start, stop in ranges)
+
+    try:
+        with metrics_phase(metrics, 'schema'):
+            catalog = SchemaCatalog.load(schema_files) if schema_files else None
+    except (OSError, ValueError, KeyError) as e:
+        log_quiet(f"错误: 读取表结构失败: {e}")
+        sys.exit(1)
+    # 压缩需要完整的变化链，三种行操作都要解析
+    parse_mode = None if compact else flashback_mode
+    read_args = (parse_mode, start_datetime, stop_datetime, database, table, direct_parse, native, catalog)
+    filter_stats = new_filter_stats()
+    started = time.time()
+    operation_types = defaultdict(int)
+    # 原生解析的读取和解码在同一个循环里，记为decode阶段
+    parse_phase = 'decode' if native else 'parse'
+    write_phase = 'apply' if applier is not None else 'write'
+    profiler = cProfile.Profile() if profile_file else None
+    try:
+        if profiler is not None:
+            profiler.enable()
+        if len(tasks) == 1:
+            operations, filter_stats = read_operations(tasks[0][1], tasks[0][2], tasks[0][3], *read_args,
+                                                       stream=True, metrics=metrics)
+            if metrics is not None:
+                operations = metrics.wrap(parse_phase, operations)
+        elif split <= 1 or not tasks:
+            operations = iter_sequence_operations(tasks, read_args, filter_stats, metrics)
+            if metrics is not None:
+                operations = metrics.wrap(parse_phase, operations)
+        else:
+            log_normal(f"按事务边界切分为 {len(tasks)} 个区间并行解析")
+            operations = []
+            max_workers = min(workers or os.cpu_count() or 1, len(tasks))
+            with metrics_phase(metrics, parse_phase) as phase:
+                with ProcessPoolExecutor(max_workers=max_workers, initializer=set_verbose_level,
+                                         initargs=(verbose_level,)) as executor:
+                    futures = [(index, executor.submit(read_operations, path, start, stop, *read_args))
+                               for index, path, start, stop in tasks]
+                    # 按文件、区间顺序拼接，保持事件顺序
+                    for index, future in futures:
+                        range_operations, range_filter_stats = future.result()
+                        if index:
+                            range_operations = offset_transactions(range_operations, index << TXN_FILE_SHIFT)
+                        operations.extend(range_operations)
+                        merge_filter_stats(filter_stats, range_filter_stats)
+                if phase is not None:
+                    phase['rows'] = len(operations)
+
+        operations = count_operation_types(operations, operation_types)
+        compact_stats = new_compact_stats()
+        if compact:
+            operations = compact_operations(operations, primary_keys, compact_max_rows, compact_stats,
+                                            FLASHBACK_OPERATION_TYPES.get(flashback_mode),
+                                            compact_reporter(flashback_mode, primary_keys))
+            if metrics is not None:
+                operations = metrics.wrap('compact', operations)
+        if reverse:
+            sql_statements = reverse_sql_statements(
+                iter_recovery_statements(operations, flashback_mode, extended_insert, max_statement_bytes,
+                                         per_transaction=True, primary_keys=primary_keys),
+                reverse_buffer_bytes, spill_dir)
+        else:
+            sql_statements = generate_recovery_sql(operations, flashback_mode, extended_insert, max_statement_bytes,
+                                                   primary_keys)
+        if metrics is not None:
+            sql_statements = metrics.wrap('sqlgen', sql_statements, 'statements', len)
+
+        with metrics_phase(metrics, write_phase):
+            if applier is not None:
+                run_key = apply_run_key(binlog_files, startpos, stoppos, start_datetime, stop_datetime, database,
+                                        table, flashback_mode, direct_parse, native, extended_insert,
+                                        max_statement_bytes, reverse, compact, compact_max_rows, schema_files,
+                                        sorted(map(str, (primary_keys or {}).items())))
+                count = applier.apply(sql_statements, run_key)
+            elif output_file:
+                count = save_to_file(sql_statements, output_file, flashback_mode)
+            else:
+                count = write_sql_statements(sql_statements, sys.stdout)
+    except ApplyError as e:
+        log_quiet(f"错误: {e}")
+        report_partial_apply(applier)
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        # 输出是流式的，出错前的语句可能已经写到标准输出或已在数据库中执行，退出码必须非0
+        log_quiet(f"错误: mysqlbinlog执行失败: {e.stderr}")
+        report_partial_apply(applier)
+        sys.exit(1)
+    except (OSError, ValueError) as e:
+        log_quiet(f"错误: 读取binlog失败: {e}")
+        report_partial_apply(applier)
+        sys.exit(1)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+            log_normal(f"cProfile结果已保存到: {profile_file}（python -m pstats {profile_file} 查看）")
+
+    if metrics is not None:
+        # 处理量来自解析器的过滤统计
+        phase = metrics.get(parse_phase)
+        phase['lines'] = filter_stats['lines']
+        phase['events'] = filter_stats['rows_events']
+        if native:
+            phase['bytes'] = filter_stats['bytes']
+        elif 'mysqlbinlog' in metrics.phases:
+            phase['bytes'] = metrics.phases['mysqlbinlog']['bytes']
+        metrics.get(write_phase)['statements'] = count
     
-    if output_file:
-        save_to_file(sql_statements, output_file, flashback_mode)
+    log_normal(f"找到 {sum(operation_types.values())} 个操作: {dict(operation_types)}")
+    if database or table:
+        log_normal(format_filter_summary(filter_stats, time.time() - started))
+    if compact:
+        log_normal(format_compact_summary(compact_stats))
+        if compact_stats['unrestorable'] > COMPACT_REPORT_ROWS:
+            log_quiet(f"警告: 共 {compact_stats['unrestorable']} 行的净变化无法按 {flashback_mode} 模式恢复"
+                      f"（-v 列出全部）")
+    if applier is None:
+        log_normal(f"生成 {count} 条SQL语句")
+    elif applier.dry_run:
+        log_normal(f"[dry-run] 将用 {applier.workers} 个连接执行 {count} 条SQL，每 {applier.batch_size} 条提交一次")
+        for table_name, table_count in sorted(applier.table_counts.items()):
+            log_detail(f"  {table_name}: {table_count} 条")
     else:
-        for sql in sql_statements:
-            print(sql)
-    
-    return sql_statements
+        log_normal(f"执行 {count} 条SQL语句，{applier.workers} 个连接，每 {applier.batch_size} 条提交一次")
+    return count
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
         print("Usage:")
-        print("  python binlog_tool.py analyze binlog_file [starttime stoptime]")
-        print("  python binlog_tool.py extract --binlog-file file [options]")
+        print("  python binlog_tool.py analyze binlog_file [binlog_file ...] [starttime stoptime] [options]")
+        print("  python binlog_tool.py extract --binlog-file file|glob|mysql-bin.index [options]")
+        print("  python binlog_tool.py index binlog_file [binlog_file ...] [--force]")
+        print("\nAnalyze options:")
+        print("  binlog_file 可以是多个文件、通配符（如 'mysql-bin.*'）或 mysql-bin.index")
+        print("  --start-datetime / --stop-datetime")
+        print("  --output OUTPUT_FILE  (默认: binlog_stats.txt)")
+        print("  --workers N       并行分析的进程数")
+        print("  --split N         每个文件按事务边界切成N个区间并行分析")
+        print("  --native")
+        print("  --cache-dir DIR   统计结果缓存目录 (默认: ~/.cache/binlog-tools/analyze)")
+        print("  --cache-max-mb N  缓存目录大小上限，超出按最近使用淘汰 (默认: 64)")
+        print("  --no-cache        不使用缓存")
+        print("  --follow          持续跟踪最后一个binlog（原生解析），定期输出各表速率")
+        print("  --start-position N / --interval SEC / --window SEC / --json  (follow模式)")
+        print("  --bucket 1s|1m|1h 按时间桶统计各表的变更行数")
+        print("  --bucket-output FILE  时间桶统计文件，.jsonl结尾输出JSON行，否则CSV (默认: binlog_activity.csv)")
+        print("  --top-transactions N  在报告末尾列出最大的N个事务")
+        print("  --sort-by rows|bytes|duration  最大事务的排序指标 (默认: rows)")
+        print("  --stats           输出各阶段的耗时、CPU、处理量和峰值内存")
+        print("  --metrics-json FILE  各阶段计时报告写入JSON文件")
         print("\nEnhanced extract options:")
+        print("  --binlog-file FILE  可重复，支持通配符和 mysql-bin.index；指定时间范围时只读取相关的文件")
         print("  --start-position START_POS")
         print("  --stop-position STOP_POS") 
         print("  --start-datetime START_DATETIME")
         print("  --stop-datetime STOP_DATETIME")
-        print("  --database DATABASE")
-        print("  --table TABLE")
+        print("  --database DATABASE   可重复或逗号分隔，支持通配符(shop_*)和正则(re:shop_\\d+)")
+        print("  --table TABLE         同上")
         print("  --output OUTPUT_FILE")
+        print("  --extended-insert  DELETE恢复按表合并为多行INSERT")
+        print("  --max-statement-bytes N  多行INSERT/批量DELETE单条语句字节上限 (默认: 1048576)")
+        print("  --primary-key [DB.]TABLE=COLS  inserts模式的主键列（列序号@N或列名），可重复")
+        print("  --schema FILE     表结构文件（CREATE TABLE导出或JSON），提供列名和主键，可重复")
+        print("  --compact         按主键把同一行的多次变更合并为一次净变化")
+        print("  --compact-max-rows N  压缩时同时跟踪的行数上限 (默认: 1000000)")
+        print("  --reverse         按事务从新到旧倒序输出（闪回顺序）")
+        print("  --reverse-buffer-mb N  倒序输出时的内存缓冲上限，超出部分写入临时文件 (默认: 64)")
+        print("  --spill-dir DIR   倒序输出的临时文件目录")
         print("  --direct-parse")
+        print("  --native          原生解析二进制binlog（不依赖mysqlbinlog）")
+        print("  --split N         按事务边界切成N个位置区间并行解析")
+        print("  --workers N       并行解析的进程数")
         print("  --flashback-mode {deletes|updates|inserts}")
         print("  --verbose, -v     输出详细程度 (可重复使用: -v, -vv, -vvv)")
+        print("  --stats           输出各阶段的耗时、CPU、处理量和峰值内存")
+        print("  --metrics-json FILE  各阶段计时报告写入JSON文件")
+        print("  --profile FILE    用cProfile记录解析到写出的循环")
+        print("  --apply DSN       直接在数据库中执行，mysql://用户:密码@主机:端口/库（密码可用MYSQL_PWD）")
+        print("  --apply-driver pymysql|MySQLdb|mysql.connector  DB-API驱动 (默认: pymysql)")
+        print("  --apply-workers N / --apply-batch N  并行连接数（按表分配）/ 每个事务的语句数 (默认: 4 / 1000)")
+        print("  --apply-checkpoint FILE  断点文件，失败后用相同参数重新运行从断点继续")
+        print("  --apply-dry-run   只按表分区、分批计数，不连接数据库")
         sys.exit(1)
 
     cmd = sys.argv[1].lower()
 
     if cmd == "analyze":
-        if len(sys.argv) < 3:
+        parser = argparse.ArgumentParser(description='Binlog统计分析工具')
+        parser.add_argument('binlog_files', nargs='+', help='binlog文件、通配符或mysql-bin.index，可指定多个')
+        parser.add_argument('--start-datetime', help='开始时间')
+        parser.add_argument('--stop-datetime', help='结束时间')
+        parser.add_argument('--output', '-o', default='binlog_stats.txt', help='统计报告文件')
+        parser.add_argument('--workers', type=int, help='并行分析的进程数（默认CPU核数）')
+        parser.add_argument('--split', type=int, default=1, help='每个文件按事务边界切成N个区间并行分析')
+        parser.add_argument('--native', action='store_true', help='原生解析二进制binlog（不依赖mysqlbinlog）')
+        parser.add_argument('--cache-dir', default=ANALYZE_CACHE_DIR, help='统计结果缓存目录')
+        parser.add_argument('--cache-max-mb', type=int, default=ANALYZE_CACHE_MAX_BYTES // (1024 * 1024),
+                            help='缓存目录大小上限(MB)，超出按最近使用淘汰')
+        parser.add_argument('--no-cache', action='store_true', help='不使用缓存，每次完整分析')
+        parser.add_argument('--follow', action='store_true', help='持续跟踪最后一个binlog，输出实时速率（Ctrl-C结束）')
+        parser.add_argument('--start-position', type=int, help='follow模式的开始位置（默认当前末尾）')
+        parser.add_argument('--interval', type=float, default=5.0, help='follow模式的输出间隔(秒)')
+        parser.add_argument('--window', type=int, default=60, help='follow模式计算速率的时间窗口(秒)')
+        parser.add_argument('--json', action='store_true', help='follow模式每次输出一行JSON')
+        parser.add_argument('--bucket', help='按时间桶统计各表的变更行数，如 1s、1m、1h')
+        parser.add_argument('--bucket-output', default='binlog_activity.csv',
+                            help='时间桶统计文件，.json/.jsonl结尾时输出JSON行，否则CSV（默认binlog_activity.csv）')
+        parser.add_argument('--top-transactions', type=int, default=0, help='在报告末尾列出最大的N个事务')
+        parser.add_argument('--sort-by', choices=TRANSACTION_SORT_KEYS, default='rows',
+                            help='最大事务的排序指标：行数、字节数或耗时（默认rows）')
+        parser.add_argument('--stats', action='store_true', help='输出各阶段的耗时、CPU、处理量和峰值内存')
+        parser.add_argument('--metrics-json', help='各阶段计时报告写入该JSON文件')
+        args = parser.parse_intermixed_args(sys.argv[2:])
+        try:
+            bucket_seconds = parse_bucket_arg(args.bucket) if args.bucket else None
+        except ValueError as e:
+            parser.error(str(e))
+        if args.top_transactions < 0:
+            parser.error("--top-transactions 不能为负数")
+
+        # 兼容旧用法: analyze binlog_file [starttime stoptime]
+        positional = list(args.binlog_files)
+        datetimes = []
+        while positional and DATETIME_ARG_RE.match(positional[-1]) and len(datetimes) < 2:
+            datetimes.insert(0, positional.pop())
+        starttime = args.start_datetime or (datetimes[0] if datetimes else None)
+        stoptime = args.stop_datetime or (datetimes[1] if len(datetimes) > 1 else None)
+
+        binlog_files = expand_binlog_inputs(positional)
+        if not binlog_files:
             print("需要指定binlog文件")
             sys.exit(1)
-        binlog_file = sys.argv[2]
-        starttime = sys.argv[3] if len(sys.argv) > 3 else None
-        stoptime = sys.argv[4] if len(sys.argv) > 4 else None
-        analyze_binlog(binlog_file, starttime, stoptime)
+        if args.follow:
+            try:
+                follow_binlog(binlog_files[-1], args.start_position, args.interval, max(args.window, 1), args.json)
+            except (OSError, ValueError) as e:
+                print(f"Error reading {binlog_files[-1]}: {e}")
+                sys.exit(1)
+            sys.exit(0)
+        metrics = PhaseMetrics() if args.stats or args.metrics_json else None
+        try:
+            analyze_binlogs(binlog_files, starttime, stoptime, native=args.native,
+                            workers=args.workers, output_file=args.output, split=args.split,
+                            cache_dir=None if args.no_cache else args.cache_dir,
+                            cache_max_bytes=args.cache_max_mb * 1024 * 1024, metrics=metrics,
+                            bucket_seconds=bucket_seconds, bucket_output=args.bucket_output,
+                            top_transactions=args.top_transactions, transaction_sort=args.sort_by)
+        finally:
+            if metrics is not None:
+                emit_metrics(metrics, args.stats, args.metrics_json)
+
+    elif cmd == "index":
+        parser = argparse.ArgumentParser(description='生成binlog时间戳索引（加速按时间范围的analyze/extract）')
+        parser.add_argument('binlog_files', nargs='+', help='binlog文件、通配符或mysql-bin.index，可指定多个')
+        parser.add_argument('--force', action='store_true', help='即使已有有效索引也重新生成')
+        args = parser.parse_args(sys.argv[2:])
+
+        failed = False
+        for binlog_file in expand_binlog_inputs(args.binlog_files):
+            try:
+                index_file, count, rebuilt = index_binlog(binlog_file, force=args.force)
+            except (OSError, ValueError) as e:
+                print(f"Error indexing {binlog_file}: {e}")
+                failed = True
+                continue
+            state = '已生成' if rebuilt else '已是最新'
+            print(f"{index_file}: {state}，{count} 个检查点")
+        if failed:
+            sys.exit(1)
 
     elif cmd == "extract":
         parser = argparse.ArgumentParser(description='Binlog数据提取工具')
-        parser.add_argument('--binlog-file', required=True, help='binlog文件路径')
-        parser.add_argument('--database', help='数据库名过滤')
-        parser.add_argument('--table', help='表名过滤')
+        parser.add_argument('--binlog-file', action='append', required=True,
+                            help='binlog文件、通配符或mysql-bin.index，可重复；多个文件按顺序读取，结果写入同一个输出')
+        parser.add_argument('--database', action='append',
+                            help='数据库名过滤，可重复或逗号分隔，支持通配符和"re:正则"')
+        parser.add_argument('--table', action='append',
+                            help='表名过滤，可重复或逗号分隔，支持通配符和"re:正则"')
         parser.add_argument('--start-position', type=int, help='开始位置')
         parser.add_argument('--stop-position', type=int, help='结束位置')
         parser.add_argument('--start-datetime', help='开始时间')
         parser.add_argument('--stop-datetime', help='结束时间')
         parser.add_argument('--output', '-o', help='输出文件')
+        parser.add_argument('--extended-insert', action='store_true', help='DELETE恢复按表合并为多行INSERT')
+        parser.add_argument('--max-statement-bytes', type=int, default=MAX_STATEMENT_BYTES,
+                            help='多行INSERT单条语句字节上限，需小于max_allowed_packet（默认1MB）')
+        parser.add_argument('--primary-key', action='append',
+                            help='inserts模式的主键列，格式 [库.]表=列[,列]，列为列序号(@N)或列名，可重复')
+        parser.add_argument('--schema', action='append',
+                            help='表结构文件：CREATE TABLE导出（如mysqldump --no-data）或JSON，提供列名和主键，可重复')
+        parser.add_argument('--compact', action='store_true', help='按主键把同一行的多次变更合并为一次净变化')
+        parser.add_argument('--compact-max-rows', type=int, default=COMPACT_MAX_ROWS,
+                            help='压缩时同时跟踪的行数上限，超出后先输出最久未变化的行（默认1000000）')
+        parser.add_argument('--reverse', action='store_true', help='按事务从新到旧倒序输出（闪回顺序）')
+        parser.add_argument('--reverse-buffer-mb', type=int, default=REVERSE_BUFFER_BYTES // (1024 * 1024),
+                            help='倒序输出时的内存缓冲上限，超出部分写入临时文件（默认64）')
+        parser.add_argument('--spill-dir', help='倒序输出的临时文件目录（默认系统临时目录）')
         parser.add_argument('--direct-parse', action='store_true', help='直接解析模式（避免编码问题）')
+        parser.add_argument('--native', action='store_true', help='原生解析二进制binlog（不依赖mysqlbinlog）')
+        parser.add_argument('--split', type=int, default=1, help='按事务边界切成N个位置区间并行解析')
+        parser.add_argument('--workers', type=int, help='并行解析的进程数（默认CPU核数）')
         parser.add_argument('--flashback-mode', default='deletes', 
                           choices=['deletes', 'updates', 'inserts'], 
                           help='闪回模式')
         parser.add_argument('--verbose', '-v', action='count', default=1,
                           help='输出详细程度 (可重复使用: -v, -vv, -vvv)')
+        parser.add_argument('--stats', action='store_true', help='输出各阶段的耗时、CPU、处理量和峰值内存')
+        parser.add_argument('--metrics-json', help='各阶段计时报告写入该JSON文件')
+        parser.add_argument('--profile', help='用cProfile记录解析到写出的循环，结果写入该文件')
+        parser.add_argument('--apply', metavar='DSN',
+                            help='直接在数据库中执行恢复SQL，连接串 mysql://用户:密码@主机:端口/库（密码可用MYSQL_PWD）')
+        parser.add_argument('--apply-driver', default='pymysql', choices=APPLY_DRIVERS, help='DB-API驱动（默认pymysql）')
+        parser.add_argument('--apply-workers', type=int, default=4, help='并行执行的连接数，按表分配（默认4）')
+        parser.add_argument('--apply-batch', type=int, default=APPLY_BATCH_SIZE, help='每个事务执行的语句数（默认1000）')
+        parser.add_argument('--apply-checkpoint', help='断点文件，失败后用相同参数重新运行可从断点继续')
+        parser.add_argument('--apply-dry-run', action='store_true', help='只按表分区、分批计数，不连接数据库')
         
         # 解析参数（跳过前两个参数：脚本名和命令）
         args = parser.parse_args(sys.argv[2:])
@@ -554,8 +4935,30 @@ if __name__ == "__main__":
         }
         verbose_level = verbosity_map.get(args.verbose, VERBOSE_NORMAL)
         
+        try:
+            primary_keys = parse_primary_key_args(args.primary_key)
+        except ValueError as e:
+            parser.error(str(e))
+
+        applier = None
+        if args.apply or args.apply_dry_run:
+            if args.output:
+                parser.error("--apply 与 --output 不能同时使用")
+            try:
+                connect = mysql_connector(args.apply, args.apply_driver) if not args.apply_dry_run else None
+            except ValueError as e:
+                parser.error(str(e))
+            applier = SqlApplier(connect, args.apply_workers, args.apply_batch, args.apply_checkpoint,
+                                 dry_run=args.apply_dry_run)
+        
+        binlog_files = expand_binlog_inputs(args.binlog_file)
+        if not binlog_files:
+            print("需要指定binlog文件")
+            sys.exit(1)
+
+        metrics = PhaseMetrics() if args.stats or args.metrics_json else None
         extract_sql_enhanced(
-            binlog_file=args.binlog_file,
+            binlog_file=binlog_files if len(binlog_files) > 1 else binlog_files[0],
             startpos=args.start_position,
             stoppos=args.stop_position,
             flashback_mode=args.flashback_mode,
@@ -565,8 +4968,25 @@ if __name__ == "__main__":
             table=args.table,
             output_file=args.output,
             direct_parse=args.direct_parse,
-            verbose=verbose_level
+            verbose=verbose_level,
+            native=args.native,
+            split=args.split,
+            workers=args.workers,
+            extended_insert=args.extended_insert,
+            max_statement_bytes=args.max_statement_bytes,
+            reverse=args.reverse,
+            reverse_buffer_bytes=args.reverse_buffer_mb * 1024 * 1024,
+            spill_dir=args.spill_dir,
+            primary_keys=primary_keys,
+            schema_files=args.schema,
+            compact=args.compact,
+            compact_max_rows=args.compact_max_rows,
+            metrics=metrics,
+            profile_file=args.profile,
+            applier=applier
         )
+        if metrics is not None:
+            emit_metrics(metrics, args.stats, args.metrics_json)
 
     else:
         print("Unknown command")
@@ -0,0 +1,26 @@
+"""
+analyze --bucket：按时间桶统计各表活动，迟到的事件合并进已有的桶
+"""
+import json
+
+import binlog_tool_rollback as tool
+
+
+def test_late_buckets_are_merged(tmp_path):
+    base = 739000 * 86400
+    spill = tmp_path / 'spill.jsonl'
+    rows = []
+    for i in range(600):
+        # 每隔一段有事件迟到15分钟，超过BUCKET_LATENESS_SECONDS
+        moment = base + i * 10 - (900 if i % 37 == 0 else 0)
+        rows.append([moment - moment % 60, 'db', f"t{i % 3}", 1, 0, 0])
+    spill.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+
+    for name in ('activity.csv', 'activity.jsonl'):
+        output = str(tmp_path / name)
+        written = tool.merge_activity_files([str(spill)], output, 60)
+        buckets = list(tool.read_activity_buckets(output))
+        texts = [text for text, _ in buckets]
+        assert texts == sorted(set(texts))
+        assert written == sum(len(tables) + 1 for _, tables in buckets)
+        assert sum(counts[0] for _, tables in buckets for counts in tables.values()) == len(rows)
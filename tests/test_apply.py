@@ -0,0 +1,175 @@
+"""
+extract --apply：按表并行执行恢复SQL，断点续跑
+"""
+import json
+import sqlite3
+import threading
+from collections import defaultdict
+
+import pytest
+
+import binlog_tool_rollback as tool
+from conftest import native_operations
+
+
+class FakeDatabase:
+    """
+    记录已提交语句的假数据库；fail_on中的语句执行时报错（只报一次）
+    """
+
+    def __init__(self, fail_on=()):
+        self.lock = threading.Lock()
+        self.committed = []
+        self.fail_on = set(fail_on)
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    """
+    DB-API连接替身：语句在commit前暂存，rollback时丢弃
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.pending = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        with self.database.lock:
+            if sql in self.database.fail_on:
+                self.database.fail_on.discard(sql)
+                raise sqlite3.OperationalError('injected failure')
+        self.pending.append(sql)
+
+    def commit(self):
+        with self.database.lock:
+            self.database.committed.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        pass
+
+
+def recovery_statements(workload):
+    return list(tool.generate_recovery_sql(iter(native_operations(workload, flashback_mode='deletes')), 'deletes'))
+
+
+def by_table(statements):
+    tables = defaultdict(list)
+    for sql in statements:
+        tables[tool.statement_table(sql)].append(sql)
+    return dict(tables)
+
+
+def test_apply_executes_every_statement(workload):
+    statements = recovery_statements(workload)
+    database = FakeDatabase()
+    applier = tool.SqlApplier(database.connect, workers=3, batch_size=50)
+    assert applier.apply(iter(statements), 'run') == len(statements)
+    assert by_table(database.committed) == by_table(statements)
+
+
+def test_apply_resumes_from_checkpoint(workload, tmp_path):
+    statements = recovery_statements(workload)
+    checkpoint = str(tmp_path / 'apply.json')
+    failing = by_table(statements)['bench.t002'][120]
+    database = FakeDatabase(fail_on=[failing])
+
+    applier = tool.SqlApplier(database.connect, workers=2, batch_size=40, checkpoint_file=checkpoint)
+    with pytest.raises(tool.ApplyError):
+        applier.apply(iter(statements), 'run')
+    first_run = len(database.committed)
+    assert 0 < first_run < len(statements)
+    with open(checkpoint, encoding='utf-8') as f:
+        assert sum(json.load(f)['tables'].values()) == first_run
+
+    # 参数不同的运行不能使用该断点
+    with pytest.raises(tool.ApplyError):
+        tool.SqlApplier(database.connect, checkpoint_file=checkpoint).apply(iter(statements), 'other')
+
+    applier = tool.SqlApplier(database.connect, workers=2, batch_size=40, checkpoint_file=checkpoint)
+    assert applier.apply(iter(statements), 'run') == len(statements) - first_run
+    # 每条语句恰好执行一次，同一张表内保持生成顺序
+    assert by_table(database.committed) == by_table(statements)
+
+    applier = tool.SqlApplier(database.connect, workers=2, batch_size=40, checkpoint_file=checkpoint)
+    assert applier.apply(iter(statements), 'run') == 0
+
+
+def test_apply_dry_run_counts_tables(workload):
+    statements = recovery_statements(workload)
+    applier = tool.SqlApplier(None, workers=2, dry_run=True)
+    assert applier.apply(iter(statements), 'run') == len(statements)
+    assert dict(applier.table_counts) == {table: len(sqls) for table, sqls in by_table(statements).items()}
+
+
+def failing_checkpoint(applier, failures):
+    """
+    让applier的第2次起共failures次断点写入失败（模拟磁盘满）
+    """
+    save = applier.save_checkpoint
+    calls = [0]
+
+    def flaky():
+        calls[0] += 1
+        if 1 < calls[0] <= 1 + failures:
+            raise OSError(28, 'No space left on device')
+        save()
+    applier.save_checkpoint = flaky
+
+
+def test_checkpoint_write_failure_is_not_a_commit_failure(workload, tmp_path):
+    statements = recovery_statements(workload)
+    checkpoint = str(tmp_path / 'apply.json')
+    database = FakeDatabase()
+
+    applier = tool.SqlApplier(database.connect, workers=1, batch_size=40, checkpoint_file=checkpoint)
+    failing_checkpoint(applier, 1)
+    with pytest.raises(tool.ApplyError) as error:
+        applier.apply(iter(statements), 'run')
+    assert '批次已提交' in str(error.value) and '提交失败' not in str(error.value)
+    # 结束时补写断点，与数据库中已提交的语句一致
+    with open(checkpoint, encoding='utf-8') as f:
+        assert sum(json.load(f)['tables'].values()) == len(database.committed)
+
+    applier = tool.SqlApplier(database.connect, workers=1, batch_size=40, checkpoint_file=checkpoint)
+    applier.apply(iter(statements), 'run')
+    assert by_table(database.committed) == by_table(statements)
+
+
+def test_checkpoint_write_failure_reports_progress(workload, tmp_path):
+    statements = recovery_statements(workload)
+    database = FakeDatabase()
+    applier = tool.SqlApplier(database.connect, workers=1, batch_size=40,
+                              checkpoint_file=str(tmp_path / 'apply.json'))
+    failing_checkpoint(applier, 100)
+    with pytest.raises(tool.ApplyError) as error:
+        applier.apply(iter(statements), 'run')
+    # 错误信息中带有应写入断点文件的内容
+    progress = json.loads(str(error.value).rsplit('\n', 1)[1])
+    assert progress['run'] == 'run'
+    assert sum(progress['tables'].values()) == len(database.committed)
+
+
+def test_dsn_query_options_are_typed():
+    params = tool.parse_mysql_dsn('mysql://root:pw@db1:3307/shop?connect_timeout=5&ssl_verify_cert=off'
+                                  '&unix_socket=/tmp/mysql.sock')
+    assert params['port'] == 3307 and params['database'] == 'shop'
+    assert params['connect_timeout'] == 5
+    assert params['ssl_verify_cert'] is False
+    assert params['unix_socket'] == '/tmp/mysql.sock'
+
+
+@pytest.mark.parametrize('dsn', ['mysql://db1/?port=', 'mysql://db1/?port=3307', 'mysql://db1/?foo=1',
+                                 'mysql://db1/?connect_timeout=5s', 'mysql://db1/?ssl_verify_cert=maybe',
+                                 'mysql://db1/?charset=', 'mysql://db1:abc/shop'])
+def test_dsn_rejects_invalid_options(dsn):
+    with pytest.raises(ValueError):
+        tool.parse_mysql_dsn(dsn)
@@ -0,0 +1,121 @@
+"""
+extract --compact：按主键跨INSERT/UPDATE/DELETE合成净变化，再按闪回模式生成SQL
+"""
+import pytest
+
+import binlog_tool_rollback as tool
+from conftest import native_operations
+
+COLUMNS = ('id', 'name')
+
+
+def insert(row_id, name, txn=0):
+    return tool.new_row_operation('INSERT', 'shop', 'users', (1, 2), (str(row_id), f"'{name}'"), txn=txn,
+                                  column_names=COLUMNS, primary_key=('id',))
+
+
+def delete(row_id, name, txn=0):
+    return tool.new_row_operation('DELETE', 'shop', 'users', (1, 2), (str(row_id), f"'{name}'"), txn=txn,
+                                  column_names=COLUMNS, primary_key=('id',))
+
+
+def update(row_id, old_name, new_name, txn=0):
+    return tool.new_row_operation('UPDATE', 'shop', 'users', (1, 2), (str(row_id), f"'{old_name}'"),
+                                  (1, 2), (str(row_id), f"'{new_name}'"), txn,
+                                  column_names=COLUMNS, primary_key=('id',))
+
+
+def compact(operations, mode):
+    stats = tool.new_compact_stats()
+    reported = []
+    result = list(tool.compact_operations(iter(operations), stats=stats,
+                                          op_type=tool.FLASHBACK_OPERATION_TYPES[mode], report=reported.append))
+    return result, stats, reported
+
+
+def recovery_sql(operations, mode):
+    result, _, _ = compact(operations, mode)
+    return list(tool.generate_recovery_sql(iter(result), mode))
+
+
+@pytest.mark.parametrize('mode', ['deletes', 'updates', 'inserts'])
+def test_insert_then_delete_cancels(mode):
+    result, stats, reported = compact([insert(1, 'a'), update(1, 'a', 'b'), delete(1, 'b')], mode)
+    assert result == [] and reported == []
+    assert stats['input'] == 3 and stats['output'] == 0 and stats['unrestorable'] == 0
+
+
+def test_delete_then_insert_restores_once():
+    operations = [delete(1, 'a'), insert(1, 'b')]
+    assert recovery_sql(operations, 'updates') == [
+        "UPDATE `shop`.`users` SET `name` = 'a' WHERE `id` = 1;"]
+
+    # 行又存在了，deletes模式不能再INSERT一次，逐行报告
+    result, stats, reported = compact(operations, 'deletes')
+    assert result == []
+    assert stats['unrestorable'] == 1
+    assert [(op.type, op.old_values, op.new_values) for op in reported] == [
+        ('UPDATE', {1: '1', 2: "'a'"}, {1: '1', 2: "'b'"})]
+
+
+def test_delete_then_identical_insert_is_nothing():
+    for mode in ('deletes', 'updates', 'inserts'):
+        result, stats, reported = compact([delete(1, 'a'), insert(1, 'a')], mode)
+        assert result == [] and reported == []
+
+
+def test_updates_collapse_into_one():
+    operations = [update(1, 'a', 'b'), update(1, 'b', 'c'), update(1, 'c', 'd'), update(2, 'x', 'y')]
+    result, stats, _ = compact(operations, 'updates')
+    assert [(op.type, op.old_values[2], op.new_values[2]) for op in result] == [
+        ('UPDATE', "'a'", "'d'"), ('UPDATE', "'x'", "'y'")]
+    assert stats['input'] == 4 and stats['output'] == 2
+    assert recovery_sql(operations, 'updates')[0] == "UPDATE `shop`.`users` SET `name` = 'a' WHERE `id` = 1;"
+
+
+def test_delete_reinsert_delete_restores_earliest_image():
+    operations = [delete(1, 'a'), insert(1, 'b'), update(1, 'b', 'c'), delete(1, 'c')]
+    assert recovery_sql(operations, 'deletes') == ["INSERT INTO `shop`.`users` VALUES (1, 'a');"]
+
+
+def test_insert_then_update_is_reported_in_updates_mode():
+    operations = [insert(1, 'a'), update(1, 'a', 'b')]
+    result, stats, reported = compact(operations, 'updates')
+    assert result == [] and stats['unrestorable'] == 1
+    assert reported[0].type == 'INSERT'
+    # inserts模式按最终镜像的主键删除
+    assert recovery_sql(operations, 'inserts') == ["DELETE FROM `shop`.`users` WHERE `id` IN (1);"]
+    assert '1 行的净变化无法按闪回模式恢复' in tool.format_compact_summary(stats)
+
+
+def test_unrestorable_rows_are_reported_per_row(capsys):
+    report = tool.compact_reporter('deletes')
+    for row_id in (1, 2):
+        report(insert(row_id, 'a'))
+    err = capsys.readouterr().err
+    assert "shop.users (`id`=1) 的净变化为INSERT" in err
+    assert "shop.users (`id`=2) 的净变化为INSERT" in err
+
+
+def test_workload_net_changes(workload):
+    # 负载中的行都在区间内插入，净变化只剩仍然存在的行（INSERT）
+    operations = native_operations(workload)
+    live = {}
+    for op in operations:
+        key = (op.layout.table, op.old_values[1])
+        if op.type == 'DELETE':
+            del live[key]
+        else:
+            row = dict(live.get(key) or op.old_values)
+            row.update(op.new_values)
+            live[key] = row
+
+    result, stats, _ = compact(operations, 'inserts')
+    assert stats['input'] == len(operations) and stats['unrestorable'] == 0
+    assert {(op.layout.table, tuple(op.old_values.items())) for op in result} == {
+        (table, tuple(row.items())) for (table, _), row in live.items()}
+
+    for mode in ('deletes', 'updates'):
+        result, stats, reported = compact(operations, mode)
+        assert result == []
+        assert stats['unrestorable'] == len(reported) == len(live)
@@ -0,0 +1,57 @@
+"""
+extract的流式输出：mysqlbinlog失败时不留下截断的文件，退出码非0
+"""
+import os
+import stat
+
+import pytest
+
+import binlog_tool_rollback as tool
+
+
+def test_save_to_file_leaves_no_partial_output(tmp_path):
+    output = str(tmp_path / 'recovery.sql')
+
+    def broken():
+        yield 'INSERT INTO `d`.`t` VALUES (1);'
+        raise ValueError('mysqlbinlog exited with 2')
+
+    with pytest.raises(ValueError):
+        tool.save_to_file(broken(), output)
+    assert os.listdir(str(tmp_path)) == []
+
+    assert tool.save_to_file(iter(['INSERT INTO `d`.`t` VALUES (1);']), output) == 1
+    assert os.listdir(str(tmp_path)) == ['recovery.sql']
+
+
+@pytest.fixture
+def failing_mysqlbinlog(tmp_path, monkeypatch, workload):
+    """
+    输出一部分负载文本后以退出码1结束的mysqlbinlog替身
+    """
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    script = bin_dir / 'mysqlbinlog'
+    script.write_text(f"#!/bin/sh\nhead -n 2000 '{workload['text']}'\necho 'read error' >&2\nexit 1\n")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return workload
+
+
+def test_mysqlbinlog_failure_exits_non_zero(failing_mysqlbinlog, tmp_path, capsys):
+    with pytest.raises(SystemExit) as exited:
+        tool.extract_sql_enhanced(failing_mysqlbinlog['binlog'], flashback_mode='deletes')
+    assert exited.value.code == 1
+    # 出错前的语句已经写到标准输出
+    assert 'INSERT INTO' in capsys.readouterr().out
+
+    output = str(tmp_path / 'recovery.sql')
+    with pytest.raises(SystemExit):
+        tool.extract_sql_enhanced(failing_mysqlbinlog['binlog'], flashback_mode='deletes', output_file=output)
+    assert not os.path.exists(output) and not os.path.exists(output + '.tmp')
+
+
+def test_unreadable_binlog_exits_non_zero(tmp_path):
+    with pytest.raises(SystemExit) as exited:
+        tool.extract_sql_enhanced(str(tmp_path / 'missing-bin.000001'), native=True)
+    assert exited.value.code == 1
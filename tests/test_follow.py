@@ -0,0 +1,39 @@
+"""
+analyze --follow：读取活跃binlog中陆续追加的事件
+"""
+import binlog_tool_rollback as tool
+
+
+def read_until_idle(events):
+    """
+    读取follow_binlog_events直到文件末尾（产出None），返回读到的事件
+    """
+    seen = []
+    for event in events:
+        if event is None:
+            return seen
+        seen.append(event)
+    return seen
+
+
+def test_follow_reads_appended_events(workload, tmp_path):
+    with open(workload['binlog'], 'rb') as f:
+        data = f.read()
+    headers = list(tool.scan_event_headers(workload['binlog']))
+    # 截在一个事件中间，模拟写了一半的活跃binlog
+    cut = headers[len(headers) // 3][2] + 7
+    active = str(tmp_path / 'bench-bin.000001')
+    with open(active, 'wb') as f:
+        f.write(data[:cut])
+
+    events = tool.follow_binlog_events(active, poll_interval=0)
+    seen = read_until_idle(events)
+    assert seen[-1][4] <= cut
+
+    with open(active, 'ab') as f:
+        f.write(data[cut:])
+    seen.extend(read_until_idle(events))
+    events.close()
+
+    assert [(event[1], event[3], event[4]) for event in seen] == [
+        (event_type, pos, next_pos) for event_type, _, pos, next_pos in headers]
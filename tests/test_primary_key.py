@@ -0,0 +1,36 @@
+"""
+--primary-key：按列名或@N指定主键，inserts模式按主键批量DELETE
+"""
+import pytest
+
+import binlog_tool_rollback as tool
+from conftest import native_operations
+
+
+def test_primary_key_column_number_forms():
+    assert tool.parse_primary_key_args(['bench.t001=@1']) == {('bench', 't001'): [1]}
+    assert tool.parse_primary_key_args(['bench.t001=1']) == {('bench', 't001'): [1]}
+    assert tool.parse_primary_key_args(['t001=@1,c2']) == {(None, 't001'): [1, 'c2']}
+    with pytest.raises(ValueError):
+        tool.parse_primary_key_args(['t001=@id'])
+
+
+def test_primary_key_at_n_resolves(workload):
+    operations = native_operations(workload, flashback_mode='inserts')
+    layout = next(op.layout for op in operations if op.type == 'INSERT')
+    for value in ('@1', '1', 'id'):
+        primary_keys = tool.parse_primary_key_args([f"{layout.database}.{layout.table}={value}"])
+        assert tool.resolve_primary_key(layout, primary_keys) == (1,)
+
+    by_number = list(tool.generate_recovery_sql(
+        iter(operations), 'inserts', primary_keys=tool.parse_primary_key_args(['t001=@1'])))
+    by_name = list(tool.generate_recovery_sql(
+        iter(operations), 'inserts', primary_keys=tool.parse_primary_key_args(['t001=id'])))
+    assert by_number == by_name
+
+
+def test_unresolved_primary_key_falls_back(workload, capsys):
+    layout = native_operations(workload)[0].layout
+    primary_keys = tool.parse_primary_key_args([f"{layout.table}=@99"])
+    assert tool.resolve_primary_key(layout, primary_keys) == (1,)
+    assert '@99' in capsys.readouterr().err
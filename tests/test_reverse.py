@@ -0,0 +1,33 @@
+"""
+extract --reverse：按事务倒序输出恢复SQL，超出缓冲时分块写入临时文件
+"""
+import pytest
+
+import binlog_tool_rollback as tool
+from conftest import native_operations
+
+
+def expected_reverse(statements):
+    groups = []
+    for txn, sql in statements:
+        if not groups or groups[-1][0] != txn:
+            groups.append((txn, []))
+        groups[-1][1].append(sql)
+    expected = []
+    for _, sqls in reversed(groups):
+        expected.append('BEGIN;')
+        expected.extend(reversed(sqls))
+        expected.append('COMMIT;')
+    return expected
+
+
+@pytest.mark.parametrize('mode', ['deletes', 'updates', 'inserts'])
+def test_reverse_order(workload, tmp_path, mode):
+    statements = list(tool.iter_recovery_statements(native_operations(workload, flashback_mode=mode), mode,
+                                                    per_transaction=True))
+    assert statements
+    expected = expected_reverse(statements)
+    assert list(tool.reverse_sql_statements(iter(statements))) == expected
+    # 缓冲很小时分块写入临时文件，结果不变
+    spilled = tool.reverse_sql_statements(iter(statements), buffer_bytes=4096, spill_dir=str(tmp_path))
+    assert list(spilled) == expected
@@ -0,0 +1,17 @@
+"""
+--schema：表结构目录提供真实列名，与binlog列数不符时退回col_N
+"""
+import binlog_tool_rollback as tool
+
+
+def test_schema_mismatch_falls_back_to_col_n(text_lines):
+    # 去掉文本中的CREATE TABLE，结构只来自目录
+    lines = [line for line in text_lines if 'CREATE TABLE' not in line]
+    catalog = tool.SchemaCatalog()
+    catalog.load_json({'bench.t001': {'columns': ['a', 'b'], 'primary_key': ['a']},
+                       'bench.t002': {'columns': ['id', 'x1', 'x2', 'x3', 'x4', 'x5'], 'primary_key': ['id']}})
+    names = {}
+    for op in tool.iter_content_operations(iter(lines), flashback_mode=None, catalog=catalog):
+        names.setdefault(op.layout.table, op.layout.column_names)
+    assert names['t001'] is None
+    assert names['t002'] == ('id', 'x1', 'x2', 'x3', 'x4', 'x5')
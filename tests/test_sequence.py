@@ -0,0 +1,18 @@
+"""
+多个binlog文件按顺序读取：操作不丢失，不同文件的事务标识不重复
+"""
+import binlog_tool_rollback as tool
+from conftest import generate
+
+
+def test_multiple_workload_files(tmp_path):
+    first = generate(tmp_path, 'bench-bin.000001', rows=500, seed=2)
+    second = generate(tmp_path, 'bench-bin.000002', rows=500, seed=3)
+    operations = list(tool.iter_sequence_operations(
+        [(0, first['binlog'], None, None), (1, second['binlog'], None, None)],
+        (None, None, None, None, None, False, True, None), tool.new_filter_stats()))
+    assert len(operations) == first['counts']['rows'] + second['counts']['rows']
+    # 不同文件的事务标识不会相同
+    first_txns = {op.txn for op in operations[:first['counts']['rows']]}
+    second_txns = {op.txn for op in operations[first['counts']['rows']:]}
+    assert not first_txns & second_txns
@@ -0,0 +1,35 @@
+"""
+--split：在事件边界切分大binlog，各段结果拼起来与整个文件一致
+"""
+from collections import defaultdict
+
+import pytest
+
+import binlog_tool_rollback as tool
+from conftest import native_operations, op_key
+
+
+@pytest.mark.parametrize('parts', [2, 4, 7])
+def test_split_ranges_cover_file(workload, parts):
+    ranges = tool.plan_split_ranges(workload['binlog'], parts)
+    assert 1 < len(ranges) <= parts
+    assert ranges[0][0] is None and ranges[-1][1] is None
+    for (_, stop), (start, _) in zip(ranges, ranges[1:]):
+        assert stop == start
+
+    split_ops = []
+    for start, stop in ranges:
+        split_ops.extend(native_operations(workload, start, stop))
+    assert [op_key(op) for op in split_ops] == [op_key(op) for op in native_operations(workload)]
+
+
+def test_split_stats_match(workload):
+    whole = tool.collect_native_binlog_stats(workload['binlog'])
+    totals = defaultdict(lambda: [0, 0, 0])
+    for start, stop in tool.plan_split_ranges(workload['binlog'], 4):
+        for key, data in tool.collect_native_binlog_stats(workload['binlog'], start_position=start,
+                                                          stop_position=stop).items():
+            for n, counter in enumerate(tool.ACTIVITY_COUNTERS):
+                totals[key][n] += data[counter]
+    assert dict(totals) == {key: [data[counter] for counter in tool.ACTIVITY_COUNTERS]
+                            for key, data in whole.items()}